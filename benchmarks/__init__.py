@@ -0,0 +1,6 @@
+"""
+Benchmarks for :mod:`gcloudorm`. These run locally against an in-memory stand-in for the datastore and don't need
+access to Google Datastore. Run a benchmark with, for example, ``python -m benchmarks.bench_batch``, or all of them with
+``python -m benchmarks.run_all``. Results can be written as JSON (see :mod:`benchmarks.report`) and compared between
+versions with ``python -m benchmarks.compare``.
+"""
@@ -0,0 +1,64 @@
+"""
+Measure end-to-end save, lookup and delete throughput, one entity at a time and with
+:func:`gcloudorm.model.Model.save_multi`, :func:`gcloudorm.model.Model.filter` and
+:func:`gcloudorm.model.Model.delete_multi` at several batch sizes.
+"""
+from __future__ import print_function
+
+import argparse
+
+from gcloudorm import model, properties
+
+from . import memory, report
+
+
+class Person(model.Model):
+    name = properties.TextProperty()
+    age = properties.IntegerProperty()
+
+
+def _measure(case, count, latency, batch_size, func, people):
+    """Time ``func`` against a fresh datastore that already holds the entities, counting only its own RPCs."""
+    backend = memory.install(latency)
+    Person.save_multi(people, force=True)
+    backend.rpcs.clear()
+    elapsed = memory.timed(func, people)
+    return report.record('batch', case, count / elapsed, 'entities/s',
+                         {'count': count, 'latency': latency, 'batch_size': batch_size},
+                         seconds=elapsed, rpcs=sum(backend.rpcs.values()))
+
+
+def run(count, latency, batch_sizes):
+    memory.install(latency)
+    people = [Person(name=u'person %d' % i, age=i) for i in xrange(count)]
+    ids = [p.id for p in people]
+
+    results = [
+        _measure('save', count, latency, 1, lambda instances: [p.save(force=True) for p in instances], people),
+        _measure('get_by_id', count, latency, 1, lambda instances: [Person.get_by_id(i) for i in ids], people),
+        _measure('delete', count, latency, 1, lambda instances: [p.delete() for p in instances], people),
+    ]
+    for size in batch_sizes:
+        results += [
+            _measure('save_multi', count, latency, size,
+                     lambda instances: Person.save_multi(instances, batch_size=size, force=True), people),
+            _measure('filter', count, latency, size, lambda instances: Person.filter(ids, shard_size=size), people),
+            _measure('delete_multi', count, latency, size,
+                     lambda instances: Person.delete_multi(instances, batch_size=size), people),
+        ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=5000, help='number of entities to write')
+    parser.add_argument('--latency', type=float, default=0.001, help='simulated seconds per RPC')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 500],
+                        help='numbers of entities per RPC to try')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.count, args.latency, args.batch_sizes), args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare the compression codecs available to compressed properties on representative payloads: compression ratio, and
+encode/decode throughput through :mod:`gcloudorm.compression`.
+"""
+from __future__ import print_function
+
+import argparse
+import cPickle as pickle
+import json
+import os
+import random
+
+from gcloudorm import compression
+
+from . import memory, report
+
+
+def payloads():
+    rng = random.Random(0)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+    records = [{'id': i, 'name': rng.choice(words), 'score': rng.random(), 'tags': rng.sample(words, 3)}
+               for i in xrange(500)]
+    return [
+        ('tiny json', json.dumps({'a': 1})),
+        ('text 4KB', ' '.join(rng.choice(words) for _ in xrange(700))[:4096]),
+        ('json 50KB', json.dumps(records)[:50 * 1024]),
+        ('pickle', pickle.dumps(records, pickle.HIGHEST_PROTOCOL)),
+        ('random 16KB', os.urandom(16 * 1024)),
+    ]
+
+
+def settings():
+    """Generate (label, codec, level, min_size) combinations to compare."""
+    for name in compression.available_codecs():
+        yield name, name, None, 0
+    yield 'zlib-1', 'zlib', 1, 0
+    yield 'zlib-9', 'zlib', 9, 0
+    yield 'default', 'zlib', None, compression.DEFAULT_MIN_SIZE
+
+
+def run(repeat):
+    results = []
+    for label, data in payloads():
+        for name, codec, level, min_size in settings():
+            stored = compression.compress(data, codec, level, min_size)
+            encode = memory.timed(lambda: [compression.compress(data, codec, level, min_size) for _ in xrange(repeat)])
+            decode = memory.timed(lambda: [compression.decompress(stored) for _ in xrange(repeat)])
+            megabytes = len(data) * repeat / 1e6
+            params = {'payload': label, 'codec': name}
+            ratio = float(len(data)) / len(stored)
+            results += [
+                report.record('codecs', 'compress', megabytes / encode, 'MB/s', params, bytes=len(data), ratio=ratio),
+                report.record('codecs', 'decompress', megabytes / decode, 'MB/s', params, bytes=len(data), ratio=ratio),
+            ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200, help='number of times to encode/decode each payload')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.repeat), args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare building model instances with the encoder MetaModel compiles for each class against going through each
+property's descriptor, as ``Model.__init__`` used to.
+"""
+from __future__ import print_function
+
+import argparse
+
+from gcloudorm import model, properties
+
+from . import memory, report
+
+
+def make_model(count):
+    """Create a model class with ``count`` properties of assorted types."""
+    types = [properties.IntegerProperty, properties.FloatProperty, properties.TextProperty,
+             properties.BooleanProperty, properties.JsonProperty]
+    attrs = {'p%d' % i: types[i % len(types)]() for i in xrange(count)}
+    return type('Wide%d' % count, (model.Model,), attrs)
+
+
+def make_values(cls):
+    samples = {properties.IntegerProperty: 1, properties.FloatProperty: 1.5, properties.TextProperty: u'text',
+               properties.BooleanProperty: True, properties.JsonProperty: {'a': 1}}
+    return {name: samples[type(prop)] for name, prop in cls._properties.items() if not prop.is_id}
+
+
+def set_via_descriptors(instance, values):
+    """How Model.__init__ used to set property values."""
+    for attr in instance._properties:
+        setattr(instance, attr, getattr(instance, attr))
+    for name in instance._properties:
+        if name in values:
+            setattr(instance, name, values[name])
+
+
+def run(count, property_counts):
+    memory.install()
+    results = []
+    for n in property_counts:
+        cls = make_model(n)
+        values = make_values(cls)
+        instance = cls()
+
+        for case, func in [('descriptors', lambda: [set_via_descriptors(instance, values) for _ in xrange(count)]),
+                           ('compiled_encode', lambda: [cls._encode_values(values) for _ in xrange(count)]),
+                           ('compiled_decode', lambda: [cls._decode_values(instance, {}) for _ in xrange(count)]),
+                           ('__init__', lambda: [cls(**values) for _ in xrange(count)])]:
+            elapsed = memory.timed(func)
+            results.append(report.record('construction', case, count / elapsed, 'instances/s',
+                                         {'properties': n}, seconds=elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=5000, help='number of instances to build per run')
+    parser.add_argument('--properties', type=int, nargs='+', default=[5, 10, 30, 60],
+                        help='numbers of properties to try')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.count, args.properties), args.json)
+
+
+if __name__ == '__main__':
+    main()
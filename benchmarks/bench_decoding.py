@@ -0,0 +1,68 @@
+"""
+Measure how many entities per second :func:`gcloudorm.model.Model.filter` reads when every one has a large compressed
+JSON value that's then read, decompressing in-process and with :mod:`gcloudorm.decoding`'s process pool.
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import random
+
+from gcloudorm import decoding, model, properties
+
+from . import memory, report
+
+
+def _model(codec):
+    class Document(model.Model):
+        id = properties.IntegerProperty()
+        payload = properties.JsonProperty(compressed=True, codec=codec)
+    return Document
+
+
+def _payload(rng, size):
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+    return [{'i': i, 'word': rng.choice(words), 'score': rng.random()} for i in xrange(size // 50)]
+
+
+def run(count, size, codecs, processes):
+    rng = random.Random(0)
+    results = []
+    for codec in codecs:
+        memory.install()
+        Document = _model(codec)
+        Document.save_multi([Document(id=i, payload=_payload(rng, size)) for i in xrange(1, count + 1)])
+        ids = range(1, count + 1)
+
+        def read():
+            for obj in Document.filter(ids):
+                obj.payload
+
+        for case, workers in [('in-process', 0), ('parallel', processes)]:
+            if workers:
+                decoding.enable(processes=workers, min_bytes=0)
+            try:
+                read()  # Warm up the pool
+                elapsed = memory.timed(read)
+            finally:
+                decoding.disable()
+            results.append(report.record('decoding', case, count / elapsed, 'entities/s',
+                                         {'count': count, 'bytes': size, 'codec': codec, 'processes': workers},
+                                         seconds=elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=500, help='number of entities to read')
+    parser.add_argument('--size', type=int, default=50 * 1024, help='approximate bytes of JSON per entity')
+    parser.add_argument('--codecs', nargs='+', default=['zlib', 'bz2'], help='compression codecs to try')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.count, args.size, args.codecs, args.processes), args.json)
+
+
+if __name__ == '__main__':
+    main()
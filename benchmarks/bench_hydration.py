@@ -0,0 +1,74 @@
+"""
+Measure how many entities per second :func:`gcloudorm.model.Model.from_entity` hydrates, compared with building
+each instance through the constructor as it used to.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+
+from gcloud.datastore import entity, key
+
+from gcloudorm import model, properties
+
+from . import memory, report
+
+
+class Person(model.Model):
+    name = properties.TextProperty()
+    email = properties.TextProperty(indexed=True)
+    age = properties.IntegerProperty(default=0)
+    score = properties.FloatProperty()
+    active = properties.BooleanProperty(default=True)
+    joined = properties.DateTimeProperty()
+    tags = properties.TextProperty(repeated=True)
+    profile = properties.JsonProperty()
+
+
+def construct(cls, e):
+    """The hydration path from_entity used to take: run the constructor, then overwrite the values."""
+    kwargs = {name: e.get(name) for name, prop in cls._properties.items() if prop.is_id}
+    obj = cls(**kwargs)
+    obj._key = e.key
+
+    for name, prop in cls._properties.items():
+        if not prop.is_id:
+            obj[name] = e.get(name)
+
+    return obj
+
+
+def make_entities(count):
+    entities = []
+    for i in xrange(count):
+        p = Person(name=u'person %d' % i, email=u'%d@example.com' % i, age=i, score=i / 3.0,
+                   joined=datetime.datetime(2015, 1, 1), tags=[u'a', u'b'], profile={'i': i})
+        e = entity.Entity(key.Key('Person', p.id))
+        e.update(p)
+        entities.append(e)
+    return entities
+
+
+def run(count):
+    memory.install()
+    entities = make_entities(count)
+
+    results = []
+    for case, func in [('constructor', lambda: [construct(Person, e) for e in entities]),
+                       ('from_entity', lambda: [Person.from_entity(e) for e in entities])]:
+        elapsed = memory.timed(func)
+        results.append(report.record('hydration', case, count / elapsed, 'entities/s',
+                                     {'count': count, 'properties': len(Person._properties)}, seconds=elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000, help='number of entities to hydrate')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.count), args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure the memory taken by holding bulk read results as model instances compared with compact records (see
+:mod:`gcloudorm.records`). Each representation is measured in a fresh process, as the resident set size it grows by
+while the results are held.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import gc
+import multiprocessing
+import resource
+
+from gcloud.datastore import entity, key
+
+from gcloudorm import model, properties, records
+
+from . import memory, report
+
+
+class Event(model.Model):
+    name = properties.TextProperty(indexed=True)
+    count = properties.IntegerProperty()
+    score = properties.FloatProperty()
+    happened = properties.DateTimeProperty()
+    tags = properties.TextProperty(repeated=True)
+
+
+def _rss():
+    """The current resident set size in bytes."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _entities(count):
+    """Generate entities as they're read from the datastore, sharing nothing between rows."""
+    happened = datetime.datetime(2015, 1, 1)
+    for i in xrange(count):
+        e = entity.Entity(key.Key('Event', i))
+        e.update({'name': u'event %d' % i, 'count': i, 'score': i / 7.0,
+                  'happened': happened + datetime.timedelta(seconds=i), 'tags': [u'tag %d' % (i % 10)]})
+        yield e
+
+
+def _measure(case, count, queue):
+    memory.install()
+    hydrate = {
+        'entities': lambda e: e,
+        'models': Event.from_entity,
+        'records': records.record_class(Event).from_entity,
+    }[case]
+
+    gc.collect()
+    before = _rss()
+    results = [hydrate(e) for e in _entities(count)]
+    gc.collect()
+    queue.put(_rss() - before)
+    del results
+
+
+def run(count):
+    results = []
+    for case in ('entities', 'models', 'records'):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_measure, args=(case, count, queue))
+        process.start()
+        used = max(queue.get(), resource.getpagesize())
+        process.join()
+        # Rates are higher-is-better, so report rows per megabyte
+        results.append(report.record('memory', case, count / (used / 1e6), 'rows/MB', {'count': count},
+                                     megabytes=used / 1e6, bytes_per_row=used / float(count)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=1000000, help='number of rows to hold')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.count), args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure how many values per second each property type encodes (validates and converts to its stored form, as setting
+the attribute does) and decodes (converts back, as reading the attribute does).
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import random
+
+from gcloudorm import model, properties
+
+from . import memory, report
+
+
+def cases():
+    """Generate (name, property, value) for each case to measure."""
+    rng = random.Random(0)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+    text = u' '.join(rng.choice(words) for _ in xrange(200))
+    record = {'id': 1, 'name': u'name', 'scores': [rng.random() for _ in xrange(20)], 'tags': words}
+
+    yield 'integer', properties.IntegerProperty(), 42
+    yield 'float', properties.FloatProperty(), 4.2
+    yield 'boolean', properties.BooleanProperty(), True
+    yield 'text', properties.TextProperty(), text
+    yield 'text_compressed', properties.TextProperty(compressed=True), text
+    yield 'blob', properties.BlobProperty(), text.encode('utf-8') * 4
+    yield 'blob_compressed', properties.BlobProperty(compressed=True), text.encode('utf-8') * 4
+    yield 'pickle', properties.PickleProperty(), record
+    yield 'pickle_compressed', properties.PickleProperty(compressed=True), record
+    yield 'json', properties.JsonProperty(), record
+    yield 'json_compressed', properties.JsonProperty(compressed=True), record
+    yield 'datetime', properties.DateTimeProperty(), datetime.datetime(2015, 6, 1, 12, 30)
+    yield 'date', properties.DateProperty(), datetime.date(2015, 6, 1)
+    yield 'time', properties.TimeProperty(), datetime.time(12, 30)
+    yield 'repeated_integer', properties.IntegerProperty(repeated=True), range(20)
+    yield 'repeated_text', properties.TextProperty(repeated=True), words * 2
+
+
+def run(count):
+    memory.install()
+    results = []
+    for name, prop, value in cases():
+        cls = type(name.title().replace('_', ''), (model.Model,), {'value': prop})
+        instance = cls()
+
+        def encode():
+            for _ in xrange(count):
+                instance.value = value
+
+        def decode():
+            for _ in xrange(count):
+                instance._decoded.clear()  # Measure decoding rather than the memo
+                instance.value
+
+        encode_time = memory.timed(encode)
+        decode_time = memory.timed(decode)
+        stored = instance['value']
+        size = len(stored) if isinstance(stored, basestring) else None
+        results += [
+            report.record('properties', 'encode', count / encode_time, 'values/s', {'property': name}, bytes=size),
+            report.record('properties', 'decode', count / decode_time, 'values/s', {'property': name}, bytes=size),
+        ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000, help='number of values to encode and decode per type')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.count), args.json)
+
+
+if __name__ == '__main__':
+    main()
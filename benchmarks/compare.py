@@ -0,0 +1,51 @@
+"""
+Compare two JSON benchmark results, e.g. from before and after a change, and report the cases whose rate changed.
+Exits with status 1 if any case got slower by more than the threshold.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+
+from . import report
+
+
+def compare(baseline, current, threshold):
+    """
+    Match the records of two runs.
+
+    :param list baseline: the records to compare against.
+    :param list current: the new records.
+    :param float threshold: the fractional drop in rate that counts as a regression.
+    :return: a list of (record, relative change in rate, regressed?) for the records in both runs.
+    """
+    before = {report.identify(result): result for result in baseline}
+    changes = []
+    for result in current:
+        old = before.get(report.identify(result))
+        if old is None or not old['rate']:
+            continue
+        change = result['rate'] / old['rate'] - 1
+        changes.append((result, change, change < -threshold))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('baseline', help='JSON results to compare against')
+    parser.add_argument('current', help='JSON results of the new run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    changes = compare(report.load(args.baseline), report.load(args.current), args.threshold)
+    for result, change, regressed in changes:
+        params = ' '.join('%s=%s' % item for item in sorted(result['params'].items()))
+        print('%-12s %-22s %-34s %+7.1f%%%s' % (result['benchmark'], result['case'], params, change * 100,
+                                               '  REGRESSION' if regressed else ''))
+
+    sys.exit(1 if any(regressed for _, _, regressed in changes) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""
+Helpers for running the benchmarks against :class:`gcloudorm.backends.MemoryBackend`.
+"""
+import time
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends
+
+DATASET_ID = 'BENCHMARK'
+
+
+def install(latency=0.0):
+    """Make a new :class:`gcloudorm.backends.MemoryBackend` the current backend and return it."""
+    backend = backends.MemoryBackend(latency)
+    set_default_dataset_id(DATASET_ID)
+    backends.set_backend(backend)
+    return backend
+
+
+def timed(func, *args, **kwargs):
+    """Call ``func`` and return the number of seconds it took."""
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
@@ -0,0 +1,87 @@
+"""
+Machine-readable benchmark results.
+
+Each benchmark's ``run`` returns a list of records, one per measurement. A record is a dict with the name of the
+``benchmark``, the ``case`` measured, the ``params`` it was measured with, its ``rate`` (higher is better) and the
+``unit`` of the rate, plus any other metrics. Results can be printed as a table or written as JSON, and two JSON
+files can be compared with :mod:`benchmarks.compare`.
+"""
+from __future__ import print_function
+
+import json
+import platform
+import sys
+import time
+
+
+def record(benchmark, case, rate, unit, params=None, **metrics):
+    """
+    Make a result record.
+
+    :param str benchmark: the name of the benchmark.
+    :param str case: what was measured.
+    :param float rate: the measured throughput.
+    :param str unit: the unit of ``rate``, e.g. ``'entities/s'``.
+    :param dict params: the settings the case was measured with. Records are matched between runs by benchmark, case
+    and params.
+    :return: the record.
+    """
+    result = {'benchmark': benchmark, 'case': case, 'rate': rate, 'unit': unit, 'params': params or {}}
+    result.update(metrics)
+    return result
+
+
+def identify(result):
+    """
+    :return: a hashable identity for ``result`` that matches the same measurement in another run.
+    """
+    return result['benchmark'], result['case'], tuple(sorted(result['params'].items()))
+
+
+def document(results):
+    """
+    :return: the JSON document for ``results``, with details of the environment they were measured in.
+    """
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+        'results': results,
+    }
+
+
+def add_arguments(parser):
+    """Add the output options to a benchmark's argument parser."""
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON to PATH, or stdout for "-"')
+
+
+def output(results, path=None):
+    """
+    Print ``results`` as a table, or write them as JSON if ``path`` is given.
+
+    :param list results: the records to output.
+    :param str path: the file to write JSON to, ``'-'`` for stdout, or None for a table.
+    """
+    if path is None:
+        print_table(results)
+    elif path == '-':
+        json.dump(document(results), sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(path, 'w') as f:
+            json.dump(document(results), f, indent=2, sort_keys=True)
+
+
+def load(path):
+    """
+    :return: the records in a JSON document written by :func:`output`.
+    """
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def print_table(results):
+    for result in results:
+        params = ' '.join('%s=%s' % item for item in sorted(result['params'].items()))
+        print('%-12s %-22s %-34s %14.1f %s' % (result['benchmark'], result['case'], params, result['rate'],
+                                               result['unit']))
@@ -0,0 +1,47 @@
+"""
+Run every benchmark and output the combined results, e.g. to compare versions:
+
+    python -m benchmarks.run_all --json before.json
+    ... change things ...
+    python -m benchmarks.run_all --json after.json
+    python -m benchmarks.compare before.json after.json
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+
+from . import (bench_batch, bench_codecs, bench_construction, bench_decoding, bench_hydration, bench_memory,
+               bench_properties, report)
+
+
+def run(scale):
+    """
+    Run the benchmarks with their default sizes multiplied by ``scale``.
+
+    :return: the combined records.
+    """
+    def scaled(n):
+        return max(1, int(n * scale))
+
+    results = []
+    results += bench_construction.run(scaled(5000), [5, 10, 30, 60])
+    results += bench_hydration.run(scaled(20000))
+    results += bench_properties.run(scaled(20000))
+    results += bench_codecs.run(scaled(200))
+    results += bench_decoding.run(scaled(500), 50 * 1024, ['zlib', 'bz2'], multiprocessing.cpu_count())
+    results += bench_batch.run(scaled(5000), 0.001, [10, 100, 500])
+    results += bench_memory.run(scaled(200000))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the amount of work per case')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    report.output(run(args.scale), args.json)
+
+
+if __name__ == '__main__':
+    main()
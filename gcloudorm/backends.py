@@ -0,0 +1,295 @@
+"""
+Backends are what :class:`gcloudorm.model.Model` reads and writes entities through. The default,
+:class:`GCloudBackend`, talks to Google Datastore using gcloud-python. :class:`MemoryBackend` keeps entities in
+process, which is handy for tests and for load testing code against a simulated datastore latency:
+
+    from gcloudorm import backends
+
+    backends.set_backend(backends.MemoryBackend(latency=0.02))
+
+Backends deal in :class:`gcloud.datastore.entity.Entity` objects holding values in their stored form, and
+:class:`gcloud.datastore.key.Key` objects.
+"""
+from __future__ import absolute_import
+
+import collections
+import copy
+import itertools
+import operator
+import threading
+import time
+
+import httplib2
+from gcloud.datastore import _implicit_environ, api, batch, connection, entity, key, query
+
+
+class Backend(object):
+    """
+    The interface of a backend. Each method corresponds to one RPC.
+
+    This class shouldn't be used directly. Instead, it is intended to be extended by concrete backend implementations.
+    """
+    # Can methods be called from several threads at once? If not, :class:`gcloudorm.ids.IdPool` reserves ids on the
+    # calling thread rather than in the background.
+    thread_safe = False
+
+    def get(self, keys):
+        """
+        Look entities up by key.
+
+        :param list keys: the keys to fetch.
+        :return: a list with the entity for each key, in the same order as ``keys``, and None for missing entities.
+        """
+        raise NotImplementedError
+
+    def put(self, entities):
+        """
+        Write entities, replacing any existing entities with the same keys.
+
+        :param list entities: the entities to write.
+        """
+        raise NotImplementedError
+
+    def delete(self, keys):
+        """
+        Remove entities. Keys without an entity are ignored.
+
+        :param list keys: the keys of the entities to remove.
+        """
+        raise NotImplementedError
+
+    def run_query(self, query, projection=(), limit=None, offset=0, start_cursor=None):
+        """
+        Fetch a page of query results.
+
+        :param Query query: a :class:`gcloudorm.query.Query`. Its filter values are already in stored form.
+        :param tuple projection: names of the properties to return, ``('__key__',)`` for keys only, or empty for
+        whole entities.
+        :param int limit: the maximum number of entities to return.
+        :param int offset: the number of results to skip.
+        :param str start_cursor: a cursor returned by an earlier call to resume from.
+        :return: a tuple of (entities, whether there are more results, cursor after the last entity).
+        """
+        raise NotImplementedError
+
+    def allocate_ids(self, kind, count):
+        """
+        Reserve integer ids for new entities of a kind, which the datastore won't assign to any other entity.
+
+        :param str kind: the kind to reserve ids for.
+        :param int count: the number of ids to reserve.
+        :return: a list of the reserved ids.
+        """
+        raise NotImplementedError
+
+
+class GCloudBackend(Backend):
+    """
+    Reads and writes Google Datastore through gcloud-python's default connection and dataset.
+
+    The default connection sends requests through a single :class:`httplib2.Http`, which isn't thread-safe, so only
+    the first thread to make an RPC through it uses it as it is. Other threads get their own copy of the connection,
+    with the same credentials and HTTP settings such as the timeout and proxy. Threads in a batch or transaction use
+    its connection, as gcloud-python would.
+    """
+    thread_safe = True
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._owner = (None, None)  # The default connection and the thread that uses it as it is
+
+    def _connection(self):
+        """:return: the connection for the current thread to use, or None to let gcloud-python pick one."""
+        default = _implicit_environ.CONNECTION
+        if batch.Batch.current() is not None or not isinstance(default, connection.Connection):
+            return None  # Stand-ins for the connection are shared
+        local = self._local
+        if getattr(local, 'default', None) is not default:
+            with self._lock:
+                if self._owner[0] is not default:
+                    self._owner = (default, threading.current_thread())
+                owned = self._owner[1] is threading.current_thread()
+            local.connection = default if owned else _copy_connection(default)
+            local.default = default
+        return local.connection
+
+    def get(self, keys):
+        # The datastore doesn't return entities in the order they were requested.
+        entities = {e.key.flat_path: e for e in api.get(keys, connection=self._connection())}
+        return [entities.get(k.flat_path) for k in keys]
+
+    def put(self, entities):
+        api.put(entities, connection=self._connection())
+
+    def delete(self, keys):
+        api.delete(keys, connection=self._connection())
+
+    def run_query(self, query, projection=(), limit=None, offset=0, start_cursor=None):
+        gquery = _gcloud_query(query, projection)
+        return gquery.fetch(limit=limit, offset=offset, start_cursor=start_cursor,
+                            connection=self._connection()).next_page()
+
+    def allocate_ids(self, kind, count):
+        return [k.id for k in api.allocate_ids(key.Key(kind), count, connection=self._connection())]
+
+
+def _copy_connection(conn):
+    """Copy a connection for another thread, with an HTTP transport of its own if it has one."""
+    copied = copy.copy(conn)  # Keeps the attributes of subclasses, whatever their constructors take
+    http = conn._http
+    if isinstance(http, httplib2.Http):
+        copied._http = copy.copy(http)  # Without its open connections, or the request method credentials wrap
+        if 'request' in vars(http):
+            credentials = getattr(http.request, 'credentials', conn.credentials)
+            if credentials is not None:
+                copied._http = credentials.authorize(copied._http)
+    return copied  # Other transports are shared, as they can't be copied in general
+
+
+def _gcloud_query(q, projection):
+    return query.Query(kind=q.model.__name__, ancestor=q.ancestor, filters=q.filters, order=q.orders,
+                       projection=projection)
+
+
+_OPERATORS = {'=': operator.eq, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class MemoryBackend(Backend):
+    """
+    A thread-safe, in-process datastore. Entities are kept in a dict keyed by namespace and key path, and copied on the
+    way in and out. Queries support everything :class:`gcloudorm.query.Query` can express.
+
+    Every RPC can be delayed by ``latency`` seconds to simulate the round trip to a real datastore. The number of RPCs
+    made of each type is counted in :attr:`rpcs`.
+    """
+    thread_safe = True
+
+    def __init__(self, latency=0.0):
+        """
+        Initialise an empty backend.
+
+        :param float latency: the number of seconds each RPC takes. Defaults to 0.
+        """
+        self.latency = latency
+        self.rpcs = collections.Counter()
+        self._entities = {}
+        self._allocated = collections.Counter()  # kind: the last id reserved
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entities)
+
+    def _rpc(self, name):
+        with self._lock:
+            self.rpcs[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get(self, keys):
+        self._rpc('get')
+        with self._lock:
+            found = [self._entities.get(_path(k)) for k in keys]
+        return [_copy(e) if e is not None else None for e in found]
+
+    def put(self, entities):
+        self._rpc('put')
+        copies = [(_path(e.key), _copy(e)) for e in entities]
+        with self._lock:
+            self._entities.update(copies)
+
+    def delete(self, keys):
+        self._rpc('delete')
+        with self._lock:
+            for k in keys:
+                self._entities.pop(_path(k), None)
+
+    def run_query(self, query, projection=(), limit=None, offset=0, start_cursor=None):
+        self._rpc('query')
+        kind, namespace = query.model.__name__, query.ancestor.namespace if query.ancestor else None
+        with self._lock:
+            results = [e for (ns, path), e in sorted(self._entities.items())
+                       if ns == namespace and path[-2] == kind]
+
+        if query.ancestor is not None:
+            ancestor = query.ancestor.flat_path
+            results = [e for e in results if e.key.flat_path[:len(ancestor)] == ancestor]
+
+        for name, op, value in query.filters:
+            compare = _OPERATORS[op]
+            results = [e for e in results if any(compare(v, value) for v in _values(e, name))]
+
+        for name in reversed(query.orders):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            results = [e for e in results if name in e]
+            results.sort(key=lambda e: _values(e, name), reverse=descending)
+
+        if projection:
+            results = list(_project(results, projection))
+
+        start = (int(start_cursor) if start_cursor else 0) + offset
+        end = len(results) if limit is None else min(start + limit, len(results))
+        return [_copy(e) for e in results[start:end]], end < len(results), str(end)
+
+    def allocate_ids(self, kind, count):
+        self._rpc('allocate_ids')
+        with self._lock:
+            last = self._allocated[kind]
+            self._allocated[kind] += count
+        return range(last + 1, last + count + 1)
+
+
+def _path(k):
+    return k.namespace, k.flat_path
+
+
+def _copy(e):
+    copy = entity.Entity(e.key, exclude_from_indexes=e.exclude_from_indexes)
+    copy.update((name, list(value) if isinstance(value, list) else value) for name, value in e.items())
+    return copy
+
+
+def _values(e, name):
+    value = e.get(name)
+    return value if isinstance(value, list) else [value]
+
+
+def _project(entities, projection):
+    """Generate the projection of each entity, once for each combination of values of repeated properties."""
+    for e in entities:
+        if projection == ('__key__',):
+            yield entity.Entity(e.key)
+            continue
+
+        if any(name not in e for name in projection):
+            continue  # Entities without a projected property aren't in its index
+        for values in itertools.product(*[_values(e, name) for name in projection]):
+            projected = entity.Entity(e.key)
+            projected.update(zip(projection, values))
+            yield projected
+
+
+_backend = None
+
+
+def get_backend():
+    """
+    :return: the backend models currently use. Defaults to a :class:`GCloudBackend`.
+    """
+    global _backend
+
+    if _backend is None:
+        _backend = GCloudBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Set the backend models use.
+
+    :param Backend backend: the new backend, or None to go back to the default.
+    """
+    global _backend
+
+    _backend = backend
@@ -0,0 +1,172 @@
+"""
+Write-behind batching for :func:`gcloudorm.model.Model.save` and :func:`gcloudorm.model.Model.delete`. Within a
+:func:`batch` block, saves and deletes made on the current thread are queued rather than sent one RPC at a time, and
+written together in as few RPCs as possible. For example:
+
+    from gcloudorm import batcher
+
+    with batcher.batch():
+        handle_request()  # Calls save() and delete() from all over the place
+
+Writes to the same key are merged, so an instance saved several times is only written once, and the last of a save
+and a delete of the same key wins. Queued writes are flushed when the queue reaches ``max_size`` keys, when a write is
+queued more than ``max_delay`` seconds after the oldest pending one, on :func:`WriteBatcher.flush` and when the block
+exits, even if it raised.
+
+Queued instances are written as they are when the queue is flushed, not as they were when saved. Reads don't see
+queued writes until they're flushed.
+"""
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+
+# The maximum number of keys queued before a flush unless told otherwise. Matches the datastore's limit on mutations
+# per commit.
+DEFAULT_MAX_SIZE = 500
+
+_local = threading.local()
+
+# A queued write that failed. instance is None for deletes.
+WriteError = collections.namedtuple('WriteError', ['operation', 'key', 'instance', 'error'])
+
+
+class BatchWriteError(Exception):
+    """Some of the writes queued in a :func:`batch` failed. :attr:`errors` is a list of :class:`WriteError`."""
+    def __init__(self, errors):
+        super(BatchWriteError, self).__init__('%d queued writes failed, the first with: %r' % (
+            len(errors), errors[0].error))
+        self.errors = errors
+
+
+class WriteBatcher(object):
+    """
+    Queues writes and sends them in batches. Use :func:`batch` to queue the saves and deletes of a block of code.
+
+    The datastore applies each batch as a whole, so when a batch fails a :class:`WriteError` is reported for each of
+    its writes. Other batches are still written. Errors are collected in :attr:`errors`.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_delay=None, raise_errors=True):
+        """
+        Initialise a batcher.
+
+        :param int max_size: the number of keys to queue before flushing. Also the maximum size of each RPC.
+        :param float max_delay: the number of seconds writes can wait in the queue. Checked as each write is queued.
+        Defaults to None, meaning no limit.
+        :param bool raise_errors: raise a :class:`BatchWriteError` at the end of the block if any writes failed?
+        Defaults to True.
+        """
+        if max_size < 1:
+            raise ValueError('Batch size must be at least 1.')
+
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.raise_errors = raise_errors
+        self.errors = []
+        # (namespace, key path): (instance or None for a delete, key, force)
+        self._pending = collections.OrderedDict()
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def save(self, instance, force=False):
+        """
+        Queue a save of ``instance``. See :func:`gcloudorm.model.Model.save`.
+
+        :param Model instance: the instance to save.
+        :param bool force: save even if the instance hasn't changed when the queue is flushed?
+        """
+        path = (instance._key.namespace, instance._key.flat_path)
+        queued = self._pending.pop(path, None)
+        if queued is not None and queued[0] is not None:
+            force = force or queued[2]
+        self._queue(path, (instance, instance._key, force))
+
+    def delete(self, k):
+        """
+        Queue a delete of the entity with key ``k``.
+
+        :param Key k: the key of the entity to delete.
+        """
+        path = (k.namespace, k.flat_path)
+        self._pending.pop(path, None)
+        self._queue(path, (None, k, False))
+
+    def flush(self):
+        """
+        Write everything queued.
+
+        :return: a list of :class:`WriteError` for the writes that failed in this flush.
+        """
+        from .model import _chunks, _delete, _put
+
+        pending, self._pending, self._oldest = self._pending.values(), collections.OrderedDict(), None
+        errors = []
+
+        saves = []
+        for instance, k, force in pending:
+            try:
+                if instance is not None and instance._prepare_for_put(force):
+                    saves.append(instance)
+            except Exception as e:
+                errors.append(WriteError('save', k, instance, e))
+
+        for batch in _chunks(saves, self.max_size):
+            try:
+                _put(batch, len(batch), 'save_multi')
+            except Exception as e:
+                errors += [WriteError('save', instance.key, instance, e) for instance in batch]
+
+        deletes = [k for instance, k, force in pending if instance is None]
+        for batch in _chunks(deletes, self.max_size):
+            try:
+                _delete(batch, len(batch), 'delete_multi')
+            except Exception as e:
+                errors += [WriteError('delete', k, None, e) for k in batch]
+
+        self.errors += errors
+        return errors
+
+    def __enter__(self):
+        stack = getattr(_local, 'batchers', None)
+        if stack is None:
+            stack = _local.batchers = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.batchers.remove(self)
+        self.flush()
+        if exc_type is None and self.errors and self.raise_errors:
+            raise BatchWriteError(self.errors)
+
+    def _queue(self, path, write):
+        now = time.time()
+        if self._oldest is None:
+            self._oldest = now
+        self._pending[path] = write
+
+        if len(self._pending) >= self.max_size or \
+                (self.max_delay is not None and now - self._oldest >= self.max_delay):
+            self.flush()
+
+
+def batch(max_size=DEFAULT_MAX_SIZE, max_delay=None, raise_errors=True):
+    """
+    Queue the saves and deletes made on the current thread within a ``with`` block. See :class:`WriteBatcher` for the
+    arguments. If the block raises, the queue is still flushed but write errors are left in
+    :attr:`WriteBatcher.errors` rather than raised over the block's exception.
+
+    :return: the :class:`WriteBatcher`.
+    """
+    return WriteBatcher(max_size, max_delay, raise_errors)
+
+
+def current_batcher():
+    """
+    :return: the innermost :class:`WriteBatcher` active on the current thread, or None.
+    """
+    stack = getattr(_local, 'batchers', None)
+    return stack[-1] if stack else None
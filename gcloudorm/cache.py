@@ -0,0 +1,409 @@
+"""
+Caches for model instances: an in-process LRU cache (see :func:`gcloudorm.model.Model.enable_cache`), and a cache
+shared between processes (see :func:`gcloudorm.model.Model.enable_shared_cache`).
+"""
+import base64
+import calendar
+import collections
+import contextlib
+import datetime
+import errno
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+
+import pytz
+from gcloud.datastore import entity, key
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping with a maximum size that evicts the least recently used entries first. Entries can optionally
+    expire ``ttl`` seconds after they were set. Useful counters are:
+
+    * :attr:`hits` the number of lookups that found a live entry.
+    * :attr:`misses` the number of lookups that found nothing or an expired entry.
+    * :attr:`evictions` the number of entries dropped to make room for new ones.
+    """
+    def __init__(self, max_size=1000, ttl=None):
+        """
+        Initialise the cache.
+
+        :param int max_size: the maximum number of entries to hold. Defaults to 1000.
+        :param float ttl: the number of seconds an entry lives for. Defaults to None, meaning entries don't expire.
+        """
+        if max_size < 1:
+            raise ValueError('The cache size must be at least 1.')
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, k):
+        return k in self._entries
+
+    def get(self, k, default=None):
+        """
+        Get the value for ``k``, marking it as the most recently used entry.
+
+        :param k: the key to look up.
+        :param default: what to return if there is no live entry for ``k``.
+        :return: the cached value or ``default``.
+        """
+        with self._lock:
+            entry = self._entries.pop(k, None)
+            if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+                self.misses += 1
+                return default
+
+            self._entries[k] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, k, value):
+        """
+        Store ``value`` for ``k``, evicting the least recently used entry if the cache is full.
+
+        :param k: the key to store the value under.
+        :param value: the value to store.
+        """
+        expires = time.time() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            self._entries.pop(k, None)
+            self._entries[k] = (value, expires)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, k):
+        """Remove the entry for ``k`` if there is one."""
+        with self._lock:
+            self._entries.pop(k, None)
+
+    def clear(self):
+        """Remove all entries. The counters are left untouched."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: a dict with the ``hits``, ``misses`` and ``evictions`` counters and the current ``size``.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries)}
+
+
+# Cached in a shared store in place of an entity that doesn't exist.
+NOT_FOUND = object()
+
+# The number of seconds that an entity doesn't exist is cached for unless told otherwise. Entities created by writers
+# that don't use the cache stay invisible to readers that do for this long.
+DEFAULT_NEGATIVE_TTL = 10
+
+
+class SharedStore(object):
+    """
+    Storage for a :class:`SharedCache` that every process on a host can reach. Values are bytes, and each key has a
+    version that :func:`invalidate_many` increments. :func:`add_many` only stores a value if the key's version hasn't
+    changed since it was read, so a value read from the datastore before a write can't be cached after the write has
+    invalidated it. Keys that have never been invalidated are at version 0.
+
+    This class shouldn't be used directly. Instead, it is intended to be extended by concrete store implementations.
+    """
+    def get_many(self, keys):
+        """
+        Look up the values of keys.
+
+        :param list keys: the string keys to look up.
+        :return: a list with a (version, value) pair for each key, in the same order as ``keys``. The value is None if
+        there isn't one, or it has expired.
+        """
+        raise NotImplementedError
+
+    def add_many(self, items, ttl=None):
+        """
+        Store values for keys whose version is still as it was read.
+
+        :param list items: (key, version, value) triples.
+        :param float ttl: the number of seconds the values are kept for. Defaults to the store's own.
+        """
+        raise NotImplementedError
+
+    def invalidate_many(self, keys):
+        """
+        Remove the values of keys and increment their versions.
+
+        :param list keys: the string keys to invalidate.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all values and versions."""
+        raise NotImplementedError
+
+
+class SQLiteStore(SharedStore):
+    """
+    A :class:`SharedStore` in an SQLite database, by default in ``/dev/shm`` so it lives in memory. Every process and
+    thread opens its own connection to the same file. Values and invalidations expire after ``ttl`` seconds, which also
+    bounds how long an entry can be stale if it's changed outside of this cache.
+
+    Anyone who can write to the database can change what every process reads, so it must belong to the current user
+    and be inaccessible to anyone else. A new database is created that way, and an existing one that isn't is refused.
+    """
+    def __init__(self, path=None, ttl=3600, prune_every=1000):
+        """
+        Open or create a store.
+
+        :param str path: the database file. Defaults to ``cache.sqlite`` in a directory of ``/dev/shm`` (if it exists,
+        or the temporary directory otherwise) that only the current user can access.
+        :param float ttl: the number of seconds values and invalidations are kept for. Defaults to an hour.
+        :param int prune_every: remove expired entries after this many calls to :func:`add_many`.
+        :raises ValueError: if the database, or the default directory, belongs to another user or can be accessed by
+        other users.
+        """
+        if path is None:
+            path = os.path.join(_private_directory(), 'cache.sqlite')
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        for name in (path, path + '-wal', path + '-shm'):
+            if os.path.lexists(name):
+                _check_private(name)
+
+        self.path = path
+        self.ttl = ttl
+        self._prune_every = prune_every
+        self._adds = 0
+        self._local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS entries '
+                                   '(key TEXT PRIMARY KEY, version INTEGER NOT NULL, value BLOB, expires REAL)')
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        connection = self._connection()
+        for start in xrange(0, len(keys), _SQL_VARIABLES):
+            chunk = keys[start:start + _SQL_VARIABLES]
+            rows = connection.execute('SELECT key, version, value, expires FROM entries WHERE key IN (%s)' %
+                                      ', '.join('?' * len(chunk)), chunk)
+            for k, version, value, expires in rows:
+                found[k] = (version, str(value) if value is not None and expires > now else None)
+
+        return [found.get(k, (0, None)) for k in keys]
+
+    def add_many(self, items, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._transaction() as connection:
+            for k, version, value in items:
+                updated = connection.execute('UPDATE entries SET value = ?, expires = ? WHERE key = ? AND version = ?',
+                                             (sqlite3.Binary(value), expires, k, version)).rowcount
+                if not updated and version == 0:
+                    connection.execute('INSERT OR IGNORE INTO entries VALUES (?, 0, ?, ?)',
+                                       (k, sqlite3.Binary(value), expires))
+
+        self._adds += 1
+        if self._adds % self._prune_every == 0:
+            self.prune()
+
+    def invalidate_many(self, keys):
+        expires = time.time() + self.ttl
+        with self._transaction() as connection:
+            for k in keys:
+                updated = connection.execute('UPDATE entries SET version = version + 1, value = NULL, expires = ? '
+                                             'WHERE key = ?', (expires, k)).rowcount
+                if not updated:
+                    connection.execute('INSERT OR IGNORE INTO entries VALUES (?, 1, NULL, ?)', (k, expires))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM entries')
+
+    def prune(self):
+        """Remove expired entries."""
+        self._connection().execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+
+    def _connection(self):
+        # Connections can't be shared between threads, or survive a fork.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or connection[0] != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            connection = self._local.connection = (os.getpid(), db)
+        return connection[1]
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+
+# The number of keys looked up per SQL statement, below SQLite's limit on variables.
+_SQL_VARIABLES = 500
+
+
+def _private_directory():
+    """:return: a directory for the current user's caches, creating it if need be."""
+    directory = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                             'gcloudorm-%d' % os.getuid())
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    _check_private(directory)
+    return directory
+
+
+def _check_private(path):
+    """Raise ValueError unless path belongs to the current user, isn't a link and can't be accessed by anyone else."""
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise ValueError('%s must belong to the current user and be inaccessible to other users.' % path)
+
+
+class SharedCache(object):
+    """
+    A cache of entities in their stored form in a :class:`SharedStore`, so processes can share what they've read.
+    Entities found not to exist are cached too, as :data:`NOT_FOUND`, but only for ``negative_ttl`` seconds. See
+    :func:`gcloudorm.model.Model.enable_shared_cache`. Useful counters are:
+
+    * :attr:`hits` the number of lookups that found an entity.
+    * :attr:`negative_hits` the number of lookups that found an entity doesn't exist.
+    * :attr:`misses` the number of lookups that found nothing.
+    """
+    def __init__(self, store, negative=True, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """
+        Initialise the cache.
+
+        :param SharedStore store: where to keep the entities.
+        :param bool negative: cache that entities don't exist? Defaults to True.
+        :param float negative_ttl: the number of seconds that an entity doesn't exist is cached for. Defaults to
+        :data:`DEFAULT_NEGATIVE_TTL`.
+        """
+        self.store = store
+        self.negative = negative
+        self.negative_ttl = negative_ttl
+        self.hits = self.negative_hits = self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Look entities up.
+
+        :param list keys: the :class:`gcloud.datastore.key.Key` of each entity.
+        :return: a pair of lists aligned with keys: the entity, :data:`NOT_FOUND` or None for each key, and the versions
+        to pass to :func:`add_many`.
+        """
+        entries = self.store.get_many([_cache_key(k) for k in keys])
+        results = []
+        for k, (version, value) in zip(keys, entries):
+            if value is None:
+                self.misses += 1
+                results.append(None)
+                continue
+
+            values = _loads(value)
+            if values is None:
+                self.negative_hits += 1
+                results.append(NOT_FOUND)
+            else:
+                self.hits += 1
+                e = entity.Entity(k)
+                e.update(values)
+                results.append(e)
+        return results, [version for version, value in entries]
+
+    def add_many(self, keys, entities, versions):
+        """
+        Cache the entities read for keys.
+
+        :param list keys: the key of each entity.
+        :param list entities: the entity read for each key, or None if it doesn't exist.
+        :param list versions: the version of each key returned by :func:`get_many` before the entities were read.
+        """
+        items, missing = [], []
+        for k, e, version in zip(keys, entities, versions):
+            if e is None:
+                if self.negative:
+                    missing.append((_cache_key(k), version, _dumps(None)))
+                continue
+            try:
+                items.append((_cache_key(k), version, _dumps(e)))
+            except ValueError:
+                pass  # Entities with values that can't be cached are read from the datastore every time
+        if items:
+            self.store.add_many(items)
+        if missing:
+            self.store.add_many(missing, self.negative_ttl)
+
+    def invalidate_many(self, keys):
+        """Drop the entries for keys, in every process."""
+        self.store.invalidate_many([_cache_key(k) for k in keys])
+
+    def stats(self):
+        """
+        :return: a dict with the ``hits``, ``negative_hits`` and ``misses`` counters.
+        """
+        return {'hits': self.hits, 'negative_hits': self.negative_hits, 'misses': self.misses}
+
+
+def _cache_key(k):
+    return repr((k.dataset_id, k.namespace, k.flat_path))
+
+
+# Entities are cached as JSON, rather than pickles, so a value planted in a store can't run code when it's read. Stored
+# values JSON doesn't represent exactly are tagged: bytes as {"b": base64}, datetimes as {"t": microseconds since the
+# epoch, "z": whether it's in UTC rather than naive} and keys as {"k": flat path, "n": namespace, "d": dataset id}.
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _dumps(e):
+    return json.dumps({name: _to_json(value) for name, value in e.items()} if e is not None else None,
+                      separators=(',', ':'))
+
+
+def _loads(value):
+    values = json.loads(value)
+    return {name: _from_json(v) for name, v in values.items()} if values is not None else None
+
+
+def _to_json(value):
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    if isinstance(value, str):
+        return {'b': base64.b64encode(value)}
+    if isinstance(value, datetime.datetime):
+        aware = value.tzinfo is not None
+        if aware:
+            value = value.astimezone(pytz.utc)
+        return {'t': calendar.timegm(value.timetuple()) * 1000000 + value.microsecond, 'z': aware}
+    if isinstance(value, key.Key):
+        return {'k': list(value.flat_path), 'n': value.namespace, 'd': value.dataset_id}
+    if value is None or isinstance(value, (bool, int, long, float, unicode)):
+        return value
+    raise ValueError("Can't cache a value of type %s." % type(value).__name__)
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if 'b' in value:
+        return base64.b64decode(value['b'])
+    if 't' in value:
+        result = _EPOCH + datetime.timedelta(microseconds=value['t'])
+        return result.replace(tzinfo=pytz.utc) if value['z'] else result
+    return key.Key(*value['k'], namespace=value['n'], dataset_id=value['d'])
@@ -0,0 +1,127 @@
+"""
+Columnar results for analytics. Rather than building an object per result and copying attributes out of each,
+property values are decoded a batch at a time into a NumPy array per property. For example:
+
+    columns = Person.query().filter('age', '>=', 18).fetch().to_columns(['age', 'score'])
+    columns['score'].mean()
+
+Each column is a :class:`numpy.ma.MaskedArray`, masked where the value is missing. The column types are:
+
+* :class:`gcloudorm.properties.IntegerProperty`: int64
+* :class:`gcloudorm.properties.FloatProperty`: float64
+* :class:`gcloudorm.properties.BooleanProperty`: bool
+* :class:`gcloudorm.properties.DateTimeProperty`: datetime64[us], in UTC
+* :class:`gcloudorm.properties.DateProperty`: datetime64[D]
+* :class:`gcloudorm.properties.TimeProperty`: timedelta64[us] since midnight
+* Everything else, and repeated properties: object arrays of the decoded values
+
+NumPy is an optional dependency, install it with ``pip install gcloudorm[numpy]``.
+"""
+from __future__ import absolute_import
+
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .properties import (BooleanProperty, DateProperty, DateTimeProperty, FloatProperty, IntegerProperty,
+                         TimeProperty)
+from .records import Record
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_columns(model, rows, names=None):
+    """
+    Decode the property values of ``rows`` into a column per property.
+
+    :param Model model: the model class the rows are of.
+    :param list rows: entities read from the datastore, model instances or :class:`gcloudorm.records.Record` objects.
+    :param list names: the names of the properties to decode. Defaults to all of them.
+    :return: a dict of property name to :class:`numpy.ma.MaskedArray`.
+    :raises ImportError: if NumPy isn't installed.
+    :raises ValueError: if a name isn't a property of the model.
+    """
+    if numpy is None:
+        raise ImportError('Columnar results need NumPy, install it with pip install numpy.')
+
+    rows = list(rows)
+    names = sorted(model._properties) if names is None else list(names)
+    for name in names:
+        if name not in model._properties:
+            raise ValueError('%s has no property %r.' % (model.__name__, name))
+
+    columns = {}
+    for name in names:
+        values = _stored_values(model, rows, name)
+        columns[name] = _column(model._properties[name], values)
+    return columns
+
+
+def concatenate(parts, names):
+    """
+    Join the columns of several batches of results, e.g. the pages of a query.
+
+    :param list parts: dicts of columns from :func:`to_columns`.
+    :param list names: the names of the columns.
+    :return: a dict of property name to the joined column.
+    """
+    if numpy is None:
+        raise ImportError('Columnar results need NumPy, install it with pip install numpy.')
+    if len(parts) == 1:
+        return parts[0]
+    return {name: numpy.ma.concatenate([part[name] for part in parts]) for name in names}
+
+
+def _stored_values(model, rows, name):
+    if rows and isinstance(rows[0], Record):
+        get_value = dict(type(rows[0])._getters)[name]
+        values = [get_value(row) for row in rows]
+    else:
+        values = [row.get(name) for row in rows]
+
+    if name == model._id_prop:  # The id falls back to the key's, as in Model.from_entity
+        values = [row.key.id_or_name if value is None else value for row, value in zip(rows, values)]
+    return values
+
+
+def _column(prop, values):
+    """Decode the stored values of prop into a masked array."""
+    mask = numpy.fromiter((value is None for value in values), dtype=bool, count=len(values))
+
+    if prop._repeated:
+        return _objects([[prop.from_base_type(v) for v in value] if value is not None else None
+                         for value in values], mask)
+    if isinstance(prop, IntegerProperty):
+        data = numpy.array([0 if value is None else value for value in values], dtype=numpy.int64)
+    elif isinstance(prop, FloatProperty):
+        data = numpy.array([numpy.nan if value is None else value for value in values], dtype=numpy.float64)
+    elif isinstance(prop, BooleanProperty):
+        data = numpy.array([False if value is None else value for value in values], dtype=bool)
+    elif isinstance(prop, DateProperty):
+        data = numpy.array([_naive(value) for value in values], dtype='datetime64[us]').astype('datetime64[D]')
+    elif isinstance(prop, TimeProperty):
+        data = numpy.array([_naive(value) - _EPOCH if value is not None else None for value in values],
+                           dtype='timedelta64[us]')
+    elif isinstance(prop, DateTimeProperty):
+        data = numpy.array([_naive(value) for value in values], dtype='datetime64[us]')
+    else:
+        return _objects([prop.from_base_type(value) for value in values], mask)
+
+    return numpy.ma.MaskedArray(data, mask=mask)
+
+
+def _objects(values, mask):
+    data = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):  # Assigning a slice would unpack list values
+        data[i] = value
+    return numpy.ma.MaskedArray(data, mask=mask)
+
+
+def _naive(value):
+    """Convert an aware datetime, as read from the datastore, to a naive one in UTC."""
+    if value is not None and value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value
@@ -0,0 +1,111 @@
+"""
+Generates specialised functions that convert all of a :class:`gcloudorm.model.Model`'s property values to and from
+their stored form in one pass. :class:`gcloudorm.model.MetaModel` compiles them once per model class, so bulk
+construction and decoding avoid a descriptor call and :func:`gcloudorm.properties.Property.validate` dispatch per
+property.
+"""
+from .properties import Property, RepeatedList
+
+
+def _overrides(prop, method):
+    """Does prop's class override ``method`` of :class:`gcloudorm.properties.Property`?"""
+    return getattr(type(prop), method).__func__ is not getattr(Property, method).__func__
+
+
+def _compile(cls, kind, lines, namespace):
+    """Compile the source of a function named ``kind`` for cls and return the function."""
+    source = '\n'.join(lines)
+    exec(compile(source, '<%s %s>' % (cls.__name__, kind), 'exec'), namespace)
+    function = namespace[kind]
+    function.source = source
+    return function
+
+
+def compile_encoder(cls):
+    """
+    Generate a function that converts a dict of external values for cls's properties into the dict of values to store,
+    i.e. the result of :func:`gcloudorm.properties.Property.__set__` for each property. Missing values are replaced
+    with the property's default. The validation and conversion steps of each property are inlined, and steps that
+    aren't overridden from :class:`gcloudorm.properties.Property` are left out.
+    """
+    namespace = {'_missing': object()}
+    lines = ['def encode(values):', '    stored = {}']
+    for i, (name, prop) in enumerate(sorted(cls._properties.items())):
+        namespace.update({
+            'p%d' % i: prop, 'default%d' % i: prop._default, 'validate%d' % i: prop.validate,
+            'to_base%d' % i: prop.to_base_type, '_validate%d' % i: prop._validate, 'validator%d' % i: prop._validator,
+            '_to_base%d' % i: prop._to_base_type,
+        })
+        lines += ['    v = values.get(%r, _missing)' % name, '    if v is _missing:']
+        if prop._repeated:
+            lines += ['        v = default%d or []' % i,
+                      '    assert isinstance(v, (tuple, list)), '
+                      '"Repeated property only accept list or tuple"',
+                      '    v = [to_base%d(validate%d(k)) for k in v]' % (i, i)]
+        else:
+            lines.append('        v = default%d()' % i if callable(prop._default) else '        v = default%d' % i)
+            if prop._choices is not None or prop._required or _overrides(prop, 'validate') or \
+                    _overrides(prop, 'to_base_type'):
+                lines.append('    v = to_base%d(validate%d(v))' % (i, i))
+            else:
+                steps = []
+                if _overrides(prop, '_validate'):
+                    steps.append('v = _validate%d(v)' % i)
+                if prop._validator is not None:
+                    steps.append('v = validator%d(p%d, v)' % (i, i))
+                if _overrides(prop, '_to_base_type'):
+                    # A validator could turn the value into None, which to_base_type() handles.
+                    steps.append('v = to_base%d(v)' % i if prop._validator is not None else 'v = _to_base%d(v)' % i)
+                if steps:
+                    lines.append('    if v is not None:')
+                    lines += ['        ' + step for step in steps]
+        lines.append('    stored[%r] = v' % name)
+    lines.append('    return stored')
+    return _compile(cls, 'encode', lines, namespace)
+
+
+def compile_decoder(cls):
+    """
+    Generate a function that converts a dict of stored values for cls's properties into external values, i.e. what
+    :func:`gcloudorm.properties.Property.__get__` returns for each property. It takes a second dict of memoized
+    decoded values (see :attr:`gcloudorm.model.Model._decoded`), which are reused when still current and updated with
+    anything decoded. Missing values are returned as None, and repeated values as lists, empty if missing.
+    """
+    namespace = {'RepeatedList': RepeatedList}
+    lines = ['def decode(stored, memo):', '    values = {}']
+    for i, (name, prop) in enumerate(sorted(cls._properties.items())):
+        namespace.update({'p%d' % i: prop, 'from_base%d' % i: prop.from_base_type,
+                          '_from_base%d' % i: prop._from_base_type})
+        lines.append('    v = stored.get(%r)' % name)
+        if prop._repeated:
+            # Repeated values are memoized as the RepeatedList attribute access returns, but returned as plain lists
+            lines += ['    m = memo.get(%r)' % name,
+                      '    if m is not None and m[0] is v:',
+                      '        v = list(m[1])',
+                      '    elif v is not None:',
+                      '        m = memo[%r] = (v, RepeatedList(p%d, v))' % (name, i),
+                      '        v = list(m[1])',
+                      '    else:',
+                      '        v = []',  # The datastore drops empty lists
+                      '    values[%r] = v' % name]
+            continue
+        elif _overrides(prop, 'from_base_type'):
+            convert = 'v = from_base%d(v)' % i
+        elif prop._memoize:
+            convert = 'v = _from_base%d(v)' % i
+        else:
+            convert = None
+
+        if prop._memoize:
+            lines += ['    m = memo.get(%r)' % name,
+                      '    if m is not None and m[0] is v:',
+                      '        v = m[1]',
+                      '    elif v is not None:',
+                      '        raw = v',
+                      '        ' + convert,
+                      '        memo[%r] = (raw, v)' % name]
+        elif convert is not None:
+            lines += ['    if v is not None:', '        ' + convert]
+        lines.append('    values[%r] = v' % name)
+    lines.append('    return values')
+    return _compile(cls, 'decode', lines, namespace)
@@ -0,0 +1,136 @@
+"""
+Compression codecs for the values of compressed :class:`gcloudorm.properties.BlobProperty` properties (and its
+subclasses).
+
+Compressed values are stored with a two byte header: a zero marker byte followed by the tag of the codec that
+compressed them, or :data:`RAW` for values that were too small to be worth compressing. Values without the header were
+written before codecs existed, and are plain zlib streams (which never start with a zero byte).
+
+``zlib`` and ``bz2`` are always available. ``lz4`` and ``snappy`` are registered when their libraries are installed.
+Other codecs can be added with :func:`register`.
+"""
+import bz2
+import zlib
+
+MARKER = '\x00'
+RAW = 0
+
+# The size in bytes below which values are stored uncompressed unless told otherwise.
+DEFAULT_MIN_SIZE = 128
+
+
+class Codec(object):
+    """A named compression algorithm with a unique tag that identifies it in stored values."""
+    def __init__(self, name, tag, compress, decompress):
+        """
+        Initialise a codec.
+
+        :param str name: the name properties refer to the codec by.
+        :param int tag: the byte, between 1 and 255, written in the header of values compressed by this codec.
+        :param func compress: a function of (data, level) returning the compressed data. level may be None, meaning
+        the codec's default.
+        :param func decompress: a function of (data) returning the decompressed data.
+        """
+        self.name = name
+        self.tag = tag
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return '<Codec %s>' % self.name
+
+
+_by_name = {}
+_by_tag = {}
+
+
+def register(name, tag, compress, decompress):
+    """
+    Make a codec available to properties. See :class:`Codec` for the arguments.
+
+    :return: the new :class:`Codec`.
+    :raises ValueError: if the name or tag is already in use, or the tag is out of range.
+    """
+    if not 0 < tag < 256:
+        raise ValueError('Codec tags must be between 1 and 255.')
+    if name in _by_name or tag in _by_tag:
+        raise ValueError('There is already a codec named %r or tagged %d.' % (name, tag))
+
+    codec = _by_name[name] = _by_tag[tag] = Codec(name, tag, compress, decompress)
+    return codec
+
+
+def get_codec(name):
+    """
+    :param str name: the name of a registered codec.
+    :return: the :class:`Codec`.
+    :raises ValueError: if there is no codec with that name.
+    """
+    try:
+        return _by_name[name]
+    except KeyError:
+        raise ValueError('Unknown compression codec %r, use one of %s.' % (name, ', '.join(available_codecs())))
+
+
+def available_codecs():
+    """
+    :return: a sorted list of the names of the registered codecs.
+    """
+    return sorted(_by_name)
+
+
+def compress(data, codec='zlib', level=None, min_size=0):
+    """
+    Compress data and add the header identifying how.
+
+    :param str data: the bytes to compress.
+    :param str codec: the name of the codec to use. Defaults to zlib.
+    :param int level: the compression level, or None for the codec's default.
+    :param int min_size: data shorter than this many bytes is stored raw instead.
+    :return: the bytes to store.
+    """
+    if len(data) < min_size:
+        return MARKER + chr(RAW) + data
+
+    codec = get_codec(codec)
+    return MARKER + chr(codec.tag) + codec.compress(data, level)
+
+
+def decompress(data):
+    """
+    Decompress data written by :func:`compress`, or by zlib before codecs existed.
+
+    :param str data: the stored bytes.
+    :return: the decompressed bytes.
+    :raises ValueError: if the data was compressed by a codec that isn't registered.
+    """
+    if not data.startswith(MARKER):
+        return zlib.decompress(data)
+
+    tag = ord(data[1])
+    if tag == RAW:
+        return data[2:]
+
+    codec = _by_tag.get(tag)
+    if codec is None:
+        raise ValueError('Unknown compression codec tag %d, is its library installed?' % tag)
+    return codec.decompress(data[2:])
+
+
+register('zlib', 1, lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress)
+register('bz2', 2, lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress)
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    register('lz4', 3, lambda data, level: lz4.frame.compress(data, compression_level=level or 0),
+             lz4.frame.decompress)
+
+try:
+    import snappy
+except ImportError:
+    pass
+else:
+    register('snappy', 4, lambda data, level: snappy.compress(data), snappy.decompress)
@@ -0,0 +1,209 @@
+"""
+Parallel decompression of heavy property values on bulk reads. Decompressing is CPU bound and holds the GIL, so a
+large :func:`gcloudorm.model.Model.filter` or query of compressed values decompresses on one core. Once enabled, the
+stored values of compressed :class:`gcloudorm.properties.BlobProperty` properties and its subclasses, such as
+:class:`gcloudorm.properties.PickleProperty` and :class:`gcloudorm.properties.JsonProperty`, are sent to a process pool
+as each batch of results is hydrated. The decompressed values are decoded once back in the reading process and
+memoized on the instances, so reading them doesn't decode again:
+
+    from gcloudorm import decoding
+
+    decoding.enable(processes=4, min_bytes=1024 * 1024)
+    profiles = Profile.filter(ids)
+
+Only compressed values are sent to the pool. Uncompressed pickles and JSON aren't, as the decoded values would have to
+be pickled back to the reading process and unpickled there, which costs about as much as decoding them in the first
+place. Only batches whose compressed values add up to at least ``min_bytes`` are sent to the pool. Smaller reads are
+decoded lazily on access as usual, so they don't pay for copying values between processes. Properties of classes that
+change how these are decoded are always decoded in-process, and so are values that fail to decode, which then raise
+when they're read, as they would otherwise. ``python -m benchmarks.bench_decoding`` compares the two.
+
+The pool is started by :func:`enable`, which forks the worker processes, so call it before starting any threads, and
+after registering any extra compression codecs. Each batch decoded in the pool is recorded in :mod:`gcloudorm.metrics`
+as the operation ``parallel_decode``.
+"""
+from __future__ import absolute_import
+
+import cPickle as pickle
+import json
+import multiprocessing
+import os
+import threading
+
+from . import compression, metrics
+from .properties import BlobProperty, JsonProperty, PickleProperty, RepeatedList, TextProperty
+
+# The total size in bytes of the heavy values in a batch below which it's decoded lazily in-process.
+DEFAULT_MIN_BYTES = 1024 * 1024
+
+# Is parallel decoding enabled? Checked by bulk reads before doing any work.
+active = False
+
+_processes = None
+_min_bytes = DEFAULT_MIN_BYTES
+_pool = None
+_pool_size = None
+_pid = None
+_lock = threading.Lock()
+
+
+def enable(processes=None, min_bytes=DEFAULT_MIN_BYTES):
+    """
+    Decompress the heavy property values of bulk reads in a process pool.
+
+    Starts the worker processes by forking, which isn't safe while other threads may hold locks, so call this before
+    starting any threads.
+
+    :param int processes: the number of worker processes. Defaults to the number of CPUs.
+    :param int min_bytes: the total size in bytes of the compressed values in a batch of results below which they're
+    decoded lazily in-process instead. Defaults to :data:`DEFAULT_MIN_BYTES`.
+    """
+    global active, _processes, _min_bytes
+
+    disable()
+    with _lock:
+        _processes = processes
+        _min_bytes = min_bytes
+        _start_pool()
+        active = True
+
+
+def disable():
+    """Stop decoding in parallel and shut the process pool down."""
+    global active, _pool
+
+    with _lock:
+        active = False
+        pool, _pool = _pool, None
+    if pool is not None and _pid == os.getpid():
+        pool.terminate()
+        pool.join()
+
+
+def is_enabled():
+    """
+    :return: True if bulk reads are decoded in parallel.
+    """
+    return active
+
+
+def decode(model, instances):
+    """
+    Decompress the compressed property values of freshly read instances of ``model`` in the process pool, if there
+    are enough of them, then decode them and memoize the results on the instances. Values that are already memoized
+    are skipped.
+
+    :param Model model: the model class of the instances.
+    :param list instances: the model instances. None entries are skipped.
+    """
+    if not active:
+        return
+    props = [(name, prop, _codec(prop)) for name, prop in model._properties.items()]
+    props = [(name, prop, codec) for name, prop, codec in props if codec is not None]
+    if not props:
+        return
+
+    tasks = []
+    targets = []  # (instance, property, codec, stored value, first task, end task)
+    total = 0
+    for obj in instances:
+        if obj is None:
+            continue
+        for name, prop, codec in props:
+            value = obj.get(name)
+            decoded = obj._decoded.get(name)
+            if value is None or (decoded is not None and decoded[0] is value):
+                continue
+            start = len(tasks)
+            for v in (value if prop._repeated else (value,)):
+                if v is not None:
+                    tasks.append(v)
+                    if isinstance(v, str) and not v.startswith(_RAW):
+                        total += len(v)
+            targets.append((obj, prop, codec, value, start, len(tasks)))
+
+    if not total or total < _min_bytes:
+        return
+
+    started = metrics.clock() if metrics.active else None
+    # Values stored as they are don't need to go to the pool
+    remote = [i for i, v in enumerate(tasks) if isinstance(v, str) and not v.startswith(_RAW)]
+    results = [(True, v[2:] if isinstance(v, str) else v) for v in tasks]
+    pool, processes = _get_pool()
+    size = max(1, len(remote) // (processes * 4))
+    chunks = pool.map(_decompress_chunk, [[tasks[i] for i in remote[j:j + size]] for j in xrange(0, len(remote), size)])
+    for i, result in zip(remote, (r for chunk in chunks for r in chunk)):
+        results[i] = result
+
+    for obj, prop, codec, value, start, end in targets:
+        decompressed = results[start:end]
+        try:
+            if not all(ok for ok, _ in decompressed):
+                raise ValueError
+            decoded = [_DECODERS[codec](data) for _, data in decompressed]
+        except Exception:
+            continue  # Leave it to be decoded, and fail, on access
+        if prop._repeated:
+            decoded = iter(decoded)
+            result = RepeatedList(prop, value, [None if v is None else next(decoded) for v in value])
+        else:
+            result = decoded[0]
+        obj._decoded[prop._name] = (value, result)
+
+    if started is not None:
+        metrics.record(model.__name__, 'parallel_decode', started, len(instances), total)
+
+
+def _start_pool():
+    """Fork the worker processes. Call with the lock held."""
+    global _pool, _pool_size, _pid
+
+    _pool_size = _processes or multiprocessing.cpu_count()
+    _pool = multiprocessing.Pool(_pool_size)
+    _pid = os.getpid()
+
+
+def _get_pool():
+    with _lock:
+        if _pool is None or _pid != os.getpid():  # A pool inherited from a parent process can't be used
+            _start_pool()
+        return _pool, _pool_size
+
+
+def _codec(prop):
+    """The name of the decoder for prop's decompressed values, or None if they aren't decompressed in the pool."""
+    if not getattr(prop, '_compressed', False):
+        return None
+    method = getattr(type(prop)._from_base_type, '__func__', None)
+    if method is PickleProperty._from_base_type.__func__:
+        return 'pickle'
+    if method is JsonProperty._from_base_type.__func__:
+        return 'json'
+    if method is TextProperty._from_base_type.__func__:
+        return 'text'
+    if method is BlobProperty._from_base_type.__func__:
+        return 'blob'
+    return None
+
+
+# The header of compressed values stored as they are, which are cheaper to slice than to send to the pool
+_RAW = compression.MARKER + chr(compression.RAW)
+
+# Decoders of the values of each kind of property, once decompressed
+_DECODERS = {
+    'blob': lambda value: value,
+    'text': lambda value: unicode(value, 'utf-8') if isinstance(value, str) else value,
+    'pickle': pickle.loads,
+    'json': json.loads,
+}
+
+
+def _decompress_chunk(values):
+    """Decompress a list of stored values in a worker, returning (ok, decompressed data) for each."""
+    results = []
+    for value in values:
+        try:
+            results.append((True, compression.decompress(value) if isinstance(value, str) else value))
+        except Exception:
+            results.append((False, None))
+    return results
@@ -0,0 +1,362 @@
+"""
+Streaming export of a kind to a file, e.g. for backups and migrations. Entities are read a page at a time and written
+as they arrive, so memory use doesn't grow with the size of the kind. Two formats are supported:
+
+* ``ndjson``: a JSON object per line. Values are encoded using the model's property definitions: blobs (including
+  pickled, JSON and compressed values) as base64, text as text, keys as their paths and datetimes as ISO 8601
+  strings in UTC.
+* ``binary``: length-prefixed records holding the stored values as they are. It's smaller and faster to read and
+  write, but, as it's pickled, only read files you trust.
+
+Either can be compressed with gzip or bz2. For example:
+
+    from gcloudorm import export
+
+    export.dump(Person, 'people.ndjson.gz', compress='gzip')
+    for person in export.read('people.ndjson.gz'):
+        ...
+
+Or from the command line, importing the module that defines the model first:
+
+    gcloudorm-export --models myapp.models --dataset-id my-project Person people.ndjson.gz
+
+The first line, or record, of an export names its kind and properties. :func:`read` detects the format and compression
+of a file, and yields instances of the model, which can be saved to restore them.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import base64
+import bz2
+import cPickle as pickle
+import datetime
+import gzip
+import importlib
+import json
+import struct
+import sys
+import zlib
+
+from gcloud.datastore import entity, key, set_default_dataset_id
+
+from .properties import BlobProperty, DateTimeProperty, KeyProperty, TextProperty
+from .query import Query
+
+FORMATS = ('ndjson', 'binary')
+COMPRESSIONS = ('gzip', 'bz2')
+
+# The start of binary exports, followed by records of a four byte big endian length and the pickled record.
+BINARY_MAGIC = 'GCLOUDORM\x00\x01\n'
+
+_LENGTH = struct.Struct('>I')
+_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def dump(source, out, format='ndjson', compress=None, page_size=500):
+    """
+    Write the entities of a kind, or the results of a query, to a file as they're read.
+
+    :param source: a model class, to export all of its entities, or a :class:`gcloudorm.query.Query`.
+    :param out: a path, or a file object opened for writing in binary mode.
+    :param str format: ``ndjson`` or ``binary``. Defaults to ``ndjson``.
+    :param str compress: ``gzip``, ``bz2`` or None for no compression. Defaults to None.
+    :param int page_size: the number of entities to read per RPC.
+    :return: the number of entities written.
+    :raises ValueError: if the format or compression is unknown.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown export format %r, use one of %s.' % (format, ', '.join(FORMATS)))
+    if compress is not None and compress not in COMPRESSIONS:
+        raise ValueError('Unknown compression %r, use one of %s.' % (compress, ', '.join(COMPRESSIONS)))
+
+    query = source if isinstance(source, Query) else source.query()
+    model = query.model
+    names = sorted(model._properties)
+    write, encode = (_write_ndjson, _encode_ndjson) if format == 'ndjson' else (_write_binary, _encode_binary)
+
+    f, close = _open(out, 'wb')
+    stream = f
+    if compress == 'gzip':
+        stream = gzip.GzipFile(fileobj=f, mode='wb')
+    elif compress == 'bz2':
+        stream = _BZ2Writer(f)
+
+    count = 0
+    try:
+        if format == 'binary':
+            stream.write(BINARY_MAGIC)
+        write(stream, {'kind': model.__name__, 'properties': names})
+        for obj in query.fetch(page_size=page_size):
+            write(stream, encode(model, names, obj))
+            count += 1
+    finally:
+        if stream is not f:
+            stream.close()
+        if close:
+            f.close()
+        else:
+            f.flush()
+    return count
+
+
+def read(source, model=None):
+    """
+    Read an export written by :func:`dump`, one entity at a time.
+
+    :param source: a path, or a file object opened for reading in binary mode.
+    :param Model model: the model to read the entities as. Defaults to the model registered for the exported kind.
+    :return: a generator of model instances.
+    :raises ValueError: if the file isn't an export, is of a different kind to ``model``, or of a kind with no model.
+    """
+    from .model import Model
+
+    f, close = _open(source, 'rb')
+    try:
+        stream = _decompressed(f)
+        first = stream.read(len(BINARY_MAGIC))
+        if first == BINARY_MAGIC:
+            records, decode = _read_binary(stream), _decode_binary
+        elif first.startswith('{'):
+            records, decode = _read_ndjson(stream, first), _decode_ndjson
+        else:
+            raise ValueError('Not an export file.')
+
+        header = next(records, None)
+        if header is None:
+            raise ValueError('Not an export file.')
+        if model is None:
+            try:
+                model = Model._lookup_model(header['kind'])
+            except KeyError:
+                raise ValueError('There is no model for %s.' % header['kind'])
+        elif model.__name__ != header['kind']:
+            raise ValueError('The export is of %s, not %s.' % (header['kind'], model.__name__))
+
+        names = header['properties']
+        for record in records:
+            yield model.from_entity(decode(model, names, record))
+    finally:
+        if close:
+            f.close()
+
+
+def _open(target, mode):
+    if isinstance(target, basestring):
+        return open(target, mode), True
+    return target, False
+
+
+def _decompressed(f):
+    """Wrap f to decompress it if it starts with the magic bytes of gzip or bz2."""
+    raw = _Reader(f)
+    magic = raw.peek(3)
+    if magic.startswith('\x1f\x8b'):
+        return _Reader(raw, zlib.decompressobj(16 + zlib.MAX_WBITS).decompress)
+    if magic == 'BZh':
+        return _Reader(raw, bz2.BZ2Decompressor().decompress)
+    return raw
+
+
+class _Reader(object):
+    """
+    Buffered reads of a stream that may not be seekable, such as stdin, optionally decompressing it a block at a time.
+    gzip.GzipFile and bz2.BZ2File in Python 2 need seekable files or paths.
+    """
+    def __init__(self, f, decompress=None, block_size=64 * 1024):
+        self._f = f
+        self._decompress = decompress
+        self._block_size = block_size
+        self._buffer = ''
+        self._offset = 0  # Where the unread data in the buffer starts, so reads don't copy the rest of it
+        self._eof = False
+
+    def _fill(self, size=None):
+        """
+        Buffer at least size unread bytes, or a whole line if size is None, unless the stream ends first. The unread
+        data is only copied, once, when more is read.
+        """
+        available = len(self._buffer) - self._offset
+        if self._eof or (available >= size if size is not None else self._buffer.find('\n', self._offset) >= 0):
+            return
+
+        chunks = [self._buffer[self._offset:]]
+        while not self._eof:
+            data = self._f.read(self._block_size)
+            if not data:
+                self._eof = True
+                break
+            if self._decompress is not None:
+                try:
+                    data = self._decompress(data)
+                except EOFError:  # Trailing data after a bz2 stream
+                    self._eof = True
+                    break
+            chunks.append(data)
+            available += len(data)
+            if available >= size if size is not None else '\n' in data:
+                break
+        self._buffer, self._offset = ''.join(chunks), 0
+
+    def peek(self, size):
+        self._fill(size)
+        return self._buffer[self._offset:self._offset + size]
+
+    def read(self, size=-1):
+        self._fill(sys.maxsize if size < 0 else size)
+        end = len(self._buffer) if size < 0 else min(self._offset + size, len(self._buffer))
+        data, self._offset = self._buffer[self._offset:end], end
+        return data
+
+    def readline(self):
+        self._fill()
+        end = self._buffer.find('\n', self._offset) + 1 or len(self._buffer)
+        line, self._offset = self._buffer[self._offset:end], end
+        return line
+
+
+class _BZ2Writer(object):
+    """Compress a stream with bz2. bz2.BZ2File in Python 2 only accepts paths."""
+    def __init__(self, f):
+        self._f = f
+        self._compressor = bz2.BZ2Compressor()
+
+    def write(self, data):
+        self._f.write(self._compressor.compress(data))
+
+    def close(self):
+        self._f.write(self._compressor.flush())
+
+
+def _write_ndjson(stream, record):
+    stream.write(json.dumps(record, separators=(',', ':')))
+    stream.write('\n')
+
+
+def _read_ndjson(stream, start):
+    line = start + stream.readline()
+    while line:
+        if line.strip():
+            yield json.loads(line)
+        line = stream.readline()
+
+
+def _encode_ndjson(model, names, obj):
+    values = {}
+    for name in names:
+        value = obj.get(name)
+        if value is not None:
+            prop = model._properties[name]
+            values[name] = [_to_json(prop, v) for v in value] if prop._repeated else _to_json(prop, value)
+    return {'key': list(obj.key.flat_path), 'namespace': obj.key.namespace, 'properties': values}
+
+
+def _decode_ndjson(model, names, record):
+    e = entity.Entity(key.Key(*record['key'], namespace=record['namespace']))
+    for name, value in record['properties'].items():
+        prop = model._properties.get(name)
+        if prop is not None:
+            e[name] = [_from_json(prop, v) for v in value] if prop._repeated else _from_json(prop, value)
+    return e
+
+
+def _to_json(prop, value):
+    """Encode the stored value of prop in JSON."""
+    if value is None:
+        return value
+    if isinstance(prop, TextProperty):
+        return prop.from_base_type(value)
+    if isinstance(prop, BlobProperty):
+        return base64.b64encode(value)
+    if isinstance(prop, KeyProperty):
+        return {'key': list(value.flat_path), 'namespace': value.namespace}
+    if isinstance(prop, DateTimeProperty):
+        if value.tzinfo is not None:
+            value = (value - value.utcoffset()).replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+
+def _from_json(prop, value):
+    """Decode a value encoded by :func:`_to_json` to prop's stored form."""
+    if value is None:
+        return value
+    if isinstance(prop, TextProperty):
+        return prop.to_base_type(value)
+    if isinstance(prop, BlobProperty):
+        return base64.b64decode(value)
+    if isinstance(prop, KeyProperty):
+        return key.Key(*value['key'], namespace=value['namespace'])
+    if isinstance(prop, DateTimeProperty):
+        for f in _DATETIME_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, f)
+            except ValueError:
+                pass
+        raise ValueError('Invalid datetime %r.' % value)
+    return value
+
+
+def _write_binary(stream, record):
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    stream.write(_LENGTH.pack(len(data)))
+    stream.write(data)
+
+
+def _read_binary(stream):
+    while True:
+        header = stream.read(_LENGTH.size)
+        if not header:
+            return
+        if len(header) < _LENGTH.size:
+            raise ValueError('Truncated export file.')
+        length, = _LENGTH.unpack(header)
+        data = stream.read(length)
+        if len(data) < length:
+            raise ValueError('Truncated export file.')
+        yield pickle.loads(data)
+
+
+def _encode_binary(model, names, obj):
+    return obj.key.flat_path, obj.key.namespace, [obj.get(name) for name in names]
+
+
+def _decode_binary(model, names, record):
+    flat_path, namespace, values = record
+    e = entity.Entity(key.Key(*flat_path, namespace=namespace))
+    e.update((name, value) for name, value in zip(names, values) if name in model._properties)
+    return e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the entities of a kind to a file.')
+    parser.add_argument('kind', help='the kind to export')
+    parser.add_argument('output', help='the file to write, or - for stdout')
+    parser.add_argument('--models', action='append', default=[], metavar='MODULE',
+                        help='a module defining the model to import first, can be given more than once')
+    parser.add_argument('--dataset-id', help='the dataset to export from, defaults to the environment')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--compress', choices=COMPRESSIONS,
+                        help='defaults to gzip or bz2 for outputs ending .gz or .bz2, otherwise none')
+    parser.add_argument('--page-size', type=int, default=500, help='the number of entities to read per RPC')
+    args = parser.parse_args(argv)
+
+    from .model import Model
+
+    for module in args.models:
+        importlib.import_module(module)
+    if args.dataset_id:
+        set_default_dataset_id(args.dataset_id)
+    if args.kind not in Model._kind_map:
+        parser.error('There is no model for %s, use --models to import the module that defines it.' % args.kind)
+
+    compress = args.compress
+    if compress is None:
+        compress = 'gzip' if args.output.endswith('.gz') else 'bz2' if args.output.endswith('.bz2') else None
+    out = sys.stdout if args.output == '-' else args.output
+
+    count = dump(Model._lookup_model(args.kind), out, args.format, compress, args.page_size)
+    print('Exported %d %s entities.' % (count, args.kind), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
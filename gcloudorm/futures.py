@@ -0,0 +1,166 @@
+"""
+Futures for datastore operations that run in the background, in the style of ndb's ``*_async`` methods. For example:
+
+    from gcloudorm import futures
+
+    future = Person.get_by_id_async(person_id)
+    others = [Person.filter_async(ids) for ids in id_lists]
+    person = future.get_result()
+    people = futures.wait_all(others)
+
+Operations run on a shared pool of worker threads, which caps how many are in flight at once. Those over the cap wait
+for a free worker. Use :func:`set_max_in_flight` to change the cap. As the workers are separate threads, background
+operations don't take part in the caller's :class:`gcloud.datastore.batch.Batch` or transaction.
+
+Up to the cap, operations call the current backend (see :mod:`gcloudorm.backends`) from several threads at once, so
+it must be thread-safe. :class:`gcloudorm.backends.GCloudBackend` is, as it gives each thread its own copy of
+gcloud-python's default connection rather than sharing that connection's HTTP transport, and so is
+:class:`gcloudorm.backends.MemoryBackend`. A custom backend, or a connection stand-in set with
+:func:`gcloud.datastore.set_default_connection` that isn't a :class:`gcloud.datastore.connection.Connection`, needs to
+handle concurrent calls itself.
+
+Bulk reads with a ``concurrency`` greater than 1, and queries that prefetch pages, make their RPCs on a second shared
+pool (see :func:`imap` and :func:`submit_read`), so they can be started from the workers above without waiting for
+one to be free. Its threads, and the connections the backend gives them, are kept for later reads rather than set up
+for each one.
+"""
+from __future__ import absolute_import
+
+import collections
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+# The maximum number of operations running at once unless told otherwise.
+DEFAULT_MAX_IN_FLIGHT = 16
+
+_max_in_flight = DEFAULT_MAX_IN_FLIGHT
+_pool = None
+_pool_lock = threading.Lock()
+
+_read_pool = None
+_read_pool_size = 0
+_read_pool_pid = None
+
+
+class Future(object):
+    """The eventual result of an operation started with :func:`submit`."""
+    def __init__(self, async_result):
+        self._async_result = async_result
+
+    def done(self):
+        """
+        :return: True if the operation has finished, successfully or not.
+        """
+        return self._async_result.ready()
+
+    def wait(self, timeout=None):
+        """
+        Block until the operation has finished or ``timeout`` seconds have passed.
+
+        :param float timeout: the number of seconds to wait for. Defaults to None, meaning no limit.
+        """
+        self._async_result.wait(timeout)
+
+    def get_result(self):
+        """
+        Block until the operation has finished.
+
+        :return: the result of the operation.
+        :raises: whatever the operation raised.
+        """
+        return self._async_result.get()
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run ``func(*args, **kwargs)`` on the worker pool.
+
+    :return: a :class:`Future` for its result.
+    """
+    return Future(_get_pool().apply_async(func, args, kwargs))
+
+
+def wait_all(futures):
+    """
+    Block until all of ``futures`` have finished.
+
+    :param list futures: the :class:`Future` objects to wait for.
+    :return: a list of their results, in the same order.
+    :raises: the exception of the first future, in order, that failed.
+    """
+    futures = list(futures)
+    for future in futures:
+        future.wait()
+    return [future.get_result() for future in futures]
+
+
+def submit_read(func, *args, **kwargs):
+    """
+    Run ``func(*args, **kwargs)`` on the pool of threads shared by bulk reads, e.g. to read ahead.
+
+    :return: a :class:`Future` for its result.
+    """
+    return Future(_get_read_pool(1).apply_async(func, args, kwargs))
+
+
+def imap(func, items, concurrency):
+    """
+    Like :func:`itertools.imap`, but call ``func`` on the pool of threads shared by bulk reads, with up to
+    ``concurrency`` calls in flight at once.
+
+    :param func func: the function to call with each item.
+    :param iterable items: the items.
+    :param int concurrency: the maximum number of calls to have in flight at once.
+    :return: a generator of the results, in the order of ``items``.
+    :raises: whatever ``func`` raised for the first item, in order, that it failed for.
+    """
+    pool = _get_read_pool(concurrency)
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= concurrency:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def set_max_in_flight(max_in_flight):
+    """
+    Set the number of operations that can run at once. Operations already submitted finish on the old pool.
+
+    :param int max_in_flight: the new limit.
+    """
+    global _max_in_flight, _pool
+
+    if max_in_flight < 1:
+        raise ValueError('At least one operation must be allowed in flight.')
+
+    with _pool_lock:
+        _max_in_flight = max_in_flight
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def _get_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(_max_in_flight)
+        return _pool
+
+
+def _get_read_pool(size):
+    """:return: the thread pool for bulk reads, replaced by a bigger one if it has fewer than ``size`` threads."""
+    global _read_pool, _read_pool_size, _read_pool_pid
+
+    with _pool_lock:
+        if _read_pool_pid != os.getpid():  # The threads of a pool inherited from a parent process are gone
+            _read_pool = None
+        if _read_pool is None or _read_pool_size < size:
+            if _read_pool is not None:
+                _read_pool.close()
+            _read_pool, _read_pool_size, _read_pool_pid = ThreadPool(size), size, os.getpid()
+        return _read_pool
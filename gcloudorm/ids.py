@@ -0,0 +1,152 @@
+"""
+Integer ids reserved from the datastore, as an alternative to the uuid4 hex strings of
+:class:`gcloudorm.properties.IdProperty`. Reserving an id is an RPC, so ids are reserved a block at a time and handed
+out from a local pool, and the next block is reserved on a background thread while the pool still has ids left.
+Creating an instance therefore doesn't wait on the datastore, unless ids are used faster than they can be reserved:
+
+    from gcloudorm import model, properties
+
+    class Order(model.Model):
+        id = properties.AllocatedIdProperty(block_size=500)
+        total = properties.FloatProperty()
+
+    Order.id.pool.warm()  # Optional, so even the first instance doesn't wait
+    order = Order(total=9.99)  # order.key.id is an int from the pool
+
+Ids come from :func:`gcloudorm.backends.Backend.allocate_ids` of the current backend, unless the pool is given another
+``allocator``, a function taking a kind and a count and returning a list of that many unused ids, which must be safe to
+call from any thread. If the backend isn't :attr:`gcloudorm.backends.Backend.thread_safe`, blocks are instead reserved
+on the calling thread when the pool runs out. Each block reserved is recorded in :mod:`gcloudorm.metrics` as the
+operation ``allocate_ids``.
+
+Ids left in a pool when the process exits are never used. Nor are they in forked processes, which start with an empty
+pool, so a parent and its children don't hand out the same ids.
+"""
+from __future__ import absolute_import
+
+import collections
+import os
+import sys
+import threading
+
+import six
+
+from . import metrics
+from .backends import get_backend
+
+# The number of ids reserved per RPC unless told otherwise.
+DEFAULT_BLOCK_SIZE = 100
+
+
+def _allocate(kind, count):
+    return get_backend().allocate_ids(kind, count)
+
+
+class IdPool(object):
+    """
+    A thread-safe pool of the integer ids reserved for a kind. See the module documentation.
+    """
+    def __init__(self, kind, block_size=DEFAULT_BLOCK_SIZE, low_water=None, allocator=None):
+        """
+        Initialise an empty pool. Nothing is reserved until an id is needed or :func:`warm` is called.
+
+        :param str kind: the kind to reserve ids for.
+        :param int block_size: the number of ids to reserve at a time.
+        :param int low_water: the number of ids left at which the next block is reserved. Defaults to half of
+        ``block_size``.
+        :param func allocator: a function taking a kind and a count and returning a list of reserved ids. Defaults to
+        reserving them through the current backend.
+        """
+        if block_size < 1:
+            raise ValueError('Block size must be at least 1.')
+        self.kind = kind
+        self.block_size = block_size
+        self.low_water = block_size // 2 if low_water is None else low_water
+        self._allocator = allocator or _allocate
+        self._ids = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._refilling = False
+        self._error = None
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def next(self):
+        """
+        :return: an unused id. Only waits for a block to be reserved if the pool is empty.
+        :raises: whatever the allocator raised, if the pool is empty and reserving a block failed.
+        """
+        with self._condition:
+            self._check_process()
+            background = self._background()
+            while not self._ids:
+                if not background:
+                    self._ids.extend(self._allocate())
+                    break
+                if not self._refilling:
+                    self._error = None
+                    self._refill()
+                self._condition.wait()
+                if not self._ids and self._error is not None:
+                    six.reraise(*self._error)
+            id = self._ids.popleft()
+            if len(self._ids) <= self.low_water and background:
+                self._refill()
+            return id
+
+    def warm(self):
+        """
+        Start reserving a block in the background if the pool is running low, e.g. when an application starts. If
+        blocks can't be reserved in the background, one is reserved now if the pool is empty.
+        """
+        with self._condition:
+            self._check_process()
+            if self._background():
+                if len(self._ids) <= self.low_water:
+                    self._refill()
+            elif not self._ids:
+                self._ids.extend(self._allocate())
+
+    def _background(self):
+        """Can blocks be reserved on a background thread? Only if the allocator can be called from any thread."""
+        return self._allocator is not _allocate or get_backend().thread_safe
+
+    def _check_process(self):
+        """Empty the pool if it's been inherited from a parent process, which may hand out the same ids."""
+        if self._pid != os.getpid():
+            self._ids.clear()
+            self._refilling = False
+            self._error = None
+            self._pid = os.getpid()
+
+    def _refill(self):
+        """Reserve a block on a background thread, unless one is already being reserved. Call with the lock held."""
+        if not self._refilling:
+            self._refilling = True
+            thread = threading.Thread(target=self._reserve)
+            thread.daemon = True
+            thread.start()
+
+    def _allocate(self):
+        """Reserve a block of ids and return them."""
+        started = metrics.clock() if metrics.active else None
+        ids = self._allocator(self.kind, self.block_size)
+        if not ids:
+            raise ValueError('No ids were allocated for %s.' % self.kind)
+        if started is not None:
+            metrics.record(self.kind, 'allocate_ids', started, len(ids))
+        return ids
+
+    def _reserve(self):
+        ids, error = [], None
+        try:
+            ids = self._allocate()
+        except Exception:
+            error = sys.exc_info()
+
+        with self._condition:
+            self._ids.extend(ids)
+            self._error = error
+            self._refilling = False
+            self._condition.notify_all()
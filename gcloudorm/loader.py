@@ -0,0 +1,374 @@
+"""
+Bulk loading of rows into the datastore. Rather than building and saving one instance at a time, a load runs as a
+pipeline of three stages, connected by bounded queues so memory use stays flat however many rows there are:
+
+1. Parse: rows are read from the input, and optionally converted by a ``parse`` function, into dicts of property
+   values.
+2. Build: each dict is turned into a model instance, validating its values. This can be spread over worker processes.
+3. Write: instances are saved in batches by several threads at once.
+
+A row that fails at any stage is reported as a :class:`LoadError` and the load carries on. For example:
+
+    from gcloudorm import loader
+
+    stats = loader.load_csv(Person, 'people.csv', processes=4, concurrency=8, log=sys.stderr)
+    for error in stats.errors:
+        ...
+
+Rows can also be model instances, which skip the build stage, e.g. to restore an export:
+
+    loader.load(Person, export.read('people.ndjson.gz'))
+
+Worker processes are forked, so they can build instances of any model defined before the load starts. The write
+threads call the current backend concurrently, which :class:`gcloudorm.backends.GCloudBackend` supports by giving each
+thread its own datastore connection. Pass ``concurrency=1`` for a backend that isn't thread-safe.
+"""
+from __future__ import absolute_import, print_function
+
+import collections
+import csv
+import datetime
+import json
+import multiprocessing.pool
+import Queue
+import sys
+import threading
+import time
+
+import six
+
+from .model import MAX_BATCH_SIZE, Model, _put
+from .properties import (BlobProperty, BooleanProperty, DateProperty, DateTimeProperty, FloatProperty, IntegerProperty,
+                         JsonProperty, PickleProperty, TextProperty, TimeProperty)
+
+# The number of rows held between each pair of stages, in batches, unless told otherwise.
+DEFAULT_QUEUE_SIZE = 8
+
+# A row that couldn't be loaded. number counts rows from 1, and stage is one of parse, build or write.
+LoadError = collections.namedtuple('LoadError', ['number', 'row', 'stage', 'error'])
+
+_DONE = object()
+
+
+class LoadStats(object):
+    """The progress of a load. :attr:`errors` is a list of a :class:`LoadError` for each row that failed."""
+    def __init__(self):
+        self.rows = 0
+        self.built = 0
+        self.written = 0
+        self.errors = []
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    @property
+    def seconds(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        """The number of rows written per second."""
+        return self.written / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {'rows': self.rows, 'built': self.built, 'written': self.written, 'failed': self.failed,
+                'seconds': self.seconds, 'rate': self.rate}
+
+    def __str__(self):
+        return '%d rows read, %d built, %d written, %d failed in %.1fs (%.0f rows/s)' % (
+            self.rows, self.built, self.written, self.failed, self.seconds, self.rate)
+
+
+def load(model, rows, parse=None, batch_size=MAX_BATCH_SIZE, concurrency=4, processes=0,
+         queue_size=DEFAULT_QUEUE_SIZE, on_error=None, log=None, log_every=10.0):
+    """
+    Build and save instances of ``model`` from ``rows``. See the module documentation.
+
+    :param Model model: the model to load.
+    :param rows: an iterable of dicts of property values (passed to the model's constructor, so ``parent`` is
+    allowed), or of model instances, which are saved as they are.
+    :param func parse: a function converting each row into a dict of property values. Defaults to None, meaning the
+    rows are used as they are.
+    :param int batch_size: the number of instances to write per RPC.
+    :param int concurrency: the number of batches to write at once, each from its own thread. The backend must be
+    thread-safe unless this is 1.
+    :param int processes: the number of worker processes to build instances in. Defaults to 0, meaning they're built
+    on a thread of this process.
+    :param int queue_size: the number of batches of rows that can wait between each pair of stages.
+    :param func on_error: called with each :class:`LoadError`, on the thread of the stage that failed.
+    :param log: a file to print progress and the final throughput to. Defaults to None, meaning nothing is printed.
+    :param float log_every: the number of seconds between progress lines.
+    :return: the :class:`LoadStats` of the load.
+    :raises: whatever reading ``rows`` raised, after stopping the load.
+    """
+    if batch_size < 1:
+        raise ValueError('Batch size must be at least 1.')
+    return _Pipeline(model, parse, batch_size, max(1, concurrency), processes, queue_size, on_error).run(
+        rows, log, log_every)
+
+
+def load_csv(model, source, parse=None, **kwargs):
+    """
+    Load rows from a CSV file with a header row naming the properties. Values are converted with :func:`csv_parser`
+    unless another ``parse`` is given. Takes the same arguments as :func:`load`.
+
+    :param source: a path, or a file object.
+    :return: the :class:`LoadStats` of the load.
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            return load(model, csv.DictReader(f), parse or csv_parser(model), **kwargs)
+    return load(model, csv.DictReader(source), parse or csv_parser(model), **kwargs)
+
+
+def csv_parser(model):
+    """
+    :return: a function converting a dict of strings, as read from a CSV file, to the types of ``model``'s
+    properties. Empty values are left out, unknown columns are passed on as they are, and the values of repeated and
+    pickled properties aren't converted.
+    """
+    converters = {}
+    for name, prop in model._properties.items():
+        if prop._repeated or isinstance(prop, PickleProperty):
+            continue
+        for cls, convert in _CSV_CONVERTERS:
+            if isinstance(prop, cls):
+                converters[name] = convert
+                break
+
+    def parse(row):
+        values = {}
+        for name, value in row.items():
+            if value == '' or value is None:
+                continue
+            convert = converters.get(name)
+            values[name] = convert(value) if convert is not None else value
+        return values
+    return parse
+
+
+def _parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes', 'y', 't'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'n', 'f'):
+        return False
+    raise ValueError('Invalid boolean %r.' % value)
+
+
+def _parse_datetime(value):
+    for f in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(value, f)
+        except ValueError:
+            pass
+    raise ValueError('Invalid datetime %r.' % value)
+
+
+def _parse_time(value):
+    for f in ('%H:%M:%S.%f', '%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.datetime.strptime(value, f).time()
+        except ValueError:
+            pass
+    raise ValueError('Invalid time %r.' % value)
+
+
+# Most specific first, as the property classes extend each other
+_CSV_CONVERTERS = (
+    (BooleanProperty, _parse_bool),
+    (IntegerProperty, int),
+    (FloatProperty, float),
+    (DateProperty, lambda value: datetime.datetime.strptime(value, '%Y-%m-%d').date()),
+    (TimeProperty, _parse_time),
+    (DateTimeProperty, _parse_datetime),
+    (JsonProperty, json.loads),
+    (TextProperty, lambda value: value.decode('utf-8')),
+    (BlobProperty, str),
+)
+
+
+def _build(model, rows):
+    """Build instances of model from (number, row, values), returning (number, row, instance or None, error or None)."""
+    results = []
+    for number, row, values in rows:
+        try:
+            results.append((number, row, model(**values), None))
+        except Exception as e:
+            results.append((number, row, None, e))
+    return results
+
+
+def _build_in_worker(kind, rows):
+    """Build instances in a worker process, returning their keys and stored values in place of the instances."""
+    return [(number, row, (obj.key, dict(obj)) if obj is not None else None, error)
+            for number, row, obj, error in _build(Model._lookup_model(kind), rows)]
+
+
+class _Pipeline(object):
+    def __init__(self, model, parse, batch_size, concurrency, processes, queue_size, on_error):
+        self._model = model
+        self._parse = parse
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._processes = processes
+        self._on_error = on_error
+        self._parsed = Queue.Queue(queue_size)
+        self._built = Queue.Queue(queue_size)
+        self._stats = LoadStats()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._fatal = None
+
+    def run(self, rows, log, log_every):
+        stats = self._stats
+        threads = [threading.Thread(target=self._guard, args=(self._read, rows)),
+                   threading.Thread(target=self._guard, args=(self._build,))]
+        threads += [threading.Thread(target=self._guard, args=(self._write,)) for _ in xrange(self._concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(log_every if log is not None else 1.0)
+                if log is not None and thread.is_alive():
+                    print('Loading %s: %s' % (self._model.__name__, stats), file=log)
+        stats.finished = time.time()
+
+        if self._fatal is not None:
+            six.reraise(*self._fatal)
+        if log is not None:
+            print('Loaded %s: %s' % (self._model.__name__, stats), file=log)
+        return stats
+
+    def _guard(self, stage, *args):
+        """Run a stage, stopping the whole load if it fails."""
+        try:
+            stage(*args)
+        except Exception:
+            with self._lock:
+                if self._fatal is None:
+                    self._fatal = sys.exc_info()
+            self._stop.set()
+
+    def _send(self, queue, item):
+        """Put item on a queue, unless the load has been stopped. Returns False if it has."""
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _receive(self, queue):
+        """Get the next item from a queue, or _DONE once the load has been stopped."""
+        while not self._stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        return _DONE
+
+    def _error(self, number, row, stage, error):
+        e = LoadError(number, row, stage, error)
+        with self._lock:
+            self._stats.errors.append(e)
+        if self._on_error is not None:
+            self._on_error(e)
+
+    def _read(self, rows):
+        batch = []
+        try:
+            for number, row in enumerate(rows, 1):
+                self._stats.rows = number
+                if self._parse is None or isinstance(row, Model):
+                    values = row
+                else:
+                    try:
+                        values = self._parse(row)
+                    except Exception as e:
+                        self._error(number, row, 'parse', e)
+                        continue
+                batch.append((number, row, values))
+                if len(batch) >= self._batch_size:
+                    if not self._send(self._parsed, batch):
+                        return
+                    batch = []
+            if batch:
+                self._send(self._parsed, batch)
+        finally:
+            self._send(self._parsed, _DONE)
+
+    def _build(self):
+        pool = multiprocessing.Pool(self._processes) if self._processes > 0 else None
+        pending = collections.deque()
+        try:
+            while True:
+                batch = self._receive(self._parsed)
+                if batch is _DONE:
+                    break
+                instances = [(n, row, values, None) for n, row, values in batch if isinstance(values, Model)]
+                rows = [(n, row, values) for n, row, values in batch if not isinstance(values, Model)]
+                if pool is not None:
+                    pending.append((instances, pool.apply_async(_build_in_worker, (self._model.__name__, rows))))
+                    # Keep the workers busy, without letting results pile up
+                    while len(pending) > self._processes * 2:
+                        if not self._built_batch(*pending.popleft()):
+                            return
+                elif not self._built_batch(instances, _build(self._model, rows)):
+                    return
+            while pending:
+                if not self._built_batch(*pending.popleft()):
+                    return
+        finally:
+            if pool is not None:
+                pool.terminate()
+            for _ in xrange(self._concurrency):
+                self._send(self._built, _DONE)
+
+    def _built_batch(self, instances, results):
+        """Queue a batch of built instances for writing. results may be an AsyncResult of _build_in_worker."""
+        if isinstance(results, multiprocessing.pool.AsyncResult):
+            results = results.get()
+
+        model = self._model
+        batch = [(n, row, obj) for n, row, obj, _ in instances]
+        for number, row, built, error in results:
+            if error is not None:
+                self._error(number, row, 'build', error)
+                continue
+            if not isinstance(built, Model):
+                # Built by a worker, so rebuild it from its stored values without validating them again
+                built = model.from_entity(_Stored(*built))
+                built._changed = set(model._properties)
+            batch.append((number, row, built))
+
+        with self._lock:
+            self._stats.built += len(batch)
+        return not batch or self._send(self._built, batch)
+
+    def _write(self):
+        while True:
+            batch = self._receive(self._built)
+            if batch is _DONE:
+                return
+            instances = [obj for _, _, obj in batch if obj._prepare_for_put(True)]
+            try:
+                _put(instances, self._batch_size, 'load')
+            except Exception as e:
+                for number, row, _ in batch:
+                    self._error(number, row, 'write', e)
+                continue
+            with self._lock:
+                self._stats.written += len(batch)
+
+
+class _Stored(dict):
+    """The stored values of an instance built by a worker, in the shape :func:`Model.from_entity` expects."""
+    def __init__(self, k, values):
+        super(_Stored, self).__init__(values)
+        self.key = k
@@ -0,0 +1,315 @@
+"""
+Instrumentation for model operations. While metrics are enabled, each operation is recorded against the kind it
+touched: the number of calls, the number of entities, a histogram of wall-clock latencies and the number of bytes of
+stored values. The time each property spends converting values to and from their stored form is recorded too, as the
+operations ``encode.<property>`` and ``decode.<property>``. For example:
+
+    from gcloudorm import metrics
+
+    metrics.enable()
+    ...
+    metrics.registry().snapshot()  # {'Person': {'get_by_id': {'calls': ..., ...}, 'decode.profile': {...}}}
+
+To see what a single request did, capture the operations run by the current thread, whether or not metrics are
+enabled globally (property conversion times are only recorded while they are):
+
+    with metrics.capture() as stats:
+        handle_request()
+    log(stats.snapshot())
+
+Other sinks, such as statsd, can be attached with :func:`add_hook`.
+
+When metrics are disabled and nothing is being captured, property conversions aren't wrapped at all and each operation
+costs a single attribute check. Operations started with the ``_async`` methods run on worker threads, so they're
+recorded globally but not by a capture on the calling thread.
+
+The recorded operations are ``get_by_id``, ``filter``, ``save``, ``delete``, ``save_multi``, ``delete_multi`` and
+``query`` (one per page fetched). Byte counts are the sizes of the stored property values, not including the framing
+of the datastore's wire format.
+"""
+from __future__ import absolute_import
+
+import bisect
+import datetime
+import functools
+import threading
+import time
+
+from .compiler import _overrides
+from .records import Record
+
+# The upper bounds, in seconds, of the latency histogram buckets. The last bucket holds everything slower.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Is anything recording? Checked by instrumented operations before doing any work.
+active = False
+
+_enabled = False
+_captures = 0
+_hooks = []
+_lock = threading.Lock()
+_local = threading.local()
+
+clock = time.time
+
+
+class Stats(object):
+    """The metrics recorded for one operation on one kind."""
+    def __init__(self):
+        self.calls = 0
+        self.entities = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, entities, size):
+        self.calls += 1
+        self.entities += entities
+        self.bytes += size
+        self.seconds += seconds
+        self.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, p):
+        """
+        Estimate a latency percentile from the histogram.
+
+        :param float p: the percentile, between 0 and 100.
+        :return: the upper bound of the bucket holding the percentile, in seconds. None if there are no calls, or the
+        percentile is slower than the last bucket.
+        """
+        if not self.calls:
+            return None
+
+        threshold = self.calls * p / 100.0
+        total = 0
+        for bound, count in zip(BUCKETS, self.histogram):
+            total += count
+            if total >= threshold:
+                return bound
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'entities': self.entities,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'histogram': list(self.histogram),
+        }
+
+
+class Registry(object):
+    """A thread-safe collection of :class:`Stats` by kind and operation."""
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, operation, seconds, entities=0, size=0):
+        """
+        Record one call of an operation.
+
+        :param str kind: the kind the operation touched.
+        :param str operation: the name of the operation.
+        :param float seconds: how long the call took.
+        :param int entities: the number of entities or values it handled.
+        :param int size: the number of bytes it read or wrote.
+        """
+        with self._lock:
+            stats = self._stats.get((kind, operation))
+            if stats is None:
+                stats = self._stats[(kind, operation)] = Stats()
+            stats.add(seconds, entities, size)
+
+    def get(self, kind, operation):
+        """
+        :return: the :class:`Stats` for an operation on a kind, or None if it hasn't been recorded.
+        """
+        return self._stats.get((kind, operation))
+
+    def snapshot(self):
+        """
+        :return: a dict of kind to a dict of operation to :func:`Stats.to_dict`.
+        """
+        with self._lock:
+            result = {}
+            for (kind, operation), stats in self._stats.items():
+                result.setdefault(kind, {})[operation] = stats.to_dict()
+            return result
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._stats.clear()
+
+
+_registry = Registry()
+
+
+def registry():
+    """
+    :return: the global :class:`Registry` that operations are recorded in while metrics are enabled.
+    """
+    return _registry
+
+
+def enable():
+    """Start recording operations, and property conversion times, in the global registry and hooks."""
+    global _enabled
+
+    from .model import Model
+
+    with _lock:
+        if _enabled:
+            return
+        _enabled = True
+        _update()
+        for cls in Model._kind_map.values():
+            instrument(cls)
+
+
+def disable():
+    """Stop recording globally and unwrap property conversions. What has been recorded is kept."""
+    global _enabled
+
+    from .model import Model
+
+    with _lock:
+        if not _enabled:
+            return
+        _enabled = False
+        _update()
+        for cls in Model._kind_map.values():
+            _uninstrument(cls)
+
+
+def is_enabled():
+    """
+    :return: True if metrics are being recorded globally.
+    """
+    return _enabled
+
+
+def add_hook(hook):
+    """
+    Call ``hook(kind, operation, seconds, entities, size)`` for every operation recorded while metrics are enabled.
+
+    :param func hook: the function to call. It's called on the thread that ran the operation.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Stop calling a hook added with :func:`add_hook`."""
+    _hooks.remove(hook)
+
+
+class capture(object):
+    """
+    A context manager that records the operations run by the current thread while it's active in a new
+    :class:`Registry`, which it returns. Captures can be nested.
+    """
+    def __enter__(self):
+        global _captures
+
+        self.registry = Registry()
+        stack = getattr(_local, 'captures', None)
+        if stack is None:
+            stack = _local.captures = []
+        stack.append(self.registry)
+        with _lock:
+            _captures += 1
+            _update()
+        return self.registry
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _captures
+
+        _local.captures.remove(self.registry)
+        with _lock:
+            _captures -= 1
+            _update()
+
+
+def record(kind, operation, started, entities=0, size=0):
+    """
+    Record an operation that started at ``started`` (from :func:`clock`) and has just finished. Instrumented code only
+    calls this when :data:`active` is set.
+    """
+    seconds = clock() - started
+    if _enabled:
+        _registry.record(kind, operation, seconds, entities, size)
+        for hook in _hooks:
+            hook(kind, operation, seconds, entities, size)
+    for r in getattr(_local, 'captures', ()):
+        r.record(kind, operation, seconds, entities, size)
+
+
+def record_entities(operation, started, entities):
+    """Record an operation on ``entities``, of any kinds, once for each kind with its share of the entities."""
+    by_kind = {}
+    for e in entities:
+        kind = by_kind.setdefault(e.key.kind if hasattr(e, 'key') else e.kind, [0, 0])
+        kind[0] += 1
+        kind[1] += entity_size(e)
+
+    for kind, (count, size) in by_kind.items():
+        record(kind, operation, started, count, size)
+
+
+def entity_size(e):
+    """
+    :return: the number of bytes of the stored values of an entity or record (0 for a key).
+    """
+    if isinstance(e, Record):
+        e = e.to_entity()
+    if not isinstance(e, dict):
+        return 0
+    return sum(len(name) + _value_size(value) for name, value in e.items())
+
+
+def _value_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, unicode):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, long, float, datetime.datetime)):
+        return 8
+    if isinstance(value, list):
+        return sum(_value_size(v) for v in value)
+    return 0
+
+
+def instrument(cls):
+    """Wrap the conversions of the properties of model class ``cls`` that do any work with timers."""
+    for name, prop in cls._properties.items():
+        for method, operation in (('_to_base_type', 'encode.'), ('_from_base_type', 'decode.')):
+            if _overrides(prop, method):
+                setattr(prop, method, _timed(getattr(prop, method), cls.__name__, operation + name, method))
+    cls._compile_codecs()
+
+
+def _uninstrument(cls):
+    for prop in cls._properties.values():
+        prop.__dict__.pop('_to_base_type', None)
+        prop.__dict__.pop('_from_base_type', None)
+    cls._compile_codecs()
+
+
+def _timed(convert, kind, operation, method):
+    @functools.wraps(convert)
+    def timed(value):
+        started = clock()
+        result = convert(value)
+        if active:
+            record(kind, operation, started, 1, _value_size(result if method == '_to_base_type' else value))
+        return result
+    return timed
+
+
+def _update():
+    global active
+
+    active = _enabled or _captures > 0
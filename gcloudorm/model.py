@@ -4,9 +4,25 @@ entities.
 """
 from __future__ import absolute_import
 
-from gcloud.datastore import api, entity, key
+import copy
 
-from .properties import IdProperty, IntegerProperty, Property, TextProperty
+from gcloud.datastore import entity, key
+
+from . import columns, decoding, metrics
+from .backends import get_backend
+from .batcher import current_batcher
+from .cache import DEFAULT_NEGATIVE_TTL, NOT_FOUND, LRUCache, SharedCache, SQLiteStore
+from .compiler import compile_decoder, compile_encoder
+from .futures import imap, submit
+from .properties import IdProperty, IntegerProperty, KeyProperty, Property, TextProperty
+from .query import Query
+from .records import record_class
+
+
+# The maximum number of mutations the datastore accepts in a single commit.
+MAX_BATCH_SIZE = 500
+# The maximum number of keys the datastore accepts in a single lookup.
+MAX_LOOKUP_SIZE = 1000
 
 
 class ObjectDoesNotExist(Exception):
@@ -42,11 +58,31 @@ class Model(entity.Entity):
     :class:`gcloudorm.properties.TextProperty` or :class:`gcloudorm.properties.IntegerProperty`, then a TypeError will
     be raised.
 
+    For integer ids reserved from the datastore in place of uuid4 hex strings, use an
+    :class:`gcloudorm.properties.AllocatedIdProperty` as the id, see :mod:`gcloudorm.ids`.
+
     Access to the model's key is via :attr:`.key`, and the id can be fetched using ``model.key.id_or_name``.
 
     To save/update an model, call :func:`.save` on it. To fetch a model by id, call :func:`.get_by_id`. To fetch
     multiple model instances at once, use :func:`.filter`. To delete a model instance from datastore, call :
-    func:`.delete`.
+    func:`.delete`. Many instances (of any kind) can be saved or deleted in batches using :func:`.save_multi` and
+    :func:`.delete_multi`, or queued from anywhere within a :func:`gcloudorm.batcher.batch` block.
+
+    To find instances by their property values, build a query with :func:`.query`.
+
+    Changes made through property attributes are tracked, see :attr:`.is_dirty` and :attr:`.changed_fields`. Saving
+    an instance that hasn't changed since it was loaded or last saved is skipped.
+
+    Each of these operations also has an ``_async`` variant that runs it in the background and returns a
+    :class:`gcloudorm.futures.Future`, so many can be in flight at once.
+
+    Reads through :func:`.get_by_id` and :func:`.filter` can be served from an in-process cache by calling
+    :func:`.enable_cache` on the model class, and from a cache shared between processes with
+    :func:`.enable_shared_cache`.
+
+    Entities are read and written through the current backend, see :mod:`gcloudorm.backends`.
+
+    Operations can be timed and counted per kind, see :mod:`gcloudorm.metrics`.
 
     This class shouldn't be used directly. Instead, it is intended to be extended by concrete model implementations.
     """
@@ -58,6 +94,13 @@ class Model(entity.Entity):
 
     _model_exclude_from_indexes = None
     _id_prop = None
+    _cache = None
+    _shared_cache = None
+    _related = None  # name: (stored key or keys, related instance or instances), see related()
+
+    # Compiled by MetaModel, see gcloudorm.compiler
+    _encode_values = None
+    _decode_values = None
 
     def __init__(self, parent=None, **kwargs):
         """
@@ -70,6 +113,9 @@ class Model(entity.Entity):
         :param kwargs: The value of the properties for this model. Unrecognised properties are ignored.
         :raises TypeError: if the id proper is the wrong type.
         """
+        self._decoded = {}  # name: (stored value, decoded value), see Property.__get__
+        self._changed = set(self._properties)  # names of the properties changed since the last load or save
+
         # Figure out the id value
         id_prop = self._properties[self._id_prop]
         id_value = kwargs.get(self._id_prop, None) or \
@@ -85,21 +131,17 @@ class Model(entity.Entity):
             self._key = key.Key(self.__class__.__name__, id_value)
         super(Model, self).__init__(self._key, exclude_from_indexes=self._model_exclude_from_indexes)
 
-        # Set our properties
-        for attr in self._properties:
-            setattr(self, attr, getattr(self, attr))
-
-        for name in self._properties:  # Don't store random properties
-            if name == self._id_prop:  # We already have the value of the id
-                setattr(self, name, id_value)
-            elif name in kwargs:
-                setattr(self, name, kwargs[name])
+        # Set our properties. Unrecognised ones are skipped and we already have the value of the id.
+        kwargs[self._id_prop] = id_value
+        dict.update(self, self._encode_values(kwargs))
 
     @classmethod
     def _fix_up_properties(cls):
         cls._properties = {}
         cls._model_exclude_from_indexes = set()
         cls._id_prop = None
+        cls._cache = None
+        cls._shared_cache = None
 
         for name, attr in cls.__dict__.items():
             if isinstance(attr, Property):
@@ -128,8 +170,16 @@ class Model(entity.Entity):
                 cls._properties['id'] = attr
             cls._id_prop = 'id'
 
+        cls._compile_codecs()
+        if metrics.is_enabled():
+            metrics.instrument(cls)
         cls._kind_map[cls.__name__] = cls
 
+    @classmethod
+    def _compile_codecs(cls):
+        cls._encode_values = staticmethod(compile_encoder(cls))
+        cls._decode_values = staticmethod(compile_decoder(cls))
+
     @classmethod
     def _lookup_model(cls, kind):
         return cls._kind_map[kind]
@@ -152,17 +202,24 @@ class Model(entity.Entity):
         """
         Create an instance of Model ``cls`` from entity ``e``.
 
+        This is the trusted hydration path for entities read from the datastore: ``e``'s key and stored values are used
+        as they are, so no validation or conversion is done and defaults aren't evaluated. Properties missing from
+        ``e`` are set to None. To build an instance from external values, use the constructor instead.
+
         :param Model cls: the class object to create and instance of.
         :param Entity e: the entity to use as a base.
         :return: a new instance of cls using e.
         """
-        kwargs = {name: e.get(name) for name, prop in cls._properties.items() if prop.is_id}  # we need the id value
-        obj = cls(**kwargs)
+        obj = cls.__new__(cls)
+        entity.Entity.__init__(obj, e.key, exclude_from_indexes=cls._model_exclude_from_indexes)
         obj._key = e.key
+        obj._decoded = {}
+        obj._changed = set()
 
-        for name, prop in cls._properties.items():  # set values
-            if not prop.is_id:
-                obj[name] = e.get(name)
+        get = e.get
+        dict.update(obj, ((name, get(name)) for name in cls._properties))
+        if obj[cls._id_prop] is None:  # we need the id value
+            obj[cls._id_prop] = e.key.id_or_name
 
         return obj
 
@@ -174,26 +231,554 @@ class Model(entity.Entity):
         :param id: The id of the entity to fetch
         :return: The model instance.
         """
-        e = api.get([key.Key(cls.__name__, id)])
-        if e:
-            return cls.from_entity(e[0])
+        started = metrics.clock() if metrics.active else None
+        obj = cls._get_multi([key.Key(cls.__name__, id)])[0]
+        if started is not None:
+            metrics.record(cls.__name__, 'get_by_id', started, int(obj is not None), metrics.entity_size(obj))
+        if obj is not None:
+            return obj
         raise ObjectDoesNotExist
 
     @classmethod
-    def filter(cls, ids):
+    def filter(cls, ids, shard_size=MAX_LOOKUP_SIZE, concurrency=1, compact=False, prefetch_related=()):
         """
         Get the entities identified by ids.
 
+        The ids are looked up in shards of at most ``shard_size`` keys. If ``concurrency`` is greater than 1, that many
+        shards are fetched in parallel on a thread pool, and the entities of each shard are hydrated as soon as it
+        arrives while later shards are still in flight. The connection in use must then be safe to share between
+        threads. If the model's cache is enabled only the ids that aren't cached are fetched. Heavy property values may
+        be decoded in a process pool, see :mod:`gcloudorm.decoding`.
+
         :param list ids: The ids to fetch.
-        :return: a list of Model instances
+        :param int shard_size: The maximum number of ids to look up per RPC.
+        :param int concurrency: The maximum number of lookups to have in flight at once.
+        :param bool compact: return read-only :class:`gcloudorm.records.Record` objects, which take much less memory,
+        instead of model instances? Defaults to False. Compact reads don't use the in-process cache.
+        :param list prefetch_related: names of :class:`gcloudorm.properties.KeyProperty` properties whose referenced
+        instances are fetched for all of the results in one lookup, see :func:`prefetch_related`.
+        :return: a list of Model instances, in the same order as ``ids``. Ids that don't exist are skipped.
+        :raises ValueError: if ``prefetch_related`` is given for a compact read.
+        """
+        if compact and prefetch_related:
+            raise ValueError("Compact records can't have related instances prefetched.")
+
+        started = metrics.clock() if metrics.active else None
+        keys = [key.Key(cls.__name__, i) for i in ids]
+        results = [obj for obj in cls._get_multi(keys, shard_size, concurrency, compact) if obj is not None]
+        if decoding.active and not compact:
+            decoding.decode(cls, results)
+        if prefetch_related:
+            prefetch(results, prefetch_related, shard_size, concurrency)
+        if started is not None:
+            metrics.record(cls.__name__, 'filter', started, len(results), sum(map(metrics.entity_size, results)))
+        return results
+
+    @classmethod
+    def filter_columns(cls, ids, names=None, shard_size=MAX_LOOKUP_SIZE, concurrency=1):
+        """
+        Get the entities identified by ids as a NumPy array per property, without building a model instance for each.
+        See :mod:`gcloudorm.columns`.
+
+        :param list ids: The ids to fetch. Ids that don't exist are skipped.
+        :param list names: the properties to return. Defaults to all of them.
+        :param int shard_size: The maximum number of ids to look up per RPC.
+        :param int concurrency: The maximum number of lookups to have in flight at once.
+        :return: a dict of property name to :class:`numpy.ma.MaskedArray`, in the same order as ``ids``.
+        """
+        started = metrics.clock() if metrics.active else None
+        keys = [key.Key(cls.__name__, i) for i in ids]
+        entities = [e for e in cls._get_multi(keys, shard_size, concurrency, raw=True) if e is not None]
+        result = columns.to_columns(cls, entities, names)
+        if started is not None:
+            metrics.record(cls.__name__, 'filter', started, len(entities), sum(map(metrics.entity_size, entities)))
+        return result
+
+    @classmethod
+    def to_columns(cls, rows, names=None):
+        """
+        Copy the values of model instances or records of this model into a NumPy array per property. See
+        :mod:`gcloudorm.columns`.
+
+        :param list rows: the instances or :class:`gcloudorm.records.Record` objects.
+        :param list names: the properties to return. Defaults to all of them.
+        :return: a dict of property name to :class:`numpy.ma.MaskedArray`.
+        """
+        rows = list(rows)
+        for row in rows:
+            if isinstance(row, Model):
+                row._flush_decoded()  # Pick up values changed in place
+        return columns.to_columns(cls, rows, names)
+
+    @classmethod
+    def query(cls, ancestor=None):
+        """
+        Start a query for instances of this model. See :class:`gcloudorm.query.Query`.
+
+        :param ancestor: a :class:`gcloud.datastore.key.Key` or model instance the results must descend from.
+        :return: a :class:`gcloudorm.query.Query` with no filters.
+        """
+        return Query(cls, ancestor=ancestor)
+
+    @classmethod
+    def _get_multi(cls, keys, shard_size=MAX_LOOKUP_SIZE, concurrency=1, compact=False, raw=False):
+        """
+        Get the instances, or records if ``compact``, or the entities as read if ``raw``, for keys of kind ``cls``,
+        using the caches if enabled. Compact and raw reads skip the in-process cache. Misses are returned as None.
+        """
+        if raw:
+            hydrate = _entity
+        else:
+            hydrate = record_class(cls).from_entity if compact else cls.from_entity
+        cache, shared = None if compact or raw else cls._cache, cls._shared_cache
+        if cache is None and shared is None:
+            return cls._fetch(keys, shard_size, concurrency, hydrate)
+
+        results = [cache.get(k.flat_path) for k in keys] if cache is not None else [None] * len(keys)
+        # Cached instances are copied on the way in and out, so callers' unsaved changes don't leak to each other
+        results = [copy.copy(obj) if obj is not None else None for obj in results]
+        missing = [i for i, obj in enumerate(results) if obj is None]
+        fetch = missing
+        if shared is not None and missing:
+            found, versions = shared.get_many([keys[i] for i in missing])
+            for i, e in zip(missing, found):
+                if e is not None and e is not NOT_FOUND:
+                    results[i] = hydrate(e)
+            fetch = [i for i, e in zip(missing, found) if e is None]
+            versions = [version for e, version in zip(found, versions) if e is None]
+
+        fetch_keys = [keys[i] for i in fetch]
+        fetched = cls._fetch(fetch_keys, shard_size, concurrency, hydrate)
+        for i, obj in zip(fetch, fetched):
+            results[i] = obj
+        if shared is not None and fetch:
+            if compact:
+                fetched = [obj.to_entity() if obj is not None else None for obj in fetched]
+            shared.add_many(fetch_keys, fetched, versions)
+
+        if cache is not None:
+            for i in missing:
+                if results[i] is not None:
+                    cache.set(keys[i].flat_path, copy.copy(results[i]))
+
+        return results
+
+    @classmethod
+    def _fetch(cls, keys, shard_size, concurrency, hydrate):
+        """Look keys up in shards and hydrate the results, in the order of ``keys`` with None for misses."""
+        lookup = get_backend().get
+        shards = _chunks(keys, shard_size)
+        if concurrency > 1 and len(shards) > 1:
+            return [hydrate(e) if e else None for entities in imap(lookup, shards, concurrency) for e in entities]
+
+        return [hydrate(e) if e else None for shard in shards for e in lookup(shard)]
+
+    @classmethod
+    def enable_cache(cls, max_size=1000, ttl=None):
+        """
+        Serve :func:`.get_by_id` and :func:`.filter` for this model from an in-process LRU cache keyed by the full key
+        path. Cached entries are invalidated when the entity is saved or deleted by this process, but not when it's
+        changed elsewhere, so use ``ttl`` to bound how stale an entry can get.
+
+        Each read of a cached entity gets its own copy of the cached instance, so changes to it that haven't been
+        saved aren't seen by other reads.
+
+        :param int max_size: the maximum number of instances to cache. Defaults to 1000.
+        :param float ttl: the number of seconds an instance is cached for. Defaults to None, meaning no expiry.
+        :return: the :class:`gcloudorm.cache.LRUCache`. Its ``hits``, ``misses`` and ``evictions`` counters can be
+        read directly or through its ``stats()`` method.
+        """
+        cls._cache = LRUCache(max_size, ttl)
+        return cls._cache
+
+    @classmethod
+    def disable_cache(cls):
+        """Stop caching instances of this model and drop the cache."""
+        cls._cache = None
+
+    @classmethod
+    def enable_shared_cache(cls, store=None, negative=True, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """
+        Serve :func:`.get_by_id` and :func:`.filter` for this model from a cache shared by all processes using the same
+        ``store``, behind the in-process cache if that's enabled too. Entities are cached in their stored form, along
+        with the ids found not to exist. Saves and deletes by any process using the store invalidate its entries, and
+        versioning stops a read that raced with a write from caching the old entity.
+
+        Only processes that have enabled the shared cache for this model invalidate its entries, so every process that
+        writes this model should enable it. Changes made by other writers are only seen once entries expire: the
+        store's ``ttl`` for entities, and ``negative_ttl`` for ids found not to exist.
+
+        :param SharedStore store: a :class:`gcloudorm.cache.SharedStore`. Defaults to a
+        :class:`gcloudorm.cache.SQLiteStore` in shared memory, private to the current user.
+        :param bool negative: cache that ids don't exist? Defaults to True.
+        :param float negative_ttl: the number of seconds that an id doesn't exist is cached for. Defaults to
+        :data:`gcloudorm.cache.DEFAULT_NEGATIVE_TTL`.
+        :return: the :class:`gcloudorm.cache.SharedCache`.
+        """
+        cls._shared_cache = SharedCache(store if store is not None else SQLiteStore(), negative, negative_ttl)
+        return cls._shared_cache
+
+    @classmethod
+    def disable_shared_cache(cls):
+        """Stop using the shared cache for this model. Its entries are left in the store."""
+        cls._shared_cache = None
+
+    def to_dict(self):
+        """
+        Get the values of all of this model's properties.
+
+        :return: a dict of property name to (decoded) value. Repeated values are plain lists.
+        """
+        return self._decode_values(self, self._decoded)
+
+    def related(self, name):
+        """
+        Get the instance referenced by a :class:`gcloudorm.properties.KeyProperty`, fetching it unless it was
+        prefetched or has been read before.
+
+        :param str name: the name of the property.
+        :return: the referenced model instance, or None if the property isn't set or the entity doesn't exist. For a
+        repeated property, a list of them.
+        :raises ValueError: if the property isn't a :class:`gcloudorm.properties.KeyProperty`.
+        """
+        value = _reference(self, name)
+        resolved = self._related.get(name) if self._related is not None else None
+        if resolved is None or resolved[0] != value:
+            prefetch([self], [name])
+            resolved = self._related[name]
+        return resolved[1]
+
+    def _flush_decoded(self):
+        """Re-encode memoized property values that may have been changed in place, ready for a put."""
+        for name in self._decoded.keys():
+            self._properties[name]._flush_decoded(self)
+
+    def __getstate__(self):
+        # Memoized decoded values aren't pickled, so values changed in place are encoded first.
+        self._flush_decoded()
+        return dict(self.__dict__, _decoded={})
+
+    def __copy__(self):
         """
-        entities = api.get([key.Key(cls.__name__, i) for i in ids])
-        return [cls.from_entity(e) for e in entities if e]
+        :return: a shallow copy of this instance. It tracks its changes separately, so saving either doesn't affect
+        which changes the other saves.
+        """
+        self._flush_decoded()
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj._decoded = {}
+        obj._changed = set(self._changed)
+        if self._related is not None:
+            obj._related = dict(self._related)
+        # Stored lists are changed in place through RepeatedList, so they aren't shared either
+        dict.update(obj, ((name, list(value) if isinstance(value, list) else value) for name, value in self.items()))
+        return obj
+
+    def __deepcopy__(self, memo):
+        """
+        :return: a deep copy of this instance, which tracks its changes separately.
+        """
+        self._flush_decoded()
+        obj = self.__class__.__new__(self.__class__)
+        memo[id(self)] = obj
+        obj.__dict__.update(copy.deepcopy(dict(self.__dict__, _decoded={}), memo))
+        dict.update(obj, copy.deepcopy(dict(self), memo))
+        return obj
+
+    @property
+    def is_dirty(self):
+        """Has this instance changed since it was loaded or last saved? New instances are always dirty."""
+        self._flush_decoded()
+        return bool(self._changed)
+
+    @property
+    def changed_fields(self):
+        """The names of the properties changed since this instance was loaded or last saved."""
+        self._flush_decoded()
+        return frozenset(self._changed)
+
+    def _prepare_for_put(self, force=False):
+        """Get this instance ready to be written. Returns False if nothing has changed, so the put can be skipped."""
+        self._flush_decoded()
+        if not (force or self._changed):
+            return False
+
+        for prop in self._properties.values():
+            prop._prepare_for_put(self)
+        return True
+
+    def save(self, force=False):
+        """
+        Save this model instance to the datastore, unless it hasn't changed since it was loaded or last saved. Inside a
+        :func:`gcloudorm.batcher.batch` the save is queued instead, see :class:`gcloudorm.batcher.WriteBatcher`.
 
-    def save(self):
-        """Save this model instance to the datastore."""
-        return api.put([self])
+        :param bool force: save even if the instance hasn't changed? Defaults to False.
+        """
+        batcher = current_batcher()
+        if batcher is not None:
+            return batcher.save(self, force)
+
+        if self._prepare_for_put(force):
+            _put([self], 1, 'save')
 
     def delete(self):
-        """Remove this model instance from the datastore."""
-        return api.delete([self._key])
+        """
+        Remove this model instance from the datastore. Inside a :func:`gcloudorm.batcher.batch` the delete is queued
+        instead.
+        """
+        batcher = current_batcher()
+        if batcher is not None:
+            return batcher.delete(self._key)
+
+        _delete([self._key], 1, 'delete')
+
+    @classmethod
+    def save_multi(cls, instances, batch_size=MAX_BATCH_SIZE, force=False):
+        """
+        Save many model instances to the datastore using as few RPCs as possible.
+
+        The instances don't need to be of the same kind. They are written in batches of at most ``batch_size``
+        entities, which defaults to the datastore's limit on mutations per commit. Instances that haven't changed
+        since they were loaded or last saved are skipped.
+
+        :param list instances: the model instances to save.
+        :param int batch_size: the maximum number of entities to write per RPC.
+        :param bool force: save instances even if they haven't changed? Defaults to False.
+        :return: a list with the key of each instance, in the same order as ``instances``.
+        """
+        instances = list(instances)
+        _put([instance for instance in instances if instance._prepare_for_put(force)], batch_size, 'save_multi')
+        return [instance.key for instance in instances]
+
+    @classmethod
+    def delete_multi(cls, instances_or_ids, batch_size=MAX_BATCH_SIZE):
+        """
+        Remove many entities from the datastore using as few RPCs as possible.
+
+        Each item can be a model instance (of any kind), a :class:`gcloud.datastore.key.Key` or the id of an entity of
+        kind ``cls``. The deletes are sent in batches of at most ``batch_size`` keys.
+
+        :param list instances_or_ids: the instances, keys or ids to delete.
+        :param int batch_size: the maximum number of entities to delete per RPC.
+        :return: a list with the key deleted for each item, in the same order as ``instances_or_ids``.
+        """
+        keys = [cls._key_for(item) for item in instances_or_ids]
+        _delete(keys, batch_size, 'delete_multi')
+        return keys
+
+    @classmethod
+    def get_by_id_async(cls, id):
+        """
+        Start getting the entity identified by id in the background. See :func:`.get_by_id`.
+
+        :return: a :class:`gcloudorm.futures.Future` for the model instance.
+        """
+        return submit(cls.get_by_id, id)
+
+    @classmethod
+    def filter_async(cls, ids, **kwargs):
+        """
+        Start getting the entities identified by ids in the background. See :func:`.filter`.
+
+        :return: a :class:`gcloudorm.futures.Future` for the list of model instances.
+        """
+        return submit(cls.filter, ids, **kwargs)
+
+    def save_async(self, force=False):
+        """
+        Start saving this model instance in the background. Don't change it until the save has finished.
+
+        :return: a :class:`gcloudorm.futures.Future` for the save.
+        """
+        return submit(self.save, force)
+
+    def delete_async(self):
+        """
+        Start removing this model instance from the datastore in the background.
+
+        :return: a :class:`gcloudorm.futures.Future` for the delete.
+        """
+        return submit(self.delete)
+
+    @classmethod
+    def save_multi_async(cls, instances, batch_size=MAX_BATCH_SIZE, force=False):
+        """
+        Start saving many model instances in the background. See :func:`.save_multi`.
+
+        :return: a :class:`gcloudorm.futures.Future` for the list of keys.
+        """
+        return submit(cls.save_multi, list(instances), batch_size, force)
+
+    @classmethod
+    def delete_multi_async(cls, instances_or_ids, batch_size=MAX_BATCH_SIZE):
+        """
+        Start removing many entities in the background. See :func:`.delete_multi`.
+
+        :return: a :class:`gcloudorm.futures.Future` for the list of keys deleted.
+        """
+        return submit(cls.delete_multi, list(instances_or_ids), batch_size)
+
+    @classmethod
+    def _key_for(cls, item):
+        """Resolve a model instance, key or id of kind ``cls`` to a key."""
+        if isinstance(item, Model):
+            return item._key
+        if isinstance(item, key.Key):
+            return item
+        return key.Key(cls.__name__, item)
+
+
+def get_multi(keys, shard_size=MAX_LOOKUP_SIZE, concurrency=1):
+    """
+    Get the entities for keys of any mix of kinds, including keys with ancestors, in as few lookups as possible. Each
+    entity is returned as an instance of the model registered for its kind. Kinds whose models have a cache enabled
+    are read through it, see :func:`Model.filter`.
+
+    :param list keys: the :class:`gcloud.datastore.key.Key` objects to fetch.
+    :param int shard_size: The maximum number of keys to look up per RPC.
+    :param int concurrency: The maximum number of lookups to have in flight at once.
+    :return: a list of model instances in the same order as ``keys``, with None for keys that don't exist.
+    :raises ValueError: if there's no model for the kind of one of the keys.
+    """
+    started = metrics.clock() if metrics.active else None
+    keys = list(keys)
+    models = []
+    for k in keys:
+        model = Model._kind_map.get(k.kind)
+        if model is None:
+            raise ValueError('There is no model for the kind %s.' % k.kind)
+        models.append(model)
+
+    results = [None] * len(keys)
+    cached = {}
+    uncached = []
+    for i, model in enumerate(models):
+        if model._cache is not None or model._shared_cache is not None:
+            cached.setdefault(model, []).append(i)
+        else:
+            uncached.append(i)
+
+    fetched = Model._fetch([keys[i] for i in uncached], shard_size, concurrency, _hydrate)
+    for i, obj in zip(uncached, fetched):
+        results[i] = obj
+    for model, indexes in cached.items():
+        for i, obj in zip(indexes, model._get_multi([keys[i] for i in indexes], shard_size, concurrency)):
+            results[i] = obj
+
+    if decoding.active:
+        by_model = {}
+        for model, obj in zip(models, results):
+            if obj is not None:
+                by_model.setdefault(model, []).append(obj)
+        for model, instances in by_model.items():
+            decoding.decode(model, instances)
+    if started is not None:
+        metrics.record_entities('get_multi', started, [obj for obj in results if obj is not None])
+    return results
+
+
+def prefetch(instances, names, shard_size=MAX_LOOKUP_SIZE, concurrency=1):
+    """
+    Fetch the instances referenced by :class:`gcloudorm.properties.KeyProperty` properties of many instances in one
+    batched lookup (see :func:`get_multi`), and attach them so :func:`Model.related` returns them without an RPC. Each
+    entity is fetched once however many instances reference it.
+
+    :param list instances: the model instances, of any kinds. None entries are skipped.
+    :param list names: the names of the properties to resolve. Instances without a property of that name are skipped.
+    :param int shard_size: The maximum number of keys to look up per RPC.
+    :param int concurrency: The maximum number of lookups to have in flight at once.
+    :raises ValueError: if one of the properties isn't a :class:`gcloudorm.properties.KeyProperty`.
+    """
+    references = []
+    keys = {}
+    for obj in instances:
+        if obj is None:
+            continue
+        for name in names:
+            if name not in obj._properties:
+                continue
+            value = _reference(obj, name)
+            references.append((obj, name, value))
+            for k in (value if isinstance(value, list) else [value]):
+                if k is not None:
+                    keys.setdefault((k.namespace, k.flat_path), k)
+
+    found = dict(zip(keys, get_multi(keys.values(), shard_size, concurrency)))
+
+    def resolve(k):
+        return found[(k.namespace, k.flat_path)] if k is not None else None
+
+    for obj, name, value in references:
+        if obj._related is None:
+            obj._related = {}
+        obj._related[name] = (value, [resolve(k) for k in value] if isinstance(value, list) else resolve(value))
+
+
+def _reference(obj, name):
+    """The stored key, or a copy of the stored list of keys, of KeyProperty name of obj."""
+    prop = obj._properties.get(name)
+    if not isinstance(prop, KeyProperty):
+        raise ValueError('%s.%s is not a KeyProperty.' % (type(obj).__name__, name))
+    prop._flush_decoded(obj)  # Pick up changes to a repeated property's list
+    value = obj.get(name)
+    return list(value) if isinstance(value, list) else value
+
+
+def _hydrate(e):
+    """Create an instance of the model registered for e's kind."""
+    return Model._kind_map[e.key.kind].from_entity(e)
+
+
+def _put(instances, batch_size, operation):
+    """Write instances that are ready to be put in batches, marking them clean as each batch succeeds."""
+    started = metrics.clock() if metrics.active else None
+    backend = get_backend()
+    try:
+        for batch in _chunks(instances, batch_size):
+            backend.put(batch)
+            for instance in batch:
+                instance._changed.clear()
+    finally:
+        _invalidate([instance._key for instance in instances])
+    if started is not None:
+        metrics.record_entities(operation, started, instances)
+
+
+def _delete(keys, batch_size, operation):
+    """Delete the entities for keys in batches."""
+    started = metrics.clock() if metrics.active else None
+    backend = get_backend()
+    try:
+        for batch in _chunks(keys, batch_size):
+            backend.delete(batch)
+    finally:
+        _invalidate(keys)
+    if started is not None:
+        metrics.record_entities(operation, started, keys)
+
+
+def _invalidate(keys):
+    """Drop the cached instances, of any kind, for keys."""
+    shared = {}
+    for k in keys:
+        model = Model._kind_map.get(k.kind)
+        if model is not None and model._cache is not None:
+            model._cache.delete(k.flat_path)
+        if model is not None and model._shared_cache is not None:
+            shared.setdefault(model._shared_cache, []).append(k)
+
+    for cache, cache_keys in shared.items():
+        cache.invalidate_many(cache_keys)
+
+
+def _chunks(items, size):
+    """Split ``items`` into a list of successive slices with at most ``size`` elements each."""
+    if size < 1:
+        raise ValueError('Batch size must be at least 1.')
+
+    return [items[start:start + size] for start in xrange(0, len(items), size)]
+
+
+def _entity(e):
+    """Hydrate an entity as itself, for reads that decode the stored values directly."""
+    return e
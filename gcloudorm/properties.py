@@ -3,7 +3,10 @@ import datetime
 import json
 import six
 import uuid
-import zlib
+
+from gcloud.datastore import key
+
+from . import compression
 
 
 class Property(object):
@@ -15,8 +18,17 @@ class Property(object):
     * :attr:`indexed` whether this property is indexed
     * :attr:`is_id` is this property being used as the id for a model?
 
+    Values are converted from their stored form with :func:`from_base_type` when read. Where that conversion builds a
+    new object (repeated properties, and properties that override :func:`_from_base_type`) the result is memoized on the
+    model instance until the property is set or deleted. Reads therefore return the same object, and in-place changes
+    to a mutable value (a repeated property's :class:`RepeatedList`, or a :class:`PickleProperty` or
+    :class:`JsonProperty` value) are re-encoded when the instance is saved.
+
     This class shouldn't be used directly. Instead, it is intended to be extended by concrete property implementations.
     """
+    # Can values of this property be changed in place once decoded?
+    _mutable = False
+
     def __init__(self, indexed=True, repeated=False, required=False, default=None, choices=None, validator=None,
                  key_id=False):
         """
@@ -39,23 +51,42 @@ class Property(object):
         self._choices = choices
         self._validator = validator
         self._is_id = key_id
+        self._memoize = False
 
     def __get__(self, instance, owner):
-        if self._repeated:
-            if self._name not in instance:
-                self.__set__(instance, self._default or [])
-
-            return [self.from_base_type(k) for k in instance[self._name]]
+        if instance is None:
+            return self
 
         if self._name not in instance:
-            if callable(self._default):
+            if self._repeated:
+                self.__set__(instance, self._default or [])
+            elif callable(self._default):
                 self.__set__(instance, self._default())
             else:
                 self.__set__(instance, self._default)
 
-        return self.from_base_type(instance[self._name])
+        value = instance[self._name]
+        if not self._memoize:
+            return self.from_base_type(value)
+
+        # Decoded values are memoized per instance along with the stored value they came from, so the memo stays
+        # correct even if the stored value is replaced without going through __set__.
+        decoded = instance._decoded.get(self._name)
+        if decoded is not None and decoded[0] is value:
+            return decoded[1]
+
+        if self._repeated:
+            if value is None:  # The datastore drops empty lists
+                value = instance[self._name] = []
+            result = RepeatedList(self, value)
+        else:
+            result = self.from_base_type(value)
+        instance._decoded[self._name] = (value, result)
+        return result
 
     def __set__(self, instance, value):
+        instance._decoded.pop(self._name, None)
+        instance._changed.add(self._name)
         if self._repeated:
             assert isinstance(value, (tuple, list)), "Repeated property only accept list or tuple"
             value = [self.validate(k) for k in value]
@@ -65,6 +96,8 @@ class Property(object):
             instance[self._name] = self.to_base_type(value)
 
     def __delete__(self, instance):
+        instance._decoded.pop(self._name, None)
+        instance._changed.add(self._name)
         instance.pop(self._name, None)
 
     @property
@@ -125,6 +158,31 @@ class Property(object):
 
     def _fix_up(self, cls, name):
         self._name = name
+        self._memoize = self._repeated or \
+            getattr(type(self)._from_base_type, '__func__', None) is not Property._from_base_type.__func__
+
+    def _flush_decoded(self, instance):
+        """
+        Re-encode this property's memoized value on instance if it's mutable, as it may have been changed in place.
+        """
+        decoded = instance._decoded.get(self._name)
+        if decoded is not None and self._repeated and instance.get(self._name) is decoded[0]:
+            if decoded[1]._write_back():
+                instance._changed.add(self._name)
+        elif decoded is not None and self._mutable and instance.get(self._name) is decoded[0]:
+            encoded = self.to_base_type(self.validate(decoded[1]))
+            # Values stored in an older format are kept as they are unless they've changed
+            if encoded != decoded[0] and not self._same(decoded[0], decoded[1]):
+                instance[self._name] = encoded
+                instance._changed.add(self._name)
+                instance._decoded[self._name] = (encoded, decoded[1])
+
+    def _same(self, stored, value):
+        """Does the stored value decode to value? Used when it's been encoded differently from how value would be."""
+        return self.from_base_type(stored) == value
+
+    def _prepare_for_put(self, entity):
+        """Called on each property of a changed model instance just before it's written."""
 
     def _to_base_type(self, value):
         return value
@@ -136,6 +194,81 @@ class Property(object):
         return value
 
 
+# Marks elements of a RepeatedList whose stored form isn't known.
+_UNENCODED = object()
+
+
+class RepeatedList(list):
+    """
+    The value of a repeated property: a list of its decoded elements. It's built when the property is first read and
+    memoized on the instance, so later reads don't decode the elements again. Changes made through it are written back
+    to the instance's stored list, in place, when it's saved (or its changes are checked). Only the elements that were
+    added or replaced are validated and encoded, along with mutable elements, which may have been changed in place.
+
+    Copies and pickles of the list are plain lists.
+    """
+    def __init__(self, prop, stored, items=None):
+        """
+        :param Property prop: the repeated property.
+        :param list stored: the property's stored list, which changes are written back to in place.
+        :param list items: the decoded elements, if they're already known.
+        """
+        super(RepeatedList, self).__init__(items if items is not None else [prop.from_base_type(v) for v in stored])
+        self._prop = prop
+        self._stored = stored
+        self._synced = None  # The elements and their stored forms before the first unsaved change
+
+    def _change(self):
+        if self._synced is None:
+            self._synced = (list(self), list(self._stored))
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+    def __reduce__(self):
+        return self.__reduce_ex__(2)
+
+    def _write_back(self):
+        """Encode what has changed into the stored list. Returns True if the stored list changed."""
+        prop = self._prop
+        if self._synced is None:
+            if not prop._mutable:
+                return False
+            known = None
+        else:
+            # Elements that were there before are recognised by identity, so they aren't validated or encoded again
+            known = {id(item): raw for item, raw in zip(*self._synced)}
+
+        stored = []
+        for i, item in enumerate(self):
+            raw = self._stored[i] if known is None else known.get(id(item), _UNENCODED)
+            if raw is _UNENCODED:
+                raw = prop.to_base_type(prop.validate(item))
+            elif prop._mutable and prop.to_base_type(item) != raw and not prop._same(raw, item):
+                raw = prop.to_base_type(prop.validate(item))
+            stored.append(raw)
+
+        self._synced = None
+        if stored == self._stored:
+            return False
+        self._stored[:] = stored
+        return True
+
+
+def _mutator(method):
+    def mutate(self, *args, **kwargs):
+        self._change()
+        return method(self, *args, **kwargs)
+    mutate.__name__ = method.__name__
+    mutate.__doc__ = method.__doc__
+    return mutate
+
+
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__', 'append', 'extend',
+              'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(RepeatedList, _name, _mutator(getattr(list, _name)))
+
+
 class BooleanProperty(Property):
     """A bool property."""
     def _validate(self, value):
@@ -165,6 +298,38 @@ class IntegerProperty(Property):
         return int(value)
 
 
+class AllocatedIdProperty(IntegerProperty):
+    """
+    An auto generated id property that uses integer ids reserved from the datastore for its value, handed out by a
+    :class:`gcloudorm.ids.IdPool` for the model's kind. The pool is available as :attr:`pool` once the model is
+    defined.
+    """
+    def __init__(self, key_id=True, block_size=None, low_water=None, allocator=None):
+        """
+        Initialise this property. Default behaviour is to set key_id to True.
+
+        :param bool key_id: is this property the key_id?  Defaults to True.
+        :param int block_size: the number of ids to reserve at a time. Defaults to
+        :data:`gcloudorm.ids.DEFAULT_BLOCK_SIZE`.
+        :param int low_water: the number of ids left in the pool at which the next block is reserved. Defaults to half
+        of ``block_size``.
+        :param func allocator: a function taking a kind and a count and returning a list of reserved ids. Defaults to
+        reserving them through the current backend.
+        """
+        super(AllocatedIdProperty, self).__init__(indexed=True, key_id=key_id)
+        self._pool_options = {'low_water': low_water, 'allocator': allocator}
+        if block_size is not None:
+            self._pool_options['block_size'] = block_size
+        self.pool = None
+
+    def _fix_up(self, cls, name):
+        from .ids import IdPool  # ids imports metrics, which imports this module
+
+        super(AllocatedIdProperty, self)._fix_up(cls, name)
+        self.pool = IdPool(cls.__name__, **self._pool_options)
+        self._default = self.pool.next
+
+
 class FloatProperty(Property):
     """A float property."""
     def _validate(self, value):
@@ -174,19 +339,27 @@ class FloatProperty(Property):
 
 class BlobProperty(Property):
     """Store data as bytes. Supports compression."""
-    def __init__(self, compressed=False, **kwargs):
+    def __init__(self, compressed=False, indexed=False, codec='zlib', level=None,
+                 min_size=compression.DEFAULT_MIN_SIZE, **kwargs):
         """
-        Initialise this property. Has an option to compress using zlib that defaults to False. **Note** that this
-        property can't be compressed and indexed!
+        Initialise this property. Has an option to compress that defaults to False. **Note** that this property can't
+        be compressed and indexed! See :mod:`gcloudorm.compression` for the available codecs.
 
         :param bool compressed: should this property store its value compressed? Defaults to False.
+        :param bool indexed: should this field be indexed? Defaults to False.
+        :param str codec: the name of the codec to compress with. Defaults to zlib.
+        :param int level: the compression level, or None for the codec's default.
+        :param int min_size: values shorter than this many bytes are stored uncompressed. Defaults to
+        :data:`gcloudorm.compression.DEFAULT_MIN_SIZE`.
         """
-        kwargs.pop('indexed', None)
-        super(BlobProperty, self).__init__(indexed=False, **kwargs)
+        super(BlobProperty, self).__init__(indexed=indexed, **kwargs)
 
         self._compressed = compressed
         assert not (compressed and self._indexed), \
             "BlobProperty %s cannot be compressed and indexed at the same time." % self._name
+        self._codec = compression.get_codec(codec).name
+        self._level = level
+        self._min_size = min_size
 
     def _validate(self, value):
         assert isinstance(value, str), value
@@ -194,19 +367,19 @@ class BlobProperty(Property):
 
     def _to_base_type(self, value):
         if self._compressed:
-            return zlib.compress(value)
+            return compression.compress(value, self._codec, self._level, self._min_size)
 
         return value
 
     def _from_base_type(self, value):
         if self._compressed:
-            return zlib.decompress(value)
+            return compression.decompress(value)
 
         return value
 
 
 class TextProperty(BlobProperty):
-    """Store data as unicode."""
+    """Store data as unicode. When compressed, values are stored as compressed UTF-8 bytes."""
     def __init__(self, indexed=False, **kwargs):
         super(TextProperty, self).__init__(indexed=indexed, **kwargs)
 
@@ -219,12 +392,19 @@ class TextProperty(BlobProperty):
 
     def _to_base_type(self, value):
         if isinstance(value, str):
-            return value.decode('utf-8')
+            value = value.decode('utf-8')
+
+        if self._compressed:
+            data = value.encode('utf-8')
+            if len(data) >= self._min_size:  # Short values are stored as unicode, which doesn't need a header
+                return compression.compress(data, self._codec, self._level)
 
         return value
 
     def _from_base_type(self, value):
         if isinstance(value, str):
+            if self._compressed:
+                value = compression.decompress(value)
             return unicode(value, 'utf-8')
         elif isinstance(value, unicode):
             return value
@@ -232,6 +412,8 @@ class TextProperty(BlobProperty):
 
 class PickleProperty(BlobProperty):
     """Store data as pickle. Takes care of (un)pickling."""
+    _mutable = True
+
     def _to_base_type(self, value):
         return super(PickleProperty, self)._to_base_type(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
 
@@ -244,8 +426,10 @@ class PickleProperty(BlobProperty):
 
 class JsonProperty(BlobProperty):
     """Store data as JSON. Takes care of conversion to/from JSON."""
+    _mutable = True
+
     def __init__(self, name=None, schema=None, **kwargs):
-        super(JsonProperty, self).__init__(name, **kwargs)
+        super(JsonProperty, self).__init__(**kwargs)
         self._schema = schema
 
     def _to_base_type(self, value):
@@ -258,11 +442,48 @@ class JsonProperty(BlobProperty):
         return value
 
 
+class KeyProperty(Property):
+    """
+    A reference to another entity, stored as its :class:`gcloud.datastore.key.Key`. Values can be set as keys or as
+    model instances. The referenced instance can be read with :func:`gcloudorm.model.Model.related`, and the references
+    of many results resolved in one lookup with the ``prefetch_related`` option of
+    :func:`gcloudorm.model.Model.filter` and :func:`gcloudorm.query.Query.fetch`.
+    """
+    def __init__(self, kind=None, **kwargs):
+        """
+        Initialise this property.
+
+        :param kind: the model class, or kind name, that references must be to. Defaults to None, meaning any kind.
+        """
+        super(KeyProperty, self).__init__(**kwargs)
+        self._kind = kind if kind is None or isinstance(kind, six.string_types) else kind.__name__
+
+    @property
+    def kind(self):
+        return self._kind
+
+    def _validate(self, value):
+        if not isinstance(value, key.Key):
+            value = value.key  # A model instance
+        assert isinstance(value, key.Key) and not value.is_partial, value
+        assert self._kind is None or value.kind == self._kind, \
+            "%s must reference a %s, not a %s" % (self._name, self._kind, value.kind)
+        return value
+
+
 class DateTimeProperty(Property):
     """Store data as a timestamp represented as datetime.datetime."""
     def __init__(self, name=None, auto_now_add=False, auto_now=False, **kwargs):
+        """
+        Initialise this property.
+
+        :param bool auto_now_add: set the value to the current time when an instance is first saved with no value?
+        :param bool auto_now: set the value to the current time whenever a changed instance is saved?
+        :param bool indexed: should this field be indexed? Defaults to False.
+        """
         assert not ((auto_now_add or auto_now) and kwargs.get("repeated", False))
-        super(DateTimeProperty, self).__init__(name, **kwargs)
+        kwargs.setdefault('indexed', False)
+        super(DateTimeProperty, self).__init__(**kwargs)
         self._auto_now_add = auto_now_add
         self._auto_now = auto_now
 
@@ -0,0 +1,300 @@
+"""
+Queries over the entities of a :class:`gcloudorm.model.Model` kind. Create one with
+:func:`gcloudorm.model.Model.query`.
+"""
+from __future__ import absolute_import
+
+import collections
+
+from gcloud.datastore import key
+
+from . import columns, decoding, metrics
+from .backends import get_backend
+from .futures import submit_read
+from .records import record_class
+
+# The number of entities fetched per RPC unless told otherwise.
+DEFAULT_PAGE_SIZE = 500
+
+
+class Query(object):
+    """
+    A query for entities of a model's kind. Queries are immutable: :func:`filter` and :func:`order` return a new query,
+    so they can be chained and shared. For example:
+
+        adults = Person.query().filter('age', '>=', 18).order('-age')
+        for person in adults.fetch(limit=100):
+            ...
+
+    Filters and orders are checked against the model's properties. They must name an indexed property, and filter
+    values are validated and converted to their stored form by that property.
+
+    Jobs that don't need whole model instances can fetch just the keys of the results with ``keys_only``, or a few
+    indexed properties with ``projection``:
+
+        for key in Person.query().fetch(keys_only=True):
+            ...
+        for person in Person.query().fetch(projection=['name', 'age']):
+            print person.key, person.name, person.age
+    """
+    OPERATORS = ('=', '<', '<=', '>', '>=')
+
+    def __init__(self, model, ancestor=None, filters=(), order=()):
+        """
+        Initialise a query. Use :func:`gcloudorm.model.Model.query` rather than calling this directly.
+
+        :param Model model: the model class to query.
+        :param ancestor: a :class:`gcloud.datastore.key.Key` or model instance the results must descend from.
+        :param tuple filters: (name, operator, stored value) filters to apply.
+        :param tuple order: names of the properties to order by, prefixed with '-' for descending order.
+        """
+        if ancestor is not None and not isinstance(ancestor, key.Key):
+            ancestor = ancestor.key
+
+        self._model = model
+        self._ancestor = ancestor
+        self._filters = tuple(filters)
+        self._order = tuple(order)
+
+    def __repr__(self):
+        return '<Query %s ancestor=%r filters=%r order=%r>' % (
+            self._model.__name__, self._ancestor, self._filters, self._order)
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def ancestor(self):
+        return self._ancestor
+
+    @property
+    def filters(self):
+        return self._filters
+
+    @property
+    def orders(self):
+        return self._order
+
+    def filter(self, name, operator, value):
+        """
+        Restrict the results to entities whose property ``name`` compares to ``value`` using ``operator``.
+
+        :param str name: the name of an indexed property of the model.
+        :param str operator: one of ``=``, ``<``, ``<=``, ``>`` or ``>=``.
+        :param value: the value to compare with. It's validated and converted by the property.
+        :return: a new :class:`Query`.
+        :raises ValueError: if the operator is unknown, or the property doesn't exist or isn't indexed.
+        """
+        if operator not in self.OPERATORS:
+            raise ValueError('Invalid operator %r, use one of %s.' % (operator, ', '.join(self.OPERATORS)))
+
+        prop = self._property(name)
+        value = prop.to_base_type(prop.validate(value))
+        return self._replace(filters=self._filters + ((name, operator, value),))
+
+    def order(self, *names):
+        """
+        Order the results by the given properties, in addition to any existing orders.
+
+        :param names: the names of indexed properties of the model, prefixed with '-' for descending order.
+        :return: a new :class:`Query`.
+        :raises ValueError: if a property doesn't exist or isn't indexed.
+        """
+        for name in names:
+            self._property(name[1:] if name.startswith('-') else name)
+
+        return self._replace(order=self._order + names)
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, page_size=DEFAULT_PAGE_SIZE, prefetch=False,
+              keys_only=False, projection=None, compact=False, prefetch_related=()):
+        """
+        Run the query.
+
+        :param int limit: the maximum number of results. Defaults to None, meaning all of them.
+        :param int offset: the number of results to skip.
+        :param str start_cursor: a cursor from a previous :class:`QueryIterator` to resume from.
+        :param int page_size: the number of entities fetched per RPC.
+        :param bool prefetch: fetch the next page on a background thread while the current one is iterated? Defaults to
+        False. The backend is then called from two threads at once, which :class:`gcloudorm.backends.GCloudBackend`
+        and :class:`gcloudorm.backends.MemoryBackend` support but other backends may not. Background fetches don't
+        run inside the caller's transaction, so leave this off within one.
+        :param bool keys_only: return just the :class:`gcloud.datastore.key.Key` of each result? Defaults to False.
+        :param list projection: names of indexed properties to return instead of model instances. Each result is a
+        named tuple with a ``key`` field and a field per projected property, decoded by the property. Results with
+        several values for a repeated property are returned once per value.
+        :param bool compact: return read-only :class:`gcloudorm.records.Record` objects, which take much less memory,
+        instead of model instances? Defaults to False.
+        :param list prefetch_related: names of :class:`gcloudorm.properties.KeyProperty` properties whose referenced
+        instances are fetched in one lookup per page of results, see :func:`gcloudorm.model.prefetch`.
+        :return: a :class:`QueryIterator` over the results.
+        :raises ValueError: if more than one of ``keys_only``, ``projection`` and ``compact`` are given, or a projected
+        property doesn't exist or isn't indexed, or ``prefetch_related`` is given for results that aren't model
+        instances.
+        """
+        if sum(map(bool, (keys_only, projection, compact))) > 1:
+            raise ValueError('A query can only be one of keys only, a projection or compact.')
+        if prefetch_related and (keys_only or projection or compact):
+            raise ValueError('Related instances can only be prefetched for model instances.')
+        for name in projection or ():
+            self._property(name)
+
+        return QueryIterator(self, limit, offset, start_cursor, page_size, prefetch, keys_only, projection, compact,
+                             prefetch_related)
+
+    def get(self):
+        """
+        :return: the first result of the query, or None if there isn't one.
+        """
+        for result in self.fetch(limit=1):
+            return result
+
+    def __iter__(self):
+        return iter(self.fetch())
+
+    def _property(self, name):
+        prop = self._model._properties.get(name)
+        if prop is None:
+            raise ValueError('%s has no property %r.' % (self._model.__name__, name))
+        if not prop.indexed:
+            raise ValueError('Property %r of %s is not indexed.' % (name, self._model.__name__))
+        return prop
+
+    def _replace(self, **kwargs):
+        args = {'ancestor': self._ancestor, 'filters': self._filters, 'order': self._order}
+        args.update(kwargs)
+        return self.__class__(self._model, **args)
+
+
+class QueryIterator(object):
+    """
+    Iterates over the results of a :class:`Query`, fetching them one page per RPC, so at most two pages are held in
+    memory however many entities the query matches. Pages are fetched on the iterating thread, unless prefetching is
+    turned on, in which case the next page is requested on a background thread as soon as the current one arrives.
+
+    After each page has been iterated, :attr:`cursor` is set to a cursor positioned after it. Passing it as the
+    ``start_cursor`` of another fetch resumes from there.
+
+    Results are model instances, unless the query is keys only, a projection or compact (see :func:`Query.fetch`).
+    """
+    def __init__(self, query, limit=None, offset=0, start_cursor=None, page_size=DEFAULT_PAGE_SIZE, prefetch=False,
+                 keys_only=False, projection=None, compact=False, prefetch_related=()):
+        if page_size < 1:
+            raise ValueError('Page size must be at least 1.')
+
+        self._query = query
+        self._limit = limit
+        self._offset = offset
+        self._page_size = page_size
+        self._prefetch = prefetch
+        self._keys_only = keys_only
+        self._projection = tuple(projection or ())
+        self._compact = compact
+        self._prefetch_related = tuple(prefetch_related)
+        self.cursor = start_cursor
+
+    def __iter__(self):
+        model = self._query.model
+        decode = False
+        if self._keys_only:
+            convert = _key_of
+        elif self._projection:
+            convert = _projector(model, self._projection)
+        elif self._compact:
+            convert = record_class(model).from_entity
+        else:
+            convert = model.from_entity
+            decode = decoding.active  # Heavy values of whole pages can be decoded in parallel
+
+        for entities, cursor in self._pages():
+            results = [convert(e) for e in entities]
+            if decode:
+                decoding.decode(model, results)
+            if self._prefetch_related:
+                from .model import prefetch
+                prefetch(results, self._prefetch_related)
+            for obj in results:
+                yield obj
+            self.cursor = cursor
+
+    def to_columns(self, names=None):
+        """
+        Fetch the results into a NumPy array per property instead of objects, decoding a page at a time. See
+        :mod:`gcloudorm.columns`.
+
+        :param list names: the properties to return. Defaults to all of them, or the projected ones.
+        :return: a dict of property name to :class:`numpy.ma.MaskedArray`.
+        :raises ValueError: if the query is keys only.
+        """
+        if self._keys_only:
+            raise ValueError("A keys only query doesn't have any properties.")
+
+        model = self._query.model
+        names = names or self._projection or sorted(model._properties)
+        parts = []
+        for entities, cursor in self._pages():
+            parts.append(columns.to_columns(model, entities, names))
+            self.cursor = cursor
+        return columns.concatenate(parts, names) if parts else columns.to_columns(model, [], names)
+
+    def _pages(self):
+        """Generate (entities, cursor) for each page of results."""
+        remaining = self._limit
+        if remaining == 0:
+            return
+
+        backend = get_backend()
+        projection = ('__key__',) if self._keys_only else self._projection
+        size = self._next_page_size(remaining)
+        started = metrics.clock() if metrics.active else None
+        page = _fetch_page(backend, self._query, projection, size, self._offset, self.cursor)
+        while True:
+            entities, more, cursor = page
+            if started is not None:
+                # Prefetched pages only count the time spent waiting for them
+                metrics.record(self._query.model.__name__, 'query', started, len(entities),
+                               sum(map(metrics.entity_size, entities)))
+            if remaining is not None:
+                remaining -= len(entities)
+            # The datastore doesn't reliably report whether there are more results, so keep going after a full page
+            has_next = bool(entities) and (more or len(entities) == size) and remaining != 0
+            if has_next:
+                size = self._next_page_size(remaining)
+                args = (backend, self._query, projection, size, 0, cursor)
+                pending = submit_read(_fetch_page, *args) if self._prefetch else None
+
+            yield entities, cursor
+            if not has_next:
+                return
+            started = metrics.clock() if metrics.active else None
+            page = pending.get_result() if pending is not None else _fetch_page(*args)
+
+    def _next_page_size(self, remaining):
+        return self._page_size if remaining is None else min(self._page_size, remaining)
+
+
+# (model, projected names): named tuple class for the results
+_projection_types = {}
+
+
+def _key_of(e):
+    return e.key
+
+
+def _projector(model, names):
+    """Make a function that converts a projected entity into a named tuple of its decoded property values."""
+    record = _projection_types.get((model, names))
+    if record is None:
+        record = _projection_types[(model, names)] = collections.namedtuple(
+            '%sProjection' % model.__name__, ('key',) + names)
+
+    decoders = [model._properties[name].from_base_type for name in names]
+
+    def project(e):
+        return record(e.key, *[decode(e.get(name)) for name, decode in zip(names, decoders)])
+    return project
+
+
+def _fetch_page(backend, query, projection, limit, offset, cursor):
+    """Run one RPC for query, returning (entities, more results?, cursor)."""
+    return backend.run_query(query, projection, limit=limit, offset=offset, start_cursor=cursor)
@@ -0,0 +1,148 @@
+"""
+Compact, read-only results for bulk reads. A :class:`gcloudorm.model.Model` instance is a dict with a
+:class:`gcloud.datastore.key.Key`, a set of excluded indexes and bookkeeping for change tracking, which adds up when
+millions of them are held at once. A record holds just the key path and the stored value of each property in
+``__slots__``, and decodes values when they're read. For example:
+
+    for person in Person.query().fetch(compact=True):
+        total += person.age
+
+Records have the same attributes as instances of their model, but can't be changed. Call :func:`Record.to_model` to
+get a full instance to change and save.
+"""
+from __future__ import absolute_import
+
+from gcloud.datastore import entity, key
+
+from .compiler import _overrides
+
+# model class: record class
+_record_classes = {}
+
+
+class Record(object):
+    """
+    The base of the record class of each model, created by :func:`record_class`.
+
+    This class shouldn't be used directly.
+    """
+    __slots__ = ('_path', '_namespace')
+
+    # Set on each record class
+    _model = None
+    _setters = ()  # (property name, slot setter) for each property
+    _getters = ()  # (property name, slot getter) for each property
+
+    @classmethod
+    def from_entity(cls, e):
+        """
+        Create a record from an entity read from the datastore, in the same way as
+        :func:`gcloudorm.model.Model.from_entity`.
+
+        :param Entity e: the entity.
+        :return: a new record.
+        """
+        obj = cls.__new__(cls)
+        _set_path(obj, e.key.flat_path)
+        _set_namespace(obj, e.key.namespace)
+        get = e.get
+        for name, set_value in cls._setters:
+            set_value(obj, get(name))
+
+        if cls._get_id(obj) is None:  # we need the id value
+            cls._set_id(obj, e.key.id_or_name)
+        return obj
+
+    @property
+    def key(self):
+        return key.Key(*self._path, namespace=self._namespace)
+
+    def to_entity(self):
+        """
+        :return: a :class:`gcloud.datastore.entity.Entity` with this record's key and stored values.
+        """
+        e = entity.Entity(self.key, exclude_from_indexes=self._model._model_exclude_from_indexes)
+        e.update((name, get_value(self)) for name, get_value in self._getters)
+        return e
+
+    def to_model(self):
+        """
+        :return: a new instance of the record's model with the same key and values, which can be changed and saved.
+        """
+        return self._model.from_entity(self.to_entity())
+
+    def to_dict(self):
+        """
+        Get the values of all of this record's properties.
+
+        :return: a dict of property name to (decoded) value.
+        """
+        return {name: getattr(self, name) for name in self._model._properties}
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only, use to_model() to get an instance that can be changed.' %
+                             type(self).__name__)
+
+    def __delattr__(self, name):
+        self.__setattr__(name, None)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._path == other._path and self._namespace == other._namespace and \
+            all(get_value(self) == get_value(other) for name, get_value in self._getters)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._model, self._namespace, self._path))
+
+    def __repr__(self):
+        return '<%s%s %r>' % (type(self).__name__, list(self._path), self.to_dict())
+
+
+_set_path = Record._path.__set__
+_set_namespace = Record._namespace.__set__
+
+
+def record_class(model):
+    """
+    Get the record class for a model class, creating it the first time.
+
+    :param Model model: the model class.
+    :return: a subclass of :class:`Record` with a slot for each of the model's properties.
+    """
+    cls = _record_classes.get(model)
+    if cls is None:
+        cls = _record_classes[model] = _make_record_class(model)
+    return cls
+
+
+def _make_record_class(model):
+    names = sorted(model._properties)
+    slots = ['_%d' % i for i in range(len(names))]
+    cls = type('%sRecord' % model.__name__, (Record,), {'__slots__': tuple(slots), '_model': model})
+
+    getters, setters = [], []
+    for name, slot in zip(names, slots):
+        descriptor = cls.__dict__[slot]
+        getters.append((name, descriptor.__get__))
+        setters.append((name, descriptor.__set__))
+        type.__setattr__(cls, name, _attribute(model._properties[name], descriptor.__get__))
+        if name == model._id_prop:
+            type.__setattr__(cls, '_get_id', staticmethod(descriptor.__get__))
+            type.__setattr__(cls, '_set_id', staticmethod(descriptor.__set__))
+
+    cls._getters = tuple(getters)
+    cls._setters = tuple(setters)
+    return cls
+
+
+def _attribute(prop, get_value):
+    """Make the read-only attribute for prop, which decodes its stored value if necessary."""
+    if prop._repeated:
+        decode = prop.from_base_type
+        return property(lambda self: [decode(v) for v in get_value(self) or ()])
+    if prop._memoize or _overrides(prop, 'from_base_type'):  # The property converts values
+        decode = prop.from_base_type
+        return property(lambda self: decode(get_value(self)))
+    return property(get_value)
@@ -24,12 +24,18 @@ setup(
     long_description=README,
     scripts=[],
     url='https://github.com/lucemia/gcloud-python-orm',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'tests']),
     license='Apache 2.0',
     platforms='Posix; MacOS X; Windows',
     include_package_data=True,
     zip_safe=False,
     install_requires=REQUIREMENTS,
+    entry_points={
+        'console_scripts': ['gcloudorm-export = gcloudorm.export:main'],
+    },
+    extras_require={
+        'numpy': ['numpy'],
+    },
     classifiers=[
         'Development Status :: 1 - Planning',
         'Intended Audience :: Developers',
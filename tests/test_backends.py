@@ -0,0 +1,155 @@
+import threading
+import time
+import unittest2
+
+import httplib2
+from gcloud.datastore import _datastore_v1_pb2 as datastore_pb
+from gcloud.datastore import _implicit_environ, connection, entity, key, set_default_connection, set_default_dataset_id
+
+from gcloudorm import backends, model, properties
+
+import test_query
+from test_model import _DATASET_ID
+
+
+class TestMemoryBackend(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = backends.MemoryBackend()
+        backends.set_backend(self.backend)
+
+        class Pet(model.Model):
+            name = properties.TextProperty()
+            tags = properties.TextProperty(repeated=True, indexed=True)
+        self.Pet = Pet
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def testGetBackend(self):
+        self.assertIs(backends.get_backend(), self.backend)
+        backends.set_backend(None)
+        self.assertIsInstance(backends.get_backend(), backends.GCloudBackend)
+
+    def testGetPutDelete(self):
+        e = entity.Entity(key.Key('Pet', 1))
+        e['name'] = u'rex'
+        e['tags'] = [u'dog']
+        self.backend.put([e])
+
+        # Stored entities are copies
+        e['name'] = u'changed'
+        e['tags'].append(u'changed')
+        found, missing = self.backend.get([key.Key('Pet', 1), key.Key('Pet', 2)])
+        self.assertIsNone(missing)
+        self.assertEqual(found, {'name': u'rex', 'tags': [u'dog']})
+        self.assertEqual(found.key, key.Key('Pet', 1))
+        found['tags'].append(u'cat')
+        self.assertEqual(self.backend.get([key.Key('Pet', 1)])[0]['tags'], [u'dog'])
+
+        self.backend.delete([key.Key('Pet', 1), key.Key('Pet', 2)])
+        self.assertEqual(self.backend.get([key.Key('Pet', 1)]), [None])
+        self.assertEqual(len(self.backend), 0)
+        self.assertEqual(self.backend.rpcs, {'put': 1, 'get': 3, 'delete': 1})
+
+    def testModel(self):
+        pets = [self.Pet(id=i, name=u'pet %d' % i, tags=[u'a', u'b'] if i % 2 else [u'b']) for i in range(1, 5)]
+        model.Model.save_multi(pets)
+        self.assertEqual(len(self.backend), 4)
+        self.assertEqual(self.Pet.get_by_id(2), pets[1])
+        self.assertEqual(self.Pet.filter([4, 5, 1]), [pets[3], pets[0]])
+
+        # Repeated properties match a filter if any of their values do, and project once per value
+        self.assertEqual(list(self.Pet.query().filter('tags', '=', u'a').fetch(keys_only=True)),
+                         [pets[0].key, pets[2].key])
+        self.assertEqual([p.tags for p in self.Pet.query().fetch(projection=['tags'])],
+                         [u'a', u'b', u'b', u'a', u'b', u'b'])
+
+        pets[0].delete()
+        with self.assertRaises(model.ObjectDoesNotExist):
+            self.Pet.get_by_id(1)
+
+    def testLatency(self):
+        self.backend.latency = 0.05
+        start = time.time()
+        self.backend.get([key.Key('Pet', 1)])
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+
+class _Http(httplib2.Http):
+    """A transport with a timeout set, which answers every lookup with no results."""
+    def __init__(self, requests):
+        super(_Http, self).__init__(timeout=7)
+        self.requests = requests
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        self.requests.append(self)
+        return {'status': '200'}, datastore_pb.LookupResponse().SerializeToString()
+
+
+class TestGCloudBackend(unittest2.TestCase):
+    def setUp(self):
+        self.connection = _implicit_environ.CONNECTION
+
+    def tearDown(self):
+        _implicit_environ.CONNECTION = self.connection
+        backends.set_backend(None)
+
+    def testConnectionPerThread(self):
+        default = connection.Connection()
+        set_default_connection(default)
+        backend = backends.GCloudBackend()
+        found = {}
+
+        def run(name):
+            found[name] = (backend._connection(), backend._connection())
+
+        # The first thread to use the default connection keeps it, and others get copies
+        self.assertIs(backend._connection(), default)
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIs(found['a'][0], found['a'][1])
+        self.assertIsNot(found['a'][0], found['b'][0])
+        self.assertIsInstance(found['a'][0], connection.Connection)
+        self.assertNotIn(default, [found['a'][0], found['b'][0]])
+        self.assertIsNot(found['a'][0].http, found['b'][0].http)
+
+        # A new default connection is picked up, and stand-ins for it are used as they are
+        first = backend._connection()
+        set_default_connection(connection.Connection())
+        self.assertIsNot(backend._connection(), first)
+        set_default_connection(object())
+        self.assertIsNone(backend._connection())
+
+    def testCustomHttp(self):
+        class Gadget(model.Model):
+            id = properties.IntegerProperty()
+
+        requests = []
+        http = _Http(requests)
+        set_default_connection(connection.Connection(http=http))
+        set_default_dataset_id(_DATASET_ID)
+        backends.set_backend(backends.GCloudBackend())
+        self.assertEqual(Gadget.filter([1, 2]), [])
+        self.assertEqual(requests, [http])
+
+        # Lookups on other threads go through copies of the transport, with the same settings
+        del requests[:]
+        self.assertEqual(Gadget.filter(range(1, 5), shard_size=1, concurrency=2), [])
+        self.assertEqual(len(requests), 4)
+        self.assertTrue(all(isinstance(h, _Http) and h.timeout == 7 and h is not http for h in requests))
+
+
+class TestMemoryBackendQuery(test_query.TestQuery):
+    """Runs the query tests against :class:`gcloudorm.backends.MemoryBackend`."""
+    def _install(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = backends.MemoryBackend()
+        backends.set_backend(self.backend)
+
+    def _queries(self):
+        return self.backend.rpcs['query']
@@ -0,0 +1,101 @@
+import time
+import unittest2
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends, batcher, model, properties
+
+from test_model import _DATASET_ID
+
+
+class _FailingBackend(backends.MemoryBackend):
+    """Rejects puts of entities named 'bad'."""
+    def put(self, entities):
+        if any(e.get('name') == u'bad' for e in entities):
+            raise ValueError('bad entity')
+        super(_FailingBackend, self).put(entities)
+
+
+class TestBatcher(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = _FailingBackend()
+        backends.set_backend(self.backend)
+
+        class Item(model.Model):
+            name = properties.TextProperty()
+        self.Item = Item
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def testBatch(self):
+        items = [self.Item(name=u'item %d' % i) for i in range(5)]
+        items[4].save()
+        self.backend.rpcs.clear()
+
+        with batcher.batch() as b:
+            self.assertIs(batcher.current_batcher(), b)
+            for item in items[:4]:
+                item.save()
+            items[0].name = u'renamed'
+            items[0].save()  # Merged with the first save
+            items[1].delete()  # Replaces the save
+            items[4].delete()
+            self.assertEqual(len(b), 5)
+            self.assertEqual(self.backend.rpcs, {})
+
+        self.assertIsNone(batcher.current_batcher())
+        self.assertEqual(self.backend.rpcs, {'put': 1, 'delete': 1})
+        self.assertEqual(self.Item.get_by_id(items[0].id).name, u'renamed')
+        self.assertEqual(self.Item.filter([item.id for item in items]), [items[0], items[2], items[3]])
+        self.assertFalse(items[0].is_dirty)
+
+    def testLimits(self):
+        with batcher.batch(max_size=2) as b:
+            for i in range(5):
+                self.Item(name=u'item %d' % i).save()
+            self.assertEqual(len(b), 1)
+            self.assertEqual(self.backend.rpcs['put'], 2)
+        self.assertEqual(self.backend.rpcs['put'], 3)
+
+        with batcher.batch(max_delay=0.01) as b:
+            self.Item(name=u'first').save()
+            time.sleep(0.02)
+            self.Item(name=u'second').save()
+            self.assertEqual(len(b), 0)
+        self.assertEqual(self.backend.rpcs['put'], 4)
+
+        with self.assertRaises(ValueError):
+            batcher.batch(max_size=0)
+
+    def testErrors(self):
+        good, bad = self.Item(name=u'good'), self.Item(name=u'bad')
+        with self.assertRaises(batcher.BatchWriteError) as cm:
+            with batcher.batch(max_size=1):
+                bad.save()
+                good.save()
+        self.assertEqual([(e.operation, e.key, e.instance) for e in cm.exception.errors], [('save', bad.key, bad)])
+        self.assertIsInstance(cm.exception.errors[0].error, ValueError)
+        self.assertEqual(self.Item.get_by_id(good.id), good)
+        self.assertTrue(bad.is_dirty)
+
+        # The block's own exception isn't masked, but the queue is still flushed. A failed batch fails all its writes.
+        other = self.Item(name=u'other')
+        with self.assertRaises(KeyError):
+            with batcher.batch() as b:
+                other.save()
+                bad.save()
+                raise KeyError
+        self.assertEqual([e.instance for e in b.errors], [other, bad])
+        self.assertTrue(other.is_dirty)
+
+        with self.assertRaises(KeyError):
+            with batcher.batch():
+                other.save()
+                raise KeyError
+        self.assertEqual(self.Item.get_by_id(other.id), other)
+
+        with batcher.batch(raise_errors=False) as b:
+            bad.save()
+        self.assertEqual(len(b.errors), 1)
@@ -0,0 +1,184 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest2
+
+from gcloud.datastore import entity, key, set_default_dataset_id
+
+from gcloudorm import backends, cache, model, properties
+
+from test_model import _DATASET_ID
+
+
+class TestLRUCache(unittest2.TestCase):
+    def testGetSet(self):
+        c = cache.LRUCache(max_size=2)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.get('a', 1), 1)
+
+        c.set('a', 1)
+        c.set('b', 2)
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.get('b'), 2)
+        self.assertEqual(c.stats(), {'hits': 2, 'misses': 2, 'evictions': 0, 'size': 2})
+
+        c.delete('a')
+        self.assertNotIn('a', c)
+        c.clear()
+        self.assertEqual(len(c), 0)
+
+        with self.assertRaises(ValueError):
+            cache.LRUCache(max_size=0)
+
+    def testEviction(self):
+        c = cache.LRUCache(max_size=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')  # b is now the least recently used
+        c.set('c', 3)
+
+        self.assertEqual(c.evictions, 1)
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+        self.assertIn('c', c)
+
+    def testTTL(self):
+        c = cache.LRUCache(ttl=0)
+        c.set('a', 1)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.misses, 1)
+
+        c = cache.LRUCache(ttl=60)
+        c.set('a', 1)
+        self.assertEqual(c.get('a'), 1)
+
+
+class TestSharedCache(unittest2.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = backends.MemoryBackend()
+        backends.set_backend(self.backend)
+
+    def tearDown(self):
+        backends.set_backend(None)
+        shutil.rmtree(self.directory)
+
+    def testStore(self):
+        store, other = cache.SQLiteStore(self.path), cache.SQLiteStore(self.path)
+        self.assertEqual(store.get_many(['a']), [(0, None)])
+
+        store.add_many([('a', 0, 'first')])
+        self.assertEqual(other.get_many(['a', 'b']), [(0, 'first'), (0, None)])
+
+        # A value read before an invalidation can't be added after it
+        other.invalidate_many(['a', 'b'])
+        self.assertEqual(store.get_many(['a', 'b']), [(1, None), (1, None)])
+        store.add_many([('a', 0, 'stale'), ('b', 1, 'fresh')])
+        self.assertEqual(other.get_many(['a', 'b']), [(1, None), (1, 'fresh')])
+
+        expired = cache.SQLiteStore(self.path, ttl=0, prune_every=1)
+        expired.add_many([('a', 1, 'expired')])
+        self.assertEqual(store.get_many(['a', 'b']), [(0, None), (1, 'fresh')])
+
+        store.clear()
+        self.assertEqual(store.get_many(['b']), [(0, None)])
+
+    def testValues(self):
+        import datetime
+        import pytz
+
+        shared = cache.SharedCache(cache.SQLiteStore(self.path))
+        e = entity.Entity(key.Key('Shared', 1))
+        e.update({'text': u'\xe9', 'blob': '\x00\xff', 'int': 2 ** 40, 'float': 1.0, 'bool': True, 'none': None,
+                  'naive': datetime.datetime(2015, 1, 2, 3, 4, 5, 6),
+                  'aware': datetime.datetime(2015, 1, 2, 3, 4, 5, tzinfo=pytz.utc),
+                  'key': key.Key('Other', 'a', namespace='ns'), 'list': [1, 'x'], 'empty': []})
+        shared.add_many([e.key], [e], [0])
+        found = shared.get_many([e.key])[0][0]
+        self.assertEqual(dict(found), dict(e))
+        for name in e:
+            self.assertIs(type(found[name]), type(e[name]), name)
+        self.assertEqual(found['key'].namespace, 'ns')
+        self.assertIsNotNone(found['aware'].tzinfo)
+        self.assertIsNone(found['naive'].tzinfo)
+
+    def testNegativeTtl(self):
+        e = entity.Entity(key.Key('Shared', 1))
+        e['value'] = 1
+        missing = key.Key('Shared', 2)
+
+        # That an entity doesn't exist expires sooner than entities, as writers outside the cache don't invalidate it
+        shared = cache.SharedCache(cache.SQLiteStore(self.path), negative_ttl=0)
+        shared.add_many([e.key, missing], [e, None], [0, 0])
+        self.assertEqual(shared.get_many([e.key, missing])[0], [e, None])
+
+        shared.negative_ttl = cache.DEFAULT_NEGATIVE_TTL
+        shared.add_many([missing], [None], [0])
+        self.assertIs(shared.get_many([missing])[0][0], cache.NOT_FOUND)
+
+    def testPermissions(self):
+        self.assertEqual(os.stat(cache.SQLiteStore(self.path).path).st_mode & 0o777, 0o600)
+        directory = os.path.dirname(cache.SQLiteStore().path)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+        # Stores other users could write to are refused
+        os.chmod(self.path, 0o644)
+        with self.assertRaises(ValueError):
+            cache.SQLiteStore(self.path)
+        os.chmod(self.path, 0o600)
+        link = os.path.join(self.directory, 'link.sqlite')
+        os.symlink(self.path, link)
+        with self.assertRaises(ValueError):
+            cache.SQLiteStore(link)
+
+    def testModel(self):
+        class Shared(model.Model):
+            value = properties.IntegerProperty()
+            data = properties.JsonProperty()
+
+        shared = Shared.enable_shared_cache(cache.SQLiteStore(self.path))
+        item = Shared(id=1, value=1, data={'a': [1]})
+        item.save()
+
+        self.assertEqual(Shared.get_by_id(1), item)
+        with self.assertRaises(model.ObjectDoesNotExist):
+            Shared.get_by_id(2)
+        self.assertEqual(self.backend.rpcs['get'], 2)
+        self.assertEqual(shared.stats(), {'hits': 0, 'negative_hits': 0, 'misses': 2})
+
+        # Another process reads the entity, and that it's missing, from the cache
+        other = cache.SharedCache(cache.SQLiteStore(self.path))
+        found, versions = other.get_many([key.Key('Shared', 1), key.Key('Shared', 2)])
+        self.assertEqual(found[0], item)
+        self.assertIs(found[1], cache.NOT_FOUND)
+
+        self.assertEqual(Shared.filter([1, 2]), [item])
+        self.assertEqual(Shared.get_by_id(1).data, {'a': [1]})
+        self.assertEqual(self.backend.rpcs['get'], 2)
+        self.assertEqual(shared.stats(), {'hits': 2, 'negative_hits': 1, 'misses': 2})
+
+        # Writes in any process invalidate the entries
+        process = multiprocessing.Process(target=_save, args=(self.path,))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(Shared.filter([1, 2]), [item])
+        self.assertEqual(self.backend.rpcs['get'], 3)
+
+        item.delete()
+        with self.assertRaises(model.ObjectDoesNotExist):
+            Shared.get_by_id(1)
+        Shared.disable_shared_cache()
+        self.assertIsNone(Shared._shared_cache)
+
+
+def _save(path):
+    """Runs in a child process. The backend isn't shared, so only the invalidation is visible to the parent."""
+    class Shared(model.Model):
+        value = properties.IntegerProperty()
+        data = properties.JsonProperty()
+    Shared.enable_shared_cache(cache.SQLiteStore(path))
+    Shared(id=1, value=2).save()
@@ -0,0 +1,101 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest2
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends, cache, columns, model, properties
+
+from test_model import _DATASET_ID
+
+
+@unittest2.skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestColumns(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = backends.MemoryBackend()
+        backends.set_backend(self.backend)
+
+        class Sample(model.Model):
+            id = properties.IntegerProperty()
+            count = properties.IntegerProperty(indexed=True)
+            score = properties.FloatProperty()
+            valid = properties.BooleanProperty()
+            taken = properties.DateTimeProperty()
+            day = properties.DateProperty()
+            at = properties.TimeProperty()
+            label = properties.TextProperty()
+            data = properties.JsonProperty()
+            tags = properties.TextProperty(repeated=True)
+        self.Sample = Sample
+
+        self.samples = [
+            Sample(id=1, count=10, score=0.5, valid=True, taken=datetime.datetime(2015, 1, 2, 3, 4, 5),
+                   day=datetime.date(2015, 1, 2), at=datetime.time(3, 4, 5), label=u'one', data={'a': 1},
+                   tags=[u'x']),
+            Sample(id=2, count=20, tags=[]),
+        ]
+        model.Model.save_multi(self.samples)
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def testTypes(self):
+        numpy = columns.numpy
+        result = self.Sample.filter_columns([1, 3, 2])
+        self.assertEqual(sorted(result), sorted(self.Sample._properties))
+
+        self.assertEqual(result['id'].dtype, numpy.int64)
+        self.assertEqual(result['id'].tolist(), [1, 2])
+        self.assertEqual(result['count'].sum(), 30)
+        self.assertEqual(result['score'].dtype, numpy.float64)
+        self.assertEqual(result['score'].tolist(), [0.5, None])
+        self.assertEqual(result['score'].mean(), 0.5)
+        self.assertEqual(result['valid'].dtype, bool)
+        self.assertEqual(result['valid'].mask.tolist(), [False, True])
+        self.assertEqual(result['taken'][0], numpy.datetime64('2015-01-02T03:04:05'))
+        self.assertEqual(result['day'].dtype, numpy.dtype('datetime64[D]'))
+        self.assertEqual(result['day'][0], numpy.datetime64('2015-01-02'))
+        self.assertEqual(result['at'][0], numpy.timedelta64(3 * 3600 + 4 * 60 + 5, 's'))
+        self.assertEqual(result['at'].mask.tolist(), [False, True])
+        self.assertEqual(result['label'].dtype, object)
+        self.assertEqual(result['label'].tolist(), [u'one', None])
+        self.assertEqual(result['data'][0], {'a': 1})
+        self.assertEqual(result['tags'].tolist(), [[u'x'], []])
+
+        with self.assertRaises(ValueError):
+            self.Sample.filter_columns([1], names=['missing'])
+
+    def testSharedCache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.Sample.enable_shared_cache(cache.SQLiteStore(os.path.join(directory, 'cache.sqlite')))
+
+        # Entities read for columns are shared with other reads
+        self.assertEqual(self.Sample.filter_columns([1, 2], ['count'])['count'].tolist(), [10, 20])
+        self.assertEqual(self.Sample.filter_columns([2, 1], ['count'])['count'].tolist(), [20, 10])
+        self.assertEqual(self.Sample.get_by_id(1).label, u'one')
+        self.assertEqual(self.backend.rpcs['get'], 1)
+
+    def testQuery(self):
+        result = self.Sample.query().order('count').fetch(page_size=1).to_columns(['count', 'score'])
+        self.assertEqual(sorted(result), ['count', 'score'])
+        self.assertEqual(result['count'].tolist(), [10, 20])
+        self.assertEqual(result['score'].mask.tolist(), [False, True])
+
+        result = self.Sample.query().filter('count', '>', 100).fetch().to_columns(['count'])
+        self.assertEqual(len(result['count']), 0)
+
+        result = self.Sample.query().order('count').fetch(projection=['count']).to_columns()
+        self.assertEqual(result['count'].tolist(), [10, 20])
+
+        with self.assertRaises(ValueError):
+            self.Sample.query().fetch(keys_only=True).to_columns()
+
+    def testInstances(self):
+        self.samples[0].data['b'] = 2
+        result = self.Sample.to_columns(self.samples, ['count', 'data'])
+        self.assertEqual(result['count'].tolist(), [10, 20])
+        self.assertEqual(result['data'][0], {'a': 1, 'b': 2})
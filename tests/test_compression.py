@@ -0,0 +1,39 @@
+import zlib
+
+import unittest2
+
+from gcloudorm import compression
+
+
+class TestCompression(unittest2.TestCase):
+    def testRoundTrip(self):
+        data = 'abc' * 100
+        for codec in compression.available_codecs():
+            stored = compression.compress(data, codec)
+            self.assertEqual(stored[:2], '\x00' + chr(compression.get_codec(codec).tag))
+            self.assertLess(len(stored), len(data))
+            self.assertEqual(compression.decompress(stored), data)
+
+        self.assertEqual(compression.decompress(compression.compress(data, 'zlib', level=1)), data)
+
+    def testMinSize(self):
+        stored = compression.compress('abc', min_size=4)
+        self.assertEqual(stored, '\x00\x00abc')
+        self.assertEqual(compression.decompress(stored), 'abc')
+        self.assertEqual(compression.decompress(compression.compress('')), '')
+
+    def testLegacyZlib(self):
+        for level in range(10):
+            self.assertEqual(compression.decompress(zlib.compress('legacy data', level)), 'legacy data')
+
+    def testRegistry(self):
+        self.assertIn('zlib', compression.available_codecs())
+        self.assertIn('bz2', compression.available_codecs())
+        with self.assertRaises(ValueError):
+            compression.get_codec('missing')
+        with self.assertRaises(ValueError):
+            compression.register('zlib', 200, None, None)
+        with self.assertRaises(ValueError):
+            compression.register('other', 0, None, None)
+        with self.assertRaises(ValueError):
+            compression.decompress('\x00\xfe data')
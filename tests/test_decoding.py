@@ -0,0 +1,89 @@
+import unittest2
+
+from gcloud.datastore import entity, key, set_default_dataset_id
+
+from gcloudorm import backends, compression, decoding, metrics, model, properties
+
+from test_model import _DATASET_ID
+
+
+class TestDecoding(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        backends.set_backend(backends.MemoryBackend())
+
+        class Document(model.Model):
+            id = properties.IntegerProperty()
+            title = properties.TextProperty()
+            state = properties.PickleProperty(compressed=True, min_size=0)
+            data = properties.JsonProperty(compressed=True, min_size=0)
+            summary = properties.JsonProperty()
+            raw = properties.BlobProperty(compressed=True, min_size=0)
+            notes = properties.TextProperty(compressed=True, min_size=0, repeated=True)
+        self.Document = Document
+
+        self.documents = [Document(id=i, title=u'doc %d' % i, state={'i': i}, data=[i] * 100, summary={'i': i},
+                                   raw='x' * 1000, notes=[u'note %d' % i, u'\xe9']) for i in range(1, 4)]
+        model.Model.save_multi(self.documents)
+
+    def tearDown(self):
+        decoding.disable()
+        backends.set_backend(None)
+
+    def assertDecoded(self, obj, original):
+        for name in ('state', 'data', 'raw', 'notes'):
+            self.assertIn(name, obj._decoded)
+            self.assertIs(obj._decoded[name][0], obj[name])
+            self.assertEqual(getattr(obj, name), getattr(original, name), name)
+        # Uncompressed values are left to be decoded on access
+        self.assertNotIn('title', obj._decoded)
+        self.assertNotIn('summary', obj._decoded)
+        self.assertEqual(obj.summary, original.summary)
+
+    def testFilter(self):
+        decoding.enable(processes=2, min_bytes=0)
+        self.assertTrue(decoding.is_enabled())
+        with metrics.capture() as stats:
+            results = self.Document.filter([d.id for d in self.documents])
+        self.assertEqual(stats.get('Document', 'parallel_decode').entities, 3)
+
+        for obj, original in zip(results, self.documents):
+            self.assertDecoded(obj, original)
+        self.assertFalse(results[0].is_dirty)
+
+        results[0].data.append(1)
+        results[0].save()
+        self.assertEqual(self.Document.get_by_id(1).data, [1] * 101)
+
+    def testQuery(self):
+        decoding.enable(processes=2, min_bytes=0)
+        results = list(self.Document.query().fetch(page_size=2))
+        self.assertEqual(len(results), 3)
+        for obj in results:
+            self.assertDecoded(obj, self.documents[obj.id - 1])
+
+        self.assertEqual(next(iter(self.Document.query().fetch(compact=True))).data, [1] * 100)
+
+    def testThreshold(self):
+        decoding.enable(processes=2, min_bytes=1024 * 1024)
+        results = self.Document.filter([d.id for d in self.documents])
+        self.assertEqual(results[0]._decoded, {})
+        self.assertEqual(results[0].state, {'i': 1})
+
+        decoding.disable()
+        self.assertFalse(decoding.is_enabled())
+        self.assertEqual(self.Document.filter([1])[0]._decoded, {})
+
+    def testFailure(self):
+        e = entity.Entity(key.Key('Document', 10))
+        e.update({'id': 10, 'state': 'not a pickle', 'data': compression.compress('{"ok": true}'),
+                  'raw': compression.compress('abc', min_size=100)})
+        backends.get_backend().put([e])
+
+        decoding.enable(processes=2, min_bytes=0)
+        obj = self.Document.filter([10])[0]
+        self.assertEqual(obj._decoded['data'][1], {'ok': True})
+        self.assertEqual(obj._decoded['raw'][1], 'abc')
+        self.assertNotIn('state', obj._decoded)
+        with self.assertRaises(Exception):
+            obj.state
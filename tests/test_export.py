@@ -0,0 +1,118 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest2
+
+from StringIO import StringIO
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends, export, model, properties
+
+from test_model import _DATASET_ID
+
+
+class Product(model.Model):
+    id = properties.IntegerProperty()
+    name = properties.TextProperty(indexed=True)
+    summary = properties.TextProperty(compressed=True, min_size=0)
+    state = properties.PickleProperty()
+    data = properties.JsonProperty(compressed=True, min_size=0)
+    raw = properties.BlobProperty()
+    created = properties.DateTimeProperty()
+    day = properties.DateProperty()
+    price = properties.FloatProperty()
+    active = properties.BooleanProperty()
+    tags = properties.TextProperty(repeated=True)
+    related = properties.KeyProperty(kind='Product', repeated=True)
+
+
+class TestExport(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        backends.set_backend(backends.MemoryBackend())
+        self.directory = tempfile.mkdtemp()
+
+        self.items = [Product(id=i, name=u'item %d \xe9' % i, summary=u'summary %d' % i, state={'i': (i, None)},
+                              data={'i': i}, raw='\x00\xff%d' % i, created=datetime.datetime(2015, 1, 2, 3, 4, 5, i),
+                              day=datetime.date(2015, 1, i), price=i / 3.0, active=bool(i % 2), tags=[u'a', u'b'])
+                      for i in range(1, 6)]
+        self.items.append(Product(id=6, related=[self.items[0], self.items[1].key]))
+        model.Model.save_multi(self.items)
+
+    def tearDown(self):
+        backends.set_backend(None)
+        shutil.rmtree(self.directory)
+
+    def assertRoundTrip(self, format, compress):
+        path = os.path.join(self.directory, 'items')
+        self.assertEqual(export.dump(Product, path, format, compress, page_size=2), 6)
+
+        results = list(export.read(path))
+        self.assertEqual([r.key for r in results], [i.key for i in self.items])
+        for result, original in zip(results, self.items):
+            self.assertIsInstance(result, Product)
+            self.assertEqual(result.to_dict(), original.to_dict())
+            self.assertFalse(result.is_dirty)
+
+    def testFormats(self):
+        for format in export.FORMATS:
+            for compress in (None,) + export.COMPRESSIONS:
+                self.assertRoundTrip(format, compress)
+
+    def testNDJSON(self):
+        out = StringIO()
+        export.dump(Product.query().filter('name', '=', u'item 1 \xe9'), out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]), {'kind': 'Product', 'properties': sorted(Product._properties)})
+
+        record = json.loads(lines[1])
+        self.assertEqual(record['key'], ['Product', 1])
+        self.assertEqual(record['properties']['name'], u'item 1 \xe9')
+        self.assertEqual(record['properties']['summary'], u'summary 1')
+        self.assertEqual(record['properties']['raw'], 'AP8x')
+        self.assertEqual(record['properties']['created'], '2015-01-02T03:04:05.000001')
+
+        results = list(export.read(StringIO(out.getvalue()), Product))
+        self.assertEqual(results, [self.items[0]])
+
+    def testReader(self):
+        reader = export._Reader(StringIO('first line\nsecond\n' + 'x' * 50), block_size=4)
+        self.assertEqual(reader.peek(3), 'fir')
+        self.assertEqual(reader.read(6), 'first ')
+        self.assertEqual(reader.readline(), 'line\n')
+        self.assertEqual(reader.peek(9), 'second\nxx')
+        self.assertEqual(reader.readline(), 'second\n')
+        self.assertEqual(reader.read(45), 'x' * 45)
+        self.assertEqual(reader.readline(), 'x' * 5)
+        self.assertEqual((reader.read(), reader.readline(), reader.peek(1)), ('', '', ''))
+
+    def testErrors(self):
+        with self.assertRaises(ValueError):
+            export.dump(Product, StringIO(), format='xml')
+        with self.assertRaises(ValueError):
+            export.dump(Product, StringIO(), compress='zip')
+        with self.assertRaises(ValueError):
+            list(export.read(StringIO('not an export')))
+
+        out = StringIO()
+        export.dump(Product, out, format='binary')
+
+        class Other(model.Model):
+            id = properties.IntegerProperty()
+        with self.assertRaises(ValueError):
+            list(export.read(StringIO(out.getvalue()), Other))
+        with self.assertRaises(ValueError):
+            list(export.read(StringIO(out.getvalue().replace('Product', 'Missing'))))
+        with self.assertRaises(ValueError):
+            list(export.read(StringIO(out.getvalue()[:-1])))
+
+    def testMain(self):
+        path = os.path.join(self.directory, 'items.bz2')
+        export.main(['Product', path, '--format', 'binary'])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(3), 'BZh')
+        self.assertEqual(len(list(export.read(path))), 6)
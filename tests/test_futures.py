@@ -0,0 +1,74 @@
+import threading
+import time
+
+import unittest2
+
+from gcloudorm import futures
+
+
+class TestFutures(unittest2.TestCase):
+    def tearDown(self):
+        futures.set_max_in_flight(futures.DEFAULT_MAX_IN_FLIGHT)
+
+    def testSubmit(self):
+        future = futures.submit(lambda a, b=0: a + b, 1, b=2)
+        self.assertEqual(future.get_result(), 3)
+        self.assertTrue(future.done())
+
+        def fail():
+            raise KeyError('boom')
+        future = futures.submit(fail)
+        future.wait()
+        self.assertTrue(future.done())
+        with self.assertRaises(KeyError):
+            future.get_result()
+
+    def testWaitAll(self):
+        self.assertEqual(futures.wait_all([futures.submit(lambda i=i: i * 2) for i in range(5)]), [0, 2, 4, 6, 8])
+        self.assertEqual(futures.wait_all([]), [])
+
+    def testMaxInFlight(self):
+        futures.set_max_in_flight(2)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def work():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        futures.wait_all([futures.submit(work) for _ in range(6)])
+        self.assertEqual(max(peak), 2)
+
+        with self.assertRaises(ValueError):
+            futures.set_max_in_flight(0)
+
+    def testImap(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+        threads = set()
+
+        def work(i):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+                threads.add(threading.current_thread())
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+            return i * 2
+
+        self.assertEqual(list(futures.imap(work, range(6), 2)), range(0, 12, 2))
+        self.assertEqual(max(peak), 2)
+
+        # Later calls run on the same threads
+        self.assertEqual(list(futures.imap(work, range(6), 2)), range(0, 12, 2))
+        self.assertLessEqual(threads, set(futures._read_pool._pool))
+
+        with self.assertRaises(ZeroDivisionError):
+            list(futures.imap(lambda i: 1 / i, [1, 0, 2], 2))
@@ -0,0 +1,128 @@
+import threading
+import unittest2
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends, ids, model, properties
+
+from test_model import _DATASET_ID
+
+
+class _Allocator(object):
+    """A local stand-in for the datastore's id allocation, which can be held up or made to fail."""
+    def __init__(self):
+        self.calls = []
+        self.last = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.error = None
+
+    def __call__(self, kind, count):
+        self.release.wait()
+        self.calls.append((kind, count))
+        if self.error is not None:
+            raise self.error
+        self.last += count
+        return range(self.last - count + 1, self.last + 1)
+
+
+class TestIds(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = backends.MemoryBackend()
+        backends.set_backend(self.backend)
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def _wait_for_refill(self, pool):
+        with pool._condition:
+            while pool._refilling:
+                pool._condition.wait()
+
+    def testPool(self):
+        allocator = _Allocator()
+        pool = ids.IdPool('Order', block_size=10, low_water=3, allocator=allocator)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.next(), 1)
+        self._wait_for_refill(pool)
+        self.assertEqual(allocator.calls, [('Order', 10)])
+
+        # The next block is reserved in the background once the pool runs low, without holding up callers
+        allocator.release.clear()
+        self.assertEqual([pool.next() for _ in range(6)], range(2, 8))
+        self.assertEqual(len(pool), 3)
+        self.assertTrue(pool._refilling)
+        self.assertEqual([pool.next() for _ in range(3)], [8, 9, 10])
+        allocator.release.set()
+        self.assertEqual(pool.next(), 11)
+        self._wait_for_refill(pool)
+        self.assertEqual(len(allocator.calls), 2)
+
+        with self.assertRaises(ValueError):
+            ids.IdPool('Order', block_size=0)
+
+    def testThreads(self):
+        pool = ids.IdPool('Order', block_size=7, allocator=_Allocator())
+        taken = []
+
+        def take():
+            taken.extend(pool.next() for _ in range(100))
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(taken), range(1, 801))
+
+    def testErrors(self):
+        allocator = _Allocator()
+        allocator.error = RuntimeError('allocation failed')
+        pool = ids.IdPool('Order', block_size=2, allocator=allocator)
+        with self.assertRaises(RuntimeError):
+            pool.next()
+
+        # A failed refill is retried once the pool is empty
+        allocator.error = None
+        self.assertEqual([pool.next() for _ in range(3)], [1, 2, 3])
+
+    def testWarm(self):
+        pool = ids.IdPool('Order', block_size=5)
+        pool.warm()
+        self._wait_for_refill(pool)
+        self.assertEqual(len(pool), 5)
+        self.assertEqual(self.backend.rpcs['allocate_ids'], 1)
+        self.assertEqual(self.backend.allocate_ids('Order', 2), [6, 7])
+
+    def testSynchronous(self):
+        backend = backends.MemoryBackend()
+        backend.thread_safe = False
+        backends.set_backend(backend)
+
+        # Blocks are reserved on the calling thread, and only once the pool is empty
+        pool = ids.IdPool('Order', block_size=3)
+        self.assertEqual([pool.next() for _ in range(3)], [1, 2, 3])
+        self.assertEqual((len(pool), pool._refilling, backend.rpcs['allocate_ids']), (0, False, 1))
+        self.assertEqual(pool.next(), 4)
+        self.assertEqual(backend.rpcs['allocate_ids'], 2)
+        pool.warm()
+        self.assertEqual(backend.rpcs['allocate_ids'], 2)
+
+    def testAllocatedIdProperty(self):
+        class Invoice(model.Model):
+            id = properties.AllocatedIdProperty(block_size=20)
+            total = properties.FloatProperty()
+
+        self.assertIsInstance(Invoice.id.pool, ids.IdPool)
+        self.assertEqual(Invoice.id.pool.kind, 'Invoice')
+
+        invoices = [Invoice(total=float(i)) for i in range(25)]
+        self.assertEqual([i.key.id for i in invoices], range(1, 26))
+        self.assertEqual([i.id for i in invoices], range(1, 26))
+        self._wait_for_refill(Invoice.id.pool)
+        self.assertEqual(self.backend.rpcs['allocate_ids'], 2)
+
+        model.Model.save_multi(invoices)
+        self.assertEqual(Invoice.get_by_id(25).total, 24.0)
+        self.assertEqual(Invoice(id=1000).key.id, 1000)
@@ -0,0 +1,116 @@
+import datetime
+import unittest2
+
+from StringIO import StringIO
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends, loader, model, properties
+
+from test_model import _DATASET_ID
+
+
+class Reading(model.Model):
+    id = properties.IntegerProperty()
+    sensor = properties.TextProperty(indexed=True)
+    value = properties.FloatProperty()
+    valid = properties.BooleanProperty()
+    taken = properties.DateTimeProperty()
+    day = properties.DateProperty()
+    extra = properties.JsonProperty()
+
+
+class _FailingBackend(backends.MemoryBackend):
+    """Fails any put that includes the entity with id 13."""
+    def put(self, entities):
+        if any(e.key.id_or_name == 13 for e in entities):
+            raise RuntimeError('write failed')
+        super(_FailingBackend, self).put(entities)
+
+
+class TestLoader(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.backend = backends.MemoryBackend()
+        backends.set_backend(self.backend)
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def _rows(self, count):
+        return ({'id': i, 'sensor': u'sensor %d' % (i % 3), 'value': i / 2.0} for i in xrange(1, count + 1))
+
+    def testLoad(self):
+        errors = []
+        log = StringIO()
+        rows = list(self._rows(95))
+        rows[9]['value'] = 'not a float'
+        stats = loader.load(Reading, rows, batch_size=10, concurrency=3, queue_size=2, on_error=errors.append,
+                            log=log)
+
+        self.assertEqual((stats.rows, stats.built, stats.written, stats.failed), (95, 94, 94, 1))
+        self.assertEqual(stats.errors, errors)
+        self.assertEqual(errors[0].number, 10)
+        self.assertEqual(errors[0].stage, 'build')
+        self.assertIs(errors[0].row, rows[9])
+        self.assertIn('94 written', log.getvalue())
+        self.assertGreater(stats.to_dict()['rate'], 0)
+
+        self.assertEqual(len(self.backend), 94)
+        self.assertEqual(self.backend.rpcs['put'], 10)
+        self.assertEqual(Reading.get_by_id(95).value, 47.5)
+
+    def testProcesses(self):
+        rows = list(self._rows(50))
+        rows[4]['id'] = 'five'
+        stats = loader.load(Reading, rows, batch_size=7, processes=2)
+        self.assertEqual((stats.written, stats.failed), (49, 1))
+        self.assertEqual(stats.errors[0].number, 5)
+
+        reading = Reading.get_by_id(50)
+        self.assertEqual((reading.sensor, reading.value), (u'sensor 2', 25.0))
+        self.assertEqual(len(self.backend), 49)
+
+    def testInstancesAndParse(self):
+        existing = Reading(id=100, value=1.0)
+        stats = loader.load(Reading, [existing, 'bad', '7,3.5'], parse=lambda row: dict(
+            zip(('id', 'value'), (int(row.split(',')[0]), float(row.split(',')[1])))))
+        self.assertEqual((stats.written, stats.failed), (2, 1))
+        self.assertEqual(stats.errors[0].stage, 'parse')
+        self.assertEqual(Reading.get_by_id(7).value, 3.5)
+        self.assertEqual(Reading.get_by_id(100).value, 1.0)
+
+    def testWriteFailure(self):
+        backends.set_backend(_FailingBackend())
+        stats = loader.load(Reading, self._rows(30), batch_size=10)
+        self.assertEqual((stats.written, stats.failed), (20, 10))
+        self.assertEqual(sorted(e.number for e in stats.errors), range(11, 21))
+        self.assertTrue(all(e.stage == 'write' for e in stats.errors))
+
+    def testReadFailure(self):
+        def rows():
+            for row in self._rows(20):
+                yield row
+            raise IOError('read failed')
+
+        with self.assertRaises(IOError):
+            loader.load(Reading, rows(), batch_size=5)
+
+    def testCSV(self):
+        data = StringIO('id,sensor,value,valid,taken,day,extra,unused\n'
+                        '1,s\xc3\xa9,1.5,true,2015-01-02T03:04:05,2015-01-02,"{""a"": 1}",x\n'
+                        '2,,,no,,,,\n'
+                        '3,s,x,,,,,\n')
+        stats = loader.load_csv(Reading, data)
+        self.assertEqual((stats.written, stats.failed), (2, 1))
+        self.assertEqual(stats.errors[0].stage, 'parse')
+
+        first, second = Reading.filter([1, 2])
+        self.assertEqual(first.sensor, u's\xe9')
+        self.assertEqual(first.value, 1.5)
+        self.assertIs(first.valid, True)
+        self.assertEqual(first.taken, datetime.datetime(2015, 1, 2, 3, 4, 5))
+        self.assertEqual(first.day, datetime.date(2015, 1, 2))
+        self.assertEqual(first.extra, {'a': 1})
+        self.assertIsNone(second.sensor)
+        self.assertIs(second.valid, False)
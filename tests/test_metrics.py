@@ -0,0 +1,96 @@
+import unittest2
+
+from gcloud.datastore import set_default_dataset_id
+
+from gcloudorm import backends, metrics, model, properties
+
+from test_model import _DATASET_ID
+
+
+class TestMetrics(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        backends.set_backend(backends.MemoryBackend())
+        metrics.registry().reset()
+
+        class Note(model.Model):
+            title = properties.TextProperty(indexed=True)
+            body = properties.JsonProperty()
+        self.Note = Note
+
+    def tearDown(self):
+        metrics.disable()
+        backends.set_backend(None)
+
+    def testDisabled(self):
+        self.assertFalse(metrics.active)
+        self.assertNotIn('_from_base_type', self.Note.body.__dict__)
+        note = self.Note(title=u'a', body={'a': 1})
+        note.save()
+        self.Note.get_by_id(note.id)
+        self.assertEqual(metrics.registry().snapshot(), {})
+
+    def testEnabled(self):
+        calls = []
+        metrics.add_hook(lambda *args: calls.append(args[:2]))
+        self.addCleanup(metrics.remove_hook, metrics._hooks[-1])
+        metrics.enable()
+        self.assertTrue(metrics.is_enabled())
+
+        notes = [self.Note(id=i, title=u'note %d' % i, body={'i': i}) for i in range(1, 4)]
+        notes[0].save()
+        model.Model.save_multi(notes[1:])
+        self.assertEqual(self.Note.get_by_id(1).body, {'i': 1})
+        self.assertEqual(len(self.Note.filter([1, 2, 5])), 2)
+        self.assertEqual(len(list(self.Note.query().fetch(page_size=2))), 3)
+        model.Model.delete_multi(notes[1:])
+        notes[0].delete()
+
+        stats = metrics.registry().snapshot()['Note']
+        for operation, calls_, entities in [('save', 1, 1), ('save_multi', 1, 2), ('get_by_id', 1, 1),
+                                            ('filter', 1, 2), ('query', 2, 3), ('delete_multi', 1, 2),
+                                            ('delete', 1, 1)]:
+            self.assertEqual((stats[operation]['calls'], stats[operation]['entities']), (calls_, entities), operation)
+            self.assertEqual(sum(stats[operation]['histogram']), calls_)
+        self.assertGreater(stats['save']['bytes'], 0)
+        self.assertEqual(stats['delete']['bytes'], 0)
+        self.assertEqual(stats['encode.body']['calls'], 3)
+        self.assertEqual(stats['decode.body']['calls'], 1)
+        self.assertNotIn('encode.id', stats)  # Properties that don't convert values aren't timed
+        self.assertIn(('Note', 'save'), calls)
+
+        # Models defined while enabled are instrumented too
+        class Later(model.Model):
+            data = properties.PickleProperty()
+        Later(data=[1]).save()
+        self.assertEqual(metrics.registry().get('Later', 'encode.data').calls, 1)
+
+        metrics.disable()
+        self.assertFalse(metrics.active)
+        self.assertNotIn('_to_base_type', self.Note.body.__dict__)
+        notes[0].save(force=True)
+        self.assertEqual(metrics.registry().get('Note', 'save').calls, 1)
+
+    def testCapture(self):
+        note = self.Note(title=u'a', body={})
+        with metrics.capture() as outer:
+            self.assertTrue(metrics.active)
+            note.save()
+            with metrics.capture() as inner:
+                self.Note.get_by_id(note.id)
+        self.assertFalse(metrics.active)
+
+        self.assertEqual(sorted(outer.snapshot()['Note']), ['get_by_id', 'save'])
+        self.assertEqual(sorted(inner.snapshot()['Note']), ['get_by_id'])
+        self.assertEqual(metrics.registry().snapshot(), {})
+
+    def testStats(self):
+        stats = metrics.Stats()
+        self.assertIsNone(stats.percentile(50))
+        for seconds in (0.0002, 0.0002, 0.003, 20):
+            stats.add(seconds, 1, 10)
+        self.assertEqual(stats.percentile(50), 0.0005)
+        self.assertEqual(stats.percentile(75), 0.005)
+        self.assertIsNone(stats.percentile(100))
+        self.assertEqual(stats.to_dict()['histogram'][-1], 1)
+        self.assertEqual(stats.bytes, 40)
@@ -1,6 +1,7 @@
 import six
 import unittest2
 
+from gcloud.datastore import _datastore_v1_pb2 as datastore_pb
 from gcloud.datastore import helpers, key, set_default_dataset_id, set_default_connection
 
 from gcloudorm import model, properties
@@ -75,6 +76,369 @@ class TestModel(unittest2.TestCase):
         self.assertEqual(connection._saved, (_DATASET_ID, 'KEY', {'test_value': '123'}, ()))
         self.assertEqual(key._path, None)
 
+    def testSaveMulti(self):
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_value = properties.TextProperty()
+
+        class OtherModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        instances = [TestModel(test_value=six.text_type(i)) for i in range(5)] + [OtherModel(test_int=1)]
+        keys = model.Model.save_multi(instances, batch_size=2)
+
+        self.assertEqual(keys, [i.key for i in instances])
+        self.assertEqual(connection._commits, 3)
+        self.assertEqual(len(connection._store), 6)
+        self.assertEqual(TestModel.get_by_id(instances[3].id).test_value, u'3')
+        self.assertEqual(OtherModel.get_by_id(instances[5].id).test_int, 1)
+
+        with self.assertRaises(ValueError):
+            model.Model.save_multi(instances, batch_size=0)
+
+    def testDeleteMulti(self):
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_value = properties.TextProperty()
+
+        class OtherModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        instances = [TestModel(test_value=u'a') for _ in range(4)]
+        other = OtherModel(test_int=1)
+        model.Model.save_multi(instances + [other])
+
+        keys = TestModel.delete_multi([instances[0], instances[1].key, instances[2].id, other], batch_size=3)
+
+        self.assertEqual(keys, [instances[0].key, instances[1].key, key.Key('TestModel', instances[2].id), other.key])
+        self.assertEqual(connection._commits, 1 + 2)
+        self.assertEqual(TestModel.filter([i.id for i in instances]), [instances[3]])
+        self.assertEqual(OtherModel.filter([other.id]), [])
+
+    def testFilter(self):
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        instances = [TestModel(test_int=i) for i in range(10)]
+        model.Model.save_multi(instances)
+        ids = [i.id for i in reversed(instances)] + ['missing']
+
+        connection._lookups = 0
+        self.assertEqual(TestModel.filter(ids), instances[::-1])
+        self.assertEqual(connection._lookups, 1)
+
+        connection._lookups = 0
+        self.assertEqual(TestModel.filter(ids, shard_size=3), instances[::-1])
+        self.assertEqual(connection._lookups, 4)
+
+        connection._lookups = 0
+        self.assertEqual(TestModel.filter(ids, shard_size=2, concurrency=3), instances[::-1])
+        self.assertEqual(connection._lookups, 6)
+
+        self.assertEqual(TestModel.filter([]), [])
+        with self.assertRaises(ValueError):
+            TestModel.filter(ids, shard_size=0, concurrency=2)
+
+    def testGetMulti(self):
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        class OtherModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        parent = TestModel(test_int=1)
+        child = OtherModel(parent=parent.key, test_int=2)
+        cached = OtherModel(test_int=3)
+        model.Model.save_multi([parent, child, cached])
+        OtherModel.enable_cache()
+
+        keys = [child.key, key.Key('TestModel', 'missing'), parent.key, cached.key]
+        connection._lookups = 0
+        results = model.get_multi(keys)
+        self.assertEqual(results, [child, None, parent, cached])
+        self.assertEqual([type(r) for r in results], [OtherModel, type(None), TestModel, OtherModel])
+        self.assertEqual(results[0].key.parent, parent.key)
+        self.assertEqual(connection._lookups, 2)
+
+        connection._lookups = 0
+        self.assertEqual(model.get_multi(keys), results)
+        self.assertEqual(connection._lookups, 1)
+
+        OtherModel.disable_cache()
+        connection._lookups = 0
+        self.assertEqual(model.get_multi(keys), results)
+        self.assertEqual(connection._lookups, 1)
+
+        self.assertEqual(model.get_multi([]), [])
+        with self.assertRaises(ValueError):
+            model.get_multi([key.Key('Unknown', 1)])
+
+    def testPrefetchRelated(self):
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class Author(model.Model):
+            name = properties.TextProperty(indexed=True)
+
+        class Book(model.Model):
+            title = properties.TextProperty(indexed=True)
+            author = properties.KeyProperty(kind=Author)
+            reviewers = properties.KeyProperty(kind=Author, repeated=True)
+
+        authors = [Author(name=u'author %d' % i) for i in range(3)]
+        books = [Book(title=u'book %d' % i, author=authors[i % 2], reviewers=[authors[2], authors[i % 2]])
+                 for i in range(4)]
+        books.append(Book(title=u'book 4', reviewers=[key.Key('Author', 'missing')]))
+        model.Model.save_multi(authors + books)
+
+        connection._lookups = 0
+        results = Book.filter([b.id for b in books], prefetch_related=['author', 'reviewers'])
+        self.assertEqual(connection._lookups, 2)
+        self.assertEqual([b.related('author') for b in results], [authors[0], authors[1]] * 2 + [None])
+        self.assertEqual(results[1].related('reviewers'), [authors[2], authors[1]])
+        self.assertEqual(results[4].related('reviewers'), [None])
+        self.assertIs(results[0].related('author'), results[2].related('author'))
+        self.assertEqual(connection._lookups, 2)
+
+        # Changing a reference fetches it again
+        results[0].author = authors[2]
+        self.assertEqual(results[0].related('author'), authors[2])
+        results[1].reviewers.append(authors[0])
+        self.assertEqual(results[1].related('reviewers'), [authors[2], authors[1], authors[0]])
+        self.assertEqual(connection._lookups, 4)
+
+        # Without prefetching each instance fetches its own
+        connection._lookups = 0
+        book = Book.get_by_id(books[3].id)
+        self.assertEqual(book.related('author'), authors[1])
+        self.assertEqual(connection._lookups, 2)
+
+        results = list(Book.query().filter('title', '<', u'book 2').order('title').fetch(
+            page_size=1, prefetch_related=['author']))
+        self.assertEqual([b.related('author') for b in results], authors[:2])
+
+        with self.assertRaises(ValueError):
+            book.related('title')
+        with self.assertRaises(ValueError):
+            Book.filter([book.id], compact=True, prefetch_related=['author'])
+        with self.assertRaises(ValueError):
+            Book.query().fetch(keys_only=True, prefetch_related=['author'])
+
+    def testCache(self):
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        class OtherModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        instances = [TestModel(test_int=i) for i in range(4)]
+        model.Model.save_multi(instances)
+        cache = TestModel.enable_cache(max_size=3)
+        self.assertIsNone(OtherModel._cache)
+
+        connection._lookups = 0
+        first = TestModel.get_by_id(instances[0].id)
+        self.assertEqual(TestModel.get_by_id(instances[0].id), first)
+        self.assertEqual(connection._lookups, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Each read gets its own copy, so unsaved changes stay with the caller that made them
+        first.test_int = 100
+        second = TestModel.get_by_id(instances[0].id)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.test_int, 0)
+        self.assertFalse(second.is_dirty)
+        first.test_int = 0
+        first._changed.clear()
+
+        # Only the misses are fetched
+        connection._lookups = 0
+        result = TestModel.filter([i.id for i in instances[:3]] + ['missing'])
+        self.assertEqual(result, instances[:3])
+        self.assertEqual(result[0], first)
+        self.assertEqual(connection._lookups, 1)
+        self.assertEqual(cache.evictions, 0)
+        TestModel.get_by_id(instances[3].id)
+        self.assertEqual(cache.evictions, 1)
+
+        # Saving and deleting invalidates
+        first.test_int = 10
+        first.save()
+        self.assertNotIn(first.key.flat_path, cache)
+        self.assertEqual(TestModel.get_by_id(first.id).test_int, 10)
+        TestModel.delete_multi([first.id])
+        with self.assertRaises(model.ObjectDoesNotExist):
+            TestModel.get_by_id(first.id)
+
+        TestModel.disable_cache()
+        self.assertIsNone(TestModel._cache)
+
+    def testFromEntity(self):
+        from gcloud.datastore import entity
+
+        calls = []
+
+        class TestModel(model.Model):
+            test_value = properties.TextProperty(default=lambda: calls.append(1) or u'default')
+            test_int = properties.IntegerProperty()
+
+        e = entity.Entity(key.Key('ParentModel', 'foo', 'TestModel', 'abc'))
+        e.update({'test_value': u'stored', 'unknown': 1})
+        m = TestModel.from_entity(e)
+
+        self.assertIs(m.key, e.key)
+        self.assertIs(m._key, e.key)
+        self.assertEqual(m.id, 'abc')
+        self.assertEqual(m.test_value, u'stored')
+        self.assertIsNone(m.test_int)
+        self.assertNotIn('unknown', m)
+        self.assertEqual(m.exclude_from_indexes, TestModel._model_exclude_from_indexes)
+        self.assertEqual(calls, [])
+
+    def testCompiledCodecs(self):
+        import datetime
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty(default=3)
+            test_choice = properties.TextProperty(choices=[u'a', u'b'], default=u'a')
+            test_validated = properties.IntegerProperty(validator=lambda prop, value: value * 2)
+            test_date = properties.DateProperty(default=datetime.date(2015, 1, 2))
+            test_pickle = properties.PickleProperty(compressed=True)
+            test_repeated = properties.TextProperty(repeated=True)
+
+        values = {'id': 'abc', 'test_validated': 2, 'test_pickle': {'a': 1}, 'test_repeated': ['x'], 'unknown': 1}
+        stored = TestModel._encode_values(values)
+        m = TestModel(**values)
+        self.assertEqual(stored, dict(m))
+        self.assertEqual(stored['test_int'], 3)
+        self.assertEqual(stored['test_validated'], 4)
+        self.assertEqual(stored['test_date'], datetime.datetime(2015, 1, 2))
+
+        with self.assertRaises(AssertionError):
+            TestModel._encode_values({'test_choice': u'c'})
+        with self.assertRaises(AssertionError):
+            TestModel._encode_values({'test_repeated': u'x'})
+
+        memo = {}
+        decoded = TestModel._decode_values(stored, memo)
+        self.assertEqual(decoded, {'id': 'abc', 'test_int': 3, 'test_choice': u'a', 'test_validated': 4,
+                                   'test_date': datetime.date(2015, 1, 2), 'test_pickle': {'a': 1},
+                                   'test_repeated': [u'x']})
+        self.assertIs(TestModel._decode_values(stored, memo)['test_pickle'], decoded['test_pickle'])
+        self.assertEqual(TestModel._decode_values({}, {})['test_repeated'], [])
+
+        # to_dict shares memoized values with attribute access
+        self.assertIs(m.to_dict()['test_pickle'], m.test_pickle)
+
+    def testAsync(self):
+        from gcloudorm import futures
+
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty()
+
+        instances = [TestModel(test_int=i) for i in range(6)]
+        futures.wait_all([instances[0].save_async(), TestModel.save_multi_async(instances[1:], batch_size=2)])
+        self.assertEqual(len(connection._store), 6)
+
+        lookups = [TestModel.get_by_id_async(i.id) for i in instances[:3]] + \
+            [TestModel.filter_async([i.id for i in instances[3:]], shard_size=1)]
+        self.assertEqual(futures.wait_all(lookups), instances[:3] + [instances[3:]])
+
+        futures.wait_all([instances[0].delete_async(), TestModel.delete_multi_async(instances[1:3])])
+        self.assertEqual(len(connection._store), 3)
+        with self.assertRaises(model.ObjectDoesNotExist):
+            TestModel.get_by_id_async(instances[0].id).get_result()
+
+    def testDirtyTracking(self):
+        import datetime
+
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty()
+            test_json = properties.JsonProperty()
+            created = properties.DateTimeProperty(auto_now_add=True)
+            updated = properties.DateTimeProperty(auto_now=True)
+
+        m = TestModel(test_int=1, test_json={'a': 1})
+        self.assertTrue(m.is_dirty)
+        self.assertIsNone(m.created)
+        m.save()
+        self.assertFalse(m.is_dirty)
+        self.assertIsInstance(m.created, datetime.datetime)
+        self.assertIsInstance(m.updated, datetime.datetime)
+        self.assertEqual(connection._commits, 1)
+
+        loaded = TestModel.get_by_id(m.id)
+        self.assertFalse(loaded.is_dirty)
+        self.assertEqual(loaded.changed_fields, frozenset())
+        loaded.test_json  # Reading doesn't change anything
+        loaded.save()
+        TestModel.save_multi([loaded, m])
+        self.assertEqual(connection._commits, 1)
+
+        created, updated = loaded.created, loaded.updated
+        loaded.test_json['b'] = 2
+        self.assertEqual(loaded.changed_fields, frozenset(['test_json']))
+        loaded.save()
+        self.assertEqual(connection._commits, 2)
+        self.assertEqual(loaded.created, created)
+        self.assertGreaterEqual(loaded.updated, updated.replace(tzinfo=None))
+        self.assertEqual(TestModel.get_by_id(m.id).test_json, {'a': 1, 'b': 2})
+
+        del loaded.test_int
+        self.assertEqual(loaded.changed_fields, frozenset(['test_int']))
+        TestModel.save_multi([loaded, m])
+        self.assertEqual(connection._commits, 3)
+        self.assertFalse(loaded.is_dirty)
+
+        loaded.save(force=True)
+        self.assertEqual(connection._commits, 4)
+
+    def testCopy(self):
+        import copy
+
+        connection = _MemoryConnection()
+        set_default_connection(connection)
+
+        class TestModel(model.Model):
+            test_int = properties.IntegerProperty()
+            test_list = properties.IntegerProperty(repeated=True)
+
+        TestModel(id=1, test_int=1, test_list=[1]).save()
+        m = TestModel.get_by_id(1)
+        m.test_int = 2
+        m.test_list
+        for other in (copy.copy(m), copy.deepcopy(m)):
+            self.assertEqual(other.key, m.key)
+            self.assertEqual(other.changed_fields, frozenset(['test_int']))
+            other.test_list.append(2)
+            other.save()
+            self.assertEqual(m.changed_fields, frozenset(['test_int']))
+            self.assertEqual(m.test_list, [1])
+
+        commits = connection._commits
+        m.save()
+        self.assertEqual(connection._commits, commits + 1)
+        self.assertEqual(TestModel.get_by_id(1).test_list, [1])
+
 
 _MARKER = object()
 _DATASET_ID = 'DATASET'
@@ -146,3 +510,90 @@ class _Transaction(object):
 
     def add_auto_id_entity(self, entity):
         self._added += (entity,)
+
+
+def _path_of(key_pb):
+    return tuple((e.kind, e.id if e.HasField('id') else e.name) for e in key_pb.path_element)
+
+
+_OPERATORS = {
+    datastore_pb.PropertyFilter.EQUAL: lambda a, b: a == b,
+    datastore_pb.PropertyFilter.LESS_THAN: lambda a, b: a < b,
+    datastore_pb.PropertyFilter.LESS_THAN_OR_EQUAL: lambda a, b: a <= b,
+    datastore_pb.PropertyFilter.GREATER_THAN: lambda a, b: a > b,
+    datastore_pb.PropertyFilter.GREATER_THAN_OR_EQUAL: lambda a, b: a >= b,
+}
+
+
+def _values_of(entity_pb, name):
+    for property_pb in entity_pb.property:
+        if property_pb.name == name:
+            value = helpers._get_value_from_property_pb(property_pb)
+            return value if isinstance(value, list) else [value]
+    return []
+
+
+class _MemoryConnection(object):
+    """An in-memory stand-in for :class:`gcloud.datastore.connection.Connection`."""
+    def __init__(self):
+        self._store = {}
+        self._lookups = self._commits = self._queries = 0
+
+    def run_query(self, dataset_id, query_pb, namespace=None, eventual=False, transaction_id=None):
+        self._queries += 1
+        kinds = set(k.name for k in query_pb.kind)
+        results = [e for _, e in sorted(self._store.items()) if e.key.path_element[-1].kind in kinds]
+
+        for filter_pb in query_pb.filter.composite_filter.filter:
+            filter_pb = filter_pb.property_filter
+            if filter_pb.operator == datastore_pb.PropertyFilter.HAS_ANCESTOR:
+                ancestor = _path_of(filter_pb.value.key_value)
+                results = [e for e in results if _path_of(e.key)[:len(ancestor)] == ancestor]
+            else:
+                op, value = _OPERATORS[filter_pb.operator], helpers._get_value_from_value_pb(filter_pb.value)
+                results = [e for e in results if any(op(v, value) for v in _values_of(e, filter_pb.property.name))]
+
+        for order_pb in reversed(query_pb.order):
+            results.sort(key=lambda e: _values_of(e, order_pb.property.name),
+                         reverse=order_pb.direction == order_pb.DESCENDING)
+
+        start = (int(query_pb.start_cursor) if query_pb.start_cursor else 0) + query_pb.offset
+        end = start + query_pb.limit if query_pb.HasField('limit') else len(results)
+        more = datastore_pb.QueryResultBatch.NOT_FINISHED if end < len(results) else \
+            datastore_pb.QueryResultBatch.NO_MORE_RESULTS
+        projection = [p.property.name for p in query_pb.projection]
+        if projection:
+            projected = []
+            for e in results[start:end]:
+                entity_pb = datastore_pb.Entity()
+                entity_pb.key.CopyFrom(e.key)
+                entity_pb.property.extend(p for p in e.property if p.name in projection)
+                projected.append(entity_pb)
+            return projected, str(min(end, len(results))), more, query_pb.offset
+
+        return results[start:end], str(min(end, len(results))), more, query_pb.offset
+
+    def lookup(self, dataset_id, key_pbs, eventual=False, transaction_id=None):
+        self._lookups += 1
+        found, missing = [], []
+        for key_pb in key_pbs:
+            entity_pb = self._store.get(_path_of(key_pb))
+            if entity_pb is None:
+                entity_pb = datastore_pb.Entity()
+                entity_pb.key.CopyFrom(key_pb)
+                missing.append(entity_pb)
+            else:
+                found.append(entity_pb)
+        found.reverse()  # The datastore doesn't return entities in the order they were requested
+        return found, missing, []
+
+    def commit(self, dataset_id, mutation_pb, transaction_id=None):
+        self._commits += 1
+        for entity_pb in mutation_pb.upsert:
+            stored = datastore_pb.Entity()
+            stored.CopyFrom(entity_pb)
+            stored.key.partition_id.dataset_id = dataset_id
+            self._store[_path_of(entity_pb.key)] = stored
+        for key_pb in mutation_pb.delete:
+            self._store.pop(_path_of(key_pb), None)
+        return datastore_pb.MutationResult()
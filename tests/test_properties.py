@@ -3,7 +3,14 @@ import unittest2
 
 from gcloud.datastore import helpers, key, set_default_dataset_id
 
-from gcloudorm import model, properties
+from gcloudorm import backends, model, properties
+
+
+class Tagged(model.Model):
+    id = properties.IntegerProperty()
+    tags = properties.IntegerProperty(repeated=True)
+    data = properties.JsonProperty(repeated=True)
+    extra = properties.JsonProperty()
 
 
 class TestProperties(unittest2.TestCase):
@@ -134,6 +141,10 @@ class TestProperties(unittest2.TestCase):
         m.test_datetime = utcnow
         self.assertEqual(m.test_datetime, utcnow)
 
+        # Unindexed unless asked for
+        self.assertFalse(TestModel.test_datetime.indexed)
+        self.assertTrue(properties.DateTimeProperty(indexed=True).indexed)
+
     def testDateProperty(self):
         import datetime
 
@@ -160,3 +171,235 @@ class TestProperties(unittest2.TestCase):
         m.test_time = t
 
         self.assertEqual(m.test_time, t)
+
+    def testKeyProperty(self):
+        class Author(model.Model):
+            name = properties.TextProperty()
+
+        class TestModel(model.Model):
+            test_key = properties.KeyProperty()
+            test_author = properties.KeyProperty(kind=Author)
+
+        author = Author(name=u'a')
+        m = TestModel(test_key=key.Key('Other', 1), test_author=author)
+        self.assertEqual(m.test_author, author.key)
+        self.assertEqual(TestModel.test_author.kind, 'Author')
+        m.test_author = author.key
+        self.assertEqual(m['test_author'], author.key)
+
+        with self.assertRaises(AssertionError):
+            m.test_author = key.Key('Other', 1)
+        with self.assertRaises(AssertionError):
+            m.test_key = key.Key('Other')
+        with self.assertRaises(AttributeError):
+            m.test_key = 'Other:1'
+
+    def testDecodedValuesAreMemoized(self):
+        class TestModel(model.Model):
+            test_pickle = properties.PickleProperty(compressed=True)
+            test_int = properties.IntegerProperty()
+
+        m = TestModel(test_pickle={'a': 1})
+        value = m.test_pickle
+        self.assertIs(m.test_pickle, value)
+
+        # Setting, deleting or replacing the stored value invalidates the memo
+        m.test_pickle = {'b': 2}
+        self.assertEqual(m.test_pickle, {'b': 2})
+        del m.test_pickle
+        self.assertIsNone(m.test_pickle)
+        m['test_pickle'] = TestModel.test_pickle.to_base_type({'c': 3})
+        self.assertEqual(m.test_pickle, {'c': 3})
+
+        # Properties that store their values as-is aren't memoized
+        m.test_int = 1
+        self.assertEqual(m.test_int, 1)
+        self.assertNotIn('test_int', m._decoded)
+
+    def testMutableValuesAreReencoded(self):
+        class TestModel(model.Model):
+            test_json = properties.JsonProperty()
+            test_text = properties.TextProperty()
+            test_repeated = properties.IntegerProperty(repeated=True)
+
+        m = TestModel(test_json={'a': 1}, test_text=u'abc', test_repeated=[1])
+        m.test_json['b'] = 2
+        m.test_repeated.append(2)
+        m.test_text
+        m._flush_decoded()
+
+        self.assertEqual(m['test_json'], TestModel.test_json.to_base_type({'a': 1, 'b': 2}))
+        self.assertEqual(m['test_repeated'], [1, 2])
+        self.assertEqual(m.test_json, {'a': 1, 'b': 2})
+
+        m.test_repeated.append('not an int')
+        with self.assertRaises(AssertionError):
+            m._flush_decoded()
+
+    def testRepeatedList(self):
+        calls = {'decode': 0, 'validate': 0}
+
+        class CountingProperty(properties.IntegerProperty):
+            def _from_base_type(self, value):
+                calls['decode'] += 1
+                return value
+
+            def _validate(self, value):
+                calls['validate'] += 1
+                return super(CountingProperty, self)._validate(value)
+
+        class TestModel(model.Model):
+            test_repeated = CountingProperty(repeated=True)
+            test_json = properties.JsonProperty(repeated=True)
+
+        m = TestModel.from_entity(TestModel(id='x', test_repeated=range(100), test_json=[{'a': 1}, {'b': 2}]))
+        stored = m['test_repeated']
+        values = m.test_repeated
+        self.assertIsInstance(values, properties.RepeatedList)
+        self.assertIs(m.test_repeated, values)
+        self.assertEqual(len(values), 100)
+        self.assertEqual((values[5], values[-1], values[2:4]), (5, 99, [2, 3]))
+        self.assertEqual(calls['decode'], 100)
+        m.test_repeated[5]
+        self.assertEqual(calls['decode'], 100)
+        self.assertFalse(m.is_dirty)
+
+        # Only added elements are validated, and the stored list is updated in place
+        calls['validate'] = 0
+        values.append(100)
+        values[0] = -1
+        del values[1]
+        values.insert(0, -2)
+        self.assertTrue(m.is_dirty)
+        self.assertEqual(calls['validate'], 3)
+        self.assertIs(m['test_repeated'], stored)
+        self.assertEqual(stored, [-2, -1] + range(2, 101))
+        self.assertIs(m.test_repeated, values)
+
+        values.sort(reverse=True)
+        values += [101]
+        m._flush_decoded()
+        self.assertEqual(calls['validate'], 4)
+        self.assertEqual(stored, range(100, 1, -1) + [-1, -2, 101])
+        self.assertEqual(values, stored)
+        self.assertNotEqual(values, stored[:-1])
+        self.assertEqual(values + [8], stored + [8])
+
+        values.append('not an int')
+        with self.assertRaises(AssertionError):
+            m._flush_decoded()
+        values.pop()
+
+        # Elements of mutable properties changed in place are re-encoded, and the list can be assigned elsewhere
+        m._changed.clear()
+        m.test_json[1]['c'] = 3
+        self.assertTrue(m.is_dirty)
+        self.assertEqual(TestModel.test_json.from_base_type(m['test_json'][1]), {'b': 2, 'c': 3})
+        other = TestModel(id='y', test_json=m.test_json)
+        self.assertEqual(other.test_json, [{'a': 1}, {'b': 2, 'c': 3}])
+        other.test_repeated = m.test_repeated
+        self.assertEqual(other['test_repeated'], stored)
+        self.assertEqual(m.to_dict()['test_json'], [{'a': 1}, {'b': 2, 'c': 3}])
+        self.assertIs(type(m.to_dict()['test_json']), list)
+
+    def testRepeatedListCopies(self):
+        import copy
+        import cPickle as pickle
+        import json
+
+        m = Tagged(id=1, tags=[1, 2], data=[{'a': 1}])
+        self.assertIsInstance(m.tags, list)
+        m.data[0]['b'] = 2
+
+        # Copies and pickles of the list, and of the instance, hold the decoded values
+        for tags in (copy.copy(m.tags), copy.deepcopy(m.tags), pickle.loads(pickle.dumps(m.tags, 2))):
+            self.assertIs(type(tags), list)
+            self.assertEqual(tags, [1, 2])
+        self.assertNotIn('gcloudorm', pickle.dumps(m.tags, 2))
+        self.assertEqual(json.loads(json.dumps(m.tags)), [1, 2])
+        for other in (copy.deepcopy(m), pickle.loads(pickle.dumps(m, 2)), pickle.loads(pickle.dumps(m))):
+            self.assertEqual(other.tags, [1, 2])
+            self.assertEqual(other.data, [{'a': 1, 'b': 2}])
+            other._changed.clear()
+            other.tags.append(3)
+            self.assertEqual(other.changed_fields, {'tags'})
+            self.assertEqual(other['tags'], [1, 2, 3])
+        self.assertEqual(m['tags'], [1, 2])
+
+        # The list can be stored as JSON
+        backends.set_backend(backends.MemoryBackend())
+        try:
+            m.extra = m.tags
+            m.save()
+            self.assertEqual(Tagged.get_by_id(1).extra, [1, 2])
+        finally:
+            backends.set_backend(None)
+
+    def testRepeatedNone(self):
+        from gcloud.datastore import entity
+        from gcloudorm.records import record_class
+
+        # The datastore drops empty lists, so entities can have None for a repeated property
+        e = entity.Entity(key.Key('Tagged', 1))
+        e.update({'id': 1, 'tags': None, 'data': None})
+        m = Tagged.from_entity(e)
+        self.assertEqual(m.to_dict()['tags'], [])
+        self.assertEqual(m.tags, [])
+        self.assertEqual(m.data, [])
+        self.assertEqual(record_class(Tagged).from_entity(e).tags, [])
+        self.assertFalse(m.is_dirty)
+
+        m.tags.append(1)
+        self.assertEqual(m.changed_fields, {'tags'})
+        self.assertEqual(m['tags'], [1])
+
+    def testCompressedProperties(self):
+        import zlib
+
+        class TestModel(model.Model):
+            test_blob = properties.BlobProperty(compressed=True, codec='bz2', min_size=10)
+            test_text = properties.TextProperty(compressed=True, level=9)
+            test_json = properties.JsonProperty(compressed=True, min_size=0)
+
+        m = TestModel(test_blob='x' * 100, test_text=u'\xe9' * 100, test_json={'a': 1})
+        self.assertEqual(m['test_blob'][:2], '\x00\x02')
+        self.assertIsInstance(m['test_text'], str)
+        self.assertEqual(m['test_json'][:2], '\x00\x01')
+        self.assertEqual(m.test_blob, 'x' * 100)
+        self.assertEqual(m.test_text, u'\xe9' * 100)
+        self.assertEqual(m.test_json, {'a': 1})
+
+        # Small values aren't compressed
+        m = TestModel(test_blob='x', test_text=u'short')
+        self.assertEqual(m['test_blob'], '\x00\x00x')
+        self.assertEqual(m['test_text'], u'short')
+        self.assertEqual(m.test_blob, 'x')
+        self.assertEqual(m.test_text, u'short')
+
+        # Values compressed with zlib before codecs existed still read
+        m['test_blob'] = zlib.compress('old')
+        m['test_json'] = zlib.compress('{"b": 2}')
+        self.assertEqual(m.test_blob, 'old')
+        self.assertEqual(m.test_json, {'b': 2})
+
+        # and aren't rewritten unless they change
+        legacy = m['test_json']
+        m._changed.clear()
+        self.assertFalse(m.is_dirty)
+        self.assertIs(m['test_json'], legacy)
+        m.test_json['c'] = 3
+        self.assertEqual(m.changed_fields, frozenset(['test_json']))
+        self.assertEqual(m['test_json'][:2], '\x00\x01')
+
+        class LegacyModel(model.Model):
+            test_json = properties.JsonProperty(compressed=True, repeated=True)
+
+        m = LegacyModel.from_entity(LegacyModel(id='x', test_json=[]))
+        m['test_json'] = [zlib.compress('[1]'), zlib.compress('[2]')]
+        m.test_json[1].append(3)
+        self.assertEqual(m.changed_fields, frozenset(['test_json']))
+        self.assertEqual(m['test_json'][0], zlib.compress('[1]'))
+        self.assertEqual(LegacyModel.test_json.from_base_type(m['test_json'][1]), [2, 3])
+
+        with self.assertRaises(ValueError):
+            properties.BlobProperty(compressed=True, codec='missing')
@@ -0,0 +1,120 @@
+import unittest2
+
+from gcloud.datastore import key, set_default_connection, set_default_dataset_id
+
+from gcloudorm import backends, futures, model, properties, query
+
+from test_model import _DATASET_ID, _MemoryConnection
+
+
+class TestQuery(unittest2.TestCase):
+    def setUp(self):
+        self._install()
+
+        class Person(model.Model):
+            name = properties.TextProperty(indexed=True)
+            age = properties.IntegerProperty()
+            bio = properties.TextProperty()
+        self.Person = Person
+
+        self.parent = key.Key('Family', 'smith')
+        self.people = [Person(name=u'person %d' % i, age=i % 5, parent=self.parent if i < 3 else None)
+                       for i in range(10)]
+        model.Model.save_multi(self.people)
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def _install(self):
+        set_default_dataset_id(_DATASET_ID)
+        self.connection = _MemoryConnection()
+        set_default_connection(self.connection)
+
+    def _queries(self):
+        return self.connection._queries
+
+    def testValidation(self):
+        q = self.Person.query()
+        with self.assertRaises(ValueError):
+            q.filter('missing', '=', 1)
+        with self.assertRaises(ValueError):
+            q.filter('bio', '=', u'unindexed')
+        with self.assertRaises(ValueError):
+            q.filter('age', '!=', 1)
+        with self.assertRaises(AssertionError):
+            q.filter('age', '=', 'not an int')
+        with self.assertRaises(ValueError):
+            q.order('-bio')
+        with self.assertRaises(ValueError):
+            q.fetch(page_size=0)
+
+        # Queries are immutable
+        filtered = q.filter('age', '=', 1).order('-name')
+        self.assertEqual(q.filters, ())
+        self.assertEqual(filtered.filters, (('age', '=', 1),))
+        self.assertEqual(filtered.orders, ('-name',))
+
+    def testFetch(self):
+        results = list(self.Person.query().filter('age', '>=', 3).order('-age', 'name'))
+        self.assertEqual([(p.age, p.name) for p in results],
+                         [(4, u'person 4'), (4, u'person 9'), (3, u'person 3'), (3, u'person 8')])
+        self.assertIsInstance(results[0], self.Person)
+        self.assertEqual(results[0].key, self.people[4].key)
+
+        self.assertEqual(self.Person.query().filter('name', '=', u'person 7').get(), self.people[7])
+        self.assertIsNone(self.Person.query().filter('age', '>', 10).get())
+
+    def testAncestor(self):
+        self.assertEqual(sorted(p.name for p in self.Person.query(ancestor=self.parent)),
+                         [u'person 0', u'person 1', u'person 2'])
+
+    def testPaging(self):
+        for prefetch in (True, False):
+            before = self._queries()
+            results = list(self.Person.query().order('name').fetch(page_size=3, prefetch=prefetch))
+            self.assertEqual([p.name for p in results], sorted(p.name for p in self.people))
+            self.assertEqual(self._queries() - before, 4)
+
+        # Pages are prefetched on the threads shared by bulk reads
+        pool = futures._read_pool
+        self.assertIsNotNone(pool)
+        list(self.Person.query().fetch(page_size=3, prefetch=True))
+        self.assertIs(futures._read_pool, pool)
+
+        q = self.Person.query().order('name')
+        self.assertFalse(q.fetch()._prefetch)
+        self.assertEqual(len(list(q.fetch(limit=4, page_size=3))), 4)
+        self.assertEqual(list(q.fetch(limit=0)), [])
+        self.assertEqual([p.name for p in q.fetch(limit=2, offset=5)], [u'person 5', u'person 6'])
+
+    def testCursor(self):
+        q = self.Person.query().order('name')
+        iterator = q.fetch(page_size=4)
+        first = []
+        for person in iterator:
+            first.append(person)
+            if len(first) == 4:
+                break
+        self.assertIsNone(iterator.cursor)
+
+        iterator = q.fetch(limit=4, page_size=4)
+        self.assertEqual(list(iterator), first)
+        rest = list(q.fetch(start_cursor=iterator.cursor, page_size=4))
+        self.assertEqual([p.name for p in first + rest], sorted(p.name for p in self.people))
+        self.assertIsInstance(q.fetch(), query.QueryIterator)
+
+    def testKeysOnly(self):
+        keys = list(self.Person.query().filter('age', '=', 1).order('name').fetch(keys_only=True))
+        self.assertEqual(keys, [self.people[1].key, self.people[6].key])
+
+    def testProjection(self):
+        results = list(self.Person.query().filter('age', '=', 2).order('name').fetch(projection=['name', 'age']))
+        self.assertEqual(results, [(self.people[2].key, u'person 2', 2), (self.people[7].key, u'person 7', 2)])
+        self.assertEqual(results[0].name, u'person 2')
+        self.assertEqual(results[0].age, 2)
+        self.assertEqual(type(results[0]).__name__, 'PersonProjection')
+
+        with self.assertRaises(ValueError):
+            self.Person.query().fetch(projection=['bio'])
+        with self.assertRaises(ValueError):
+            self.Person.query().fetch(projection=['name'], keys_only=True)
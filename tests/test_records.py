@@ -0,0 +1,74 @@
+import datetime
+import unittest2
+
+from gcloud.datastore import entity, key, set_default_dataset_id
+
+from gcloudorm import backends, model, properties, records
+
+from test_model import _DATASET_ID
+
+
+class TestRecords(unittest2.TestCase):
+    def setUp(self):
+        set_default_dataset_id(_DATASET_ID)
+        backends.set_backend(backends.MemoryBackend())
+
+        class Reading(model.Model):
+            name = properties.TextProperty(indexed=True)
+            value = properties.FloatProperty()
+            taken = properties.DateProperty()
+            data = properties.JsonProperty(compressed=True, min_size=0)
+            tags = properties.TextProperty(repeated=True)
+        self.Reading = Reading
+
+        self.readings = [Reading(name=u'reading %d' % i, value=i / 2.0, taken=datetime.date(2015, 1, i + 1),
+                                 data={'i': i}, tags=[u'a', u'b']) for i in range(3)]
+        model.Model.save_multi(self.readings)
+
+    def tearDown(self):
+        backends.set_backend(None)
+
+    def testAttributes(self):
+        record = self.Reading.filter([self.readings[1].id], compact=True)[0]
+        self.assertIsInstance(record, records.Record)
+        self.assertIs(type(record), records.record_class(self.Reading))
+        self.assertFalse(hasattr(record, '__dict__'))
+
+        original = self.readings[1]
+        for name in ('id', 'name', 'value', 'taken', 'data', 'tags'):
+            self.assertEqual(getattr(record, name), getattr(original, name), name)
+        self.assertEqual(record.key, original.key)
+        self.assertEqual(record.to_dict(), original.to_dict())
+
+        with self.assertRaises(AttributeError):
+            record.value = 10.0
+        with self.assertRaises(AttributeError):
+            del record.name
+
+    def testIdFromKey(self):
+        e = entity.Entity(key.Key('Reading', 'from-key'))
+        record = records.record_class(self.Reading).from_entity(e)
+        self.assertEqual(record.id, 'from-key')
+        self.assertIsNone(record.value)
+        self.assertEqual(record.tags, [])
+
+    def testToModel(self):
+        record = self.Reading.filter([self.readings[0].id], compact=True)[0]
+        instance = record.to_model()
+        self.assertIsInstance(instance, self.Reading)
+        self.assertEqual(instance, self.readings[0])
+        self.assertFalse(instance.is_dirty)
+
+        instance.value = 10.0
+        instance.save()
+        self.assertEqual(self.Reading.filter([record.id], compact=True)[0].value, 10.0)
+        self.assertEqual(record.value, 0.0)
+
+    def testQuery(self):
+        results = list(self.Reading.query().order('name').fetch(compact=True))
+        self.assertEqual([r.name for r in results], [u'reading 0', u'reading 1', u'reading 2'])
+        self.assertEqual(results, self.Reading.filter([r.id for r in self.readings], compact=True))
+        self.assertEqual(len(set(results)), 3)
+
+        with self.assertRaises(ValueError):
+            self.Reading.query().fetch(compact=True, keys_only=True)